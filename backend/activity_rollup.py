@@ -0,0 +1,246 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from model import db, UserSession, QuizAttempt, DailyActivity, DailyActiveUser, UserActivitySummary
+from db_utils import upsert_insert
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _session_contribution(values):
+    """Maps a user_sessions row to (day, DailyActivity deltas), bucketed by login date."""
+    duration = values['session_duration_seconds']
+    return _as_date(values['login_at']), {
+        'sessions_started': 1,
+        'completed_sessions': 1 if duration is not None else 0,
+        'session_duration_total': duration or 0
+    }
+
+
+def _attempt_contribution(values):
+    """Maps a quiz_attempts row to (day, DailyActivity deltas), bucketed by start date."""
+    return _as_date(values['started_at']), {
+        'quiz_attempts': 1,
+        'quiz_score_total': values['score_earned'] or 0,
+        'quiz_time_total': values['time_taken_seconds'] or 0
+    }
+
+
+# Rows that feed the rollups: the columns read and how a row contributes.
+_TRACKED = {
+    UserSession: (('login_at', 'session_duration_seconds'), _session_contribution),
+    QuizAttempt: (('started_at', 'score_earned', 'time_taken_seconds'), _attempt_contribution),
+}
+
+
+def _add(deltas, contribution, sign):
+    day, metrics = contribution
+    if day is None:
+        return
+    for name, amount in metrics.items():
+        deltas[day][name] += sign * amount
+
+
+def _old_values(session, obj, names):
+    """Returns the column values of obj as they are stored, before this flush."""
+    state = inspect(obj)
+    values = {}
+    for name in names:
+        history = state.attrs[name].history
+        if history.deleted:
+            values[name] = history.deleted[0]
+        elif history.unchanged:
+            values[name] = history.unchanged[0]
+        elif not history.added:
+            values[name] = getattr(obj, name)
+        else:
+            break
+    else:
+        return values
+
+    # The attribute was overwritten without its old value being loaded
+    table = state.mapper.local_table
+    row = session.connection().execute(
+        select(*[table.c[name] for name in names]).where(state.mapper.primary_key[0] == state.identity[0])
+    ).first()
+    return dict(zip(names, row))
+
+
+def _write_rollups(connection, deltas, active_users):
+    """
+    Applies the deltas with single-statement upserts, so concurrent flushes
+    for the same day add to one row instead of racing to insert it.
+    """
+    activity = DailyActivity.__table__
+    for day, metrics in deltas.items():
+        metrics = {name: amount for name, amount in metrics.items() if amount}
+        if not metrics:
+            continue
+        statement = upsert_insert(activity, connection).values(activity_date=day, **metrics)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[activity.c.activity_date],
+            set_={name: activity.c[name] + amount for name, amount in metrics.items()}
+        ))
+
+    active = DailyActiveUser.__table__
+    for day, user_id in active_users:
+        connection.execute(upsert_insert(active, connection).values(
+            activity_date=day, user_id=user_id
+        ).on_conflict_do_nothing(index_elements=[active.c.activity_date, active.c.user_id]))
+
+
+@event.listens_for(Session, 'before_flush')
+def _retract_changed_activity(session, flush_context, instances):
+    """Takes the stored values of changed or deleted rows back out of their rollups."""
+    deltas = session.info.setdefault('activity_deltas', defaultdict(lambda: defaultdict(int)))
+    changed = session.info.setdefault('activity_changed', [])
+    for obj in session.deleted:
+        entry = _TRACKED.get(type(obj))
+        if entry:
+            names, contribution = entry
+            _add(deltas, contribution(_old_values(session, obj, names)), -1)
+    for obj in session.dirty:
+        entry = _TRACKED.get(type(obj))
+        if not entry:
+            continue
+        names, contribution = entry
+        state = inspect(obj)
+        if any(state.attrs[name].history.has_changes() for name in names):
+            _add(deltas, contribution(_old_values(session, obj, names)), -1)
+            changed.append(obj)
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_activity(session, flush_context):
+    """Adds new and updated rows to their rollups, in the same transaction as the rows themselves."""
+    deltas = session.info.pop('activity_deltas', None)
+    changed = session.info.pop('activity_changed', [])
+    if deltas is None:
+        return
+    active_users = set()
+    for obj in list(session.new) + changed:
+        entry = _TRACKED.get(type(obj))
+        if not entry:
+            continue
+        names, contribution = entry
+        day, metrics = contribution({name: getattr(obj, name) for name in names})
+        _add(deltas, (day, metrics), 1)
+        if isinstance(obj, UserSession) and obj in session.new and day is not None:
+            active_users.add((day, obj.user_id))
+    if deltas or active_users:
+        _write_rollups(session.connection(), deltas, active_users)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_activity(session, previous_transaction):
+    session.info.pop('activity_deltas', None)
+    session.info.pop('activity_changed', None)
+
+
+def rebuild_activity_rollups():
+    """Recomputes daily_activity and daily_active_users from the session and quiz attempt history."""
+    deltas = defaultdict(lambda: defaultdict(int))
+    active_users = set()
+    for model, (names, contribution) in _TRACKED.items():
+        columns = [getattr(model, name) for name in names]
+        if model is UserSession:
+            columns.append(UserSession.user_id)
+        for row in db.session.query(*columns).yield_per(1000):
+            day, metrics = contribution(dict(zip(names, row)))
+            _add(deltas, (day, metrics), 1)
+            if model is UserSession and day is not None:
+                active_users.add((day, row[-1]))
+
+    DailyActivity.query.delete()
+    DailyActiveUser.query.delete()
+    if deltas:
+        db.session.execute(insert(DailyActivity), [
+            {'activity_date': day, **metrics} for day, metrics in deltas.items()
+        ])
+    if active_users:
+        db.session.execute(insert(DailyActiveUser), [
+            {'activity_date': day, 'user_id': user_id} for day, user_id in active_users
+        ])
+    db.session.commit()
+
+
+def get_activity_totals():
+    """Returns the DailyActivity columns summed over all days, as a single row."""
+    return db.session.query(
+        func.coalesce(func.sum(DailyActivity.completed_sessions), 0).label('completed_sessions'),
+        func.coalesce(func.sum(DailyActivity.session_duration_total), 0).label('session_duration_total'),
+        func.coalesce(func.sum(DailyActivity.quiz_attempts), 0).label('quiz_attempts'),
+        func.coalesce(func.sum(DailyActivity.quiz_score_total), 0).label('quiz_score_total'),
+        func.coalesce(func.sum(DailyActivity.quiz_time_total), 0).label('quiz_time_total')
+    ).one()
+
+
+def count_active_users(day):
+    return db.session.query(func.count(DailyActiveUser.user_id)).filter(DailyActiveUser.activity_date == day).scalar()
+
+
+# --- Per-user summaries ---
+
+def _parse_date(value):
+    # date() comes back as text on SQLite
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def compute_user_summary(user_id):
+    """
+    Builds a (transient) UserActivitySummary with two grouped queries: quiz
+    attempt aggregates, and completed session time per login day. The streak
+    is read off the per-day rows newest first, so neither query nor scan grows
+    with the number of sessions, only with the number of active days.
+    """
+    attempts, average_score, quiz_time = db.session.query(
+        func.count(QuizAttempt.attempt_id),
+        func.avg(QuizAttempt.score_earned),
+        func.sum(QuizAttempt.time_taken_seconds)
+    ).filter(QuizAttempt.user_id == user_id).one()
+
+    login_day = func.date(UserSession.login_at)
+    days = db.session.query(login_day, func.sum(UserSession.session_duration_seconds)).filter(
+        UserSession.user_id == user_id,
+        UserSession.session_duration_seconds.isnot(None)
+    ).group_by(login_day).order_by(login_day.desc()).all()
+    active_dates = [_parse_date(day) for day, _ in days]
+
+    streak = 0
+    for previous, day in zip([None] + active_dates, active_dates):
+        if previous is not None and previous - day != timedelta(days=1):
+            break
+        streak += 1
+
+    return UserActivitySummary(
+        user_id=user_id,
+        quiz_attempts=attempts or 0,
+        quiz_average_score=average_score or 0,
+        quiz_time_seconds=quiz_time or 0,
+        session_time_seconds=sum(total for _, total in days),
+        active_days=len(active_dates),
+        last_active_date=active_dates[0] if active_dates else None,
+        streak_days=streak
+    )
+
+
+def refresh_user_summary(user_id):
+    """Recomputes the user's stored summary in the current transaction. Called on logout and quiz evaluation."""
+    return db.session.merge(compute_user_summary(user_id))
+
+
+def get_user_summary(user_id):
+    """Returns the stored summary, or computes one (without storing it) for users who have none yet."""
+    return UserActivitySummary.query.get(user_id) or compute_user_summary(user_id)
+
+
+def current_streak(summary, today):
+    """The streak only counts while its last active day is today or yesterday."""
+    if summary.last_active_date in (today, today - timedelta(days=1)):
+        return summary.streak_days
+    return 0
@@ -0,0 +1,160 @@
+import atexit
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import bindparam, select
+from model import db, QuizAttempt, QuestionAttempt
+from db_utils import upsert_insert
+
+
+class AnswerBuffer:
+    """
+    Write-behind buffer for quiz autosaves. Answers are held in memory keyed by
+    (attempt_id, question_id), so repeated clicks on the same question collapse
+    to the last value, and are written to question_attempts in batches.
+
+    The buffer belongs to one process and answers are acknowledged before they
+    are written, so a crash loses whatever is pending and other worker
+    processes cannot see it. Only use it with a single worker process.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def add(self, attempt_id, user_id, question_id, selected_answer, is_correct, attempted_at):
+        """Queues an answer, replacing any earlier one for the same question. Returns the pending count."""
+        with self._lock:
+            self._pending[(attempt_id, question_id)] = {
+                'attempt_id': attempt_id,
+                'user_id': user_id,
+                'question_id': question_id,
+                'selected_answer': selected_answer,
+                'is_correct': is_correct,
+                'attempted_at': attempted_at
+            }
+            return len(self._pending)
+
+    def pending_for(self, attempt_id):
+        """Returns {question_id: selected_answer} for answers of an attempt not yet written."""
+        with self._lock:
+            return {
+                question_id: entry['selected_answer']
+                for (pending_attempt_id, question_id), entry in self._pending.items()
+                if pending_attempt_id == attempt_id
+            }
+
+    def take(self, attempt_id=None):
+        """Removes and returns the pending answers of one attempt, or of all attempts."""
+        with self._lock:
+            keys = [key for key in self._pending if attempt_id is None or key[0] == attempt_id]
+            return [self._pending.pop(key) for key in keys]
+
+    def requeue(self, entries):
+        """Puts back answers whose write failed, unless a newer answer arrived meanwhile."""
+        with self._lock:
+            for entry in entries:
+                self._pending.setdefault((entry['attempt_id'], entry['question_id']), entry)
+
+    def flush(self):
+        """
+        Writes every pending answer and commits. Answers are only written while
+        their attempt is still open, checked by the write itself, so an
+        attempt submitted meanwhile keeps its graded answers. Failed batches
+        are requeued.
+        """
+        entries = self.take()
+        if not entries:
+            return 0
+        try:
+            written = write_question_attempts(entries, open_attempts_only=True)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self.requeue(entries)
+            raise
+        return written
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def ensure_flusher(self, app):
+        """Starts the background thread that flushes on ANSWER_BUFFER_FLUSH_INTERVAL, once per process."""
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._run_flusher, args=(app,), name='answer-buffer-flusher', daemon=True)
+            self._flusher.start()
+        atexit.register(self._flush_with_app, app)
+
+    def _run_flusher(self, app):
+        while True:
+            time.sleep(app.config.get('ANSWER_BUFFER_FLUSH_INTERVAL', 2))
+            self._flush_with_app(app)
+
+    def _flush_with_app(self, app):
+        with app.app_context():
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing buffered answers: {e}")
+            finally:
+                db.session.remove()
+
+
+def write_question_attempts(entries, open_attempts_only=False):
+    """
+    Upserts question attempts with one bulk INSERT ... ON CONFLICT on
+    (attempt_id, question_id), so concurrent writers replace each other's
+    answer instead of adding a second row. With open_attempts_only, rows are
+    only written for attempts whose completed_at is still NULL when the
+    statement runs. Returns the number of rows written.
+    """
+    if not entries:
+        return 0
+    table = QuestionAttempt.__table__
+    statement = upsert_insert(table, db.session.get_bind())
+    if open_attempts_only:
+        columns = [table.c[name] for name in entries[0]]
+        statement = statement.from_select(
+            [column.name for column in columns],
+            select(*[bindparam(column.name, type_=column.type) for column in columns]).where(
+                select(QuizAttempt.attempt_id).where(
+                    QuizAttempt.attempt_id == bindparam('attempt_id'),
+                    QuizAttempt.completed_at.is_(None)
+                ).exists()
+            )
+        )
+    statement = statement.on_conflict_do_update(
+        index_elements=['attempt_id', 'question_id'],
+        set_={
+            'selected_answer': statement.excluded.selected_answer,
+            'is_correct': statement.excluded.is_correct,
+            'attempted_at': statement.excluded.attempted_at
+        }
+    )
+    result = db.session.execute(statement, [dict(entry) for entry in entries])
+    return result.rowcount
+
+
+answer_buffer = AnswerBuffer()
+
+
+def buffer_answers():
+    """True when SaveAnswer should queue answers instead of writing them immediately."""
+    return current_app.config.get('ANSWER_SAVE_MODE', 'sync') == 'buffered'
+
+
+def queue_answer(attempt_id, user_id, question_id, selected_answer, is_correct, attempted_at):
+    """Buffers an answer, flushing in-request once ANSWER_BUFFER_MAX_PENDING answers are waiting."""
+    answer_buffer.ensure_flusher(current_app._get_current_object())
+    pending = answer_buffer.add(attempt_id, user_id, question_id, selected_answer, is_correct, attempted_at)
+    if pending >= current_app.config.get('ANSWER_BUFFER_MAX_PENDING', 500):
+        answer_buffer.flush()
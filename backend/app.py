@@ -15,6 +15,9 @@ from routes.chatbot import chatbot_ns
 from routes.expense import passcode_ns,transaction_ns
 from routes.user_payment import user_payment_ns  # Import the user payment namespace
 from swagger_setup import configure_swagger  # Import Swagger configuration
+from session_reaper import init_session_reaper
+from export_jobs import init_export_jobs
+from blob_store import init_blob_store
 # Import other namespaces as needed
 # from routes.learn import learn_ns
 # from routes.quiz import quiz_ns
@@ -36,6 +39,9 @@ def create_app():
     # Initialize extensions
     db.init_app(app)
     JWTManager(app)
+    init_session_reaper(app)
+    init_export_jobs(app)
+    init_blob_store(app)
 
     # Initialize Flask-RESTx with Swagger configuration
     api = configure_swagger(app)
@@ -0,0 +1,157 @@
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from flask import current_app
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from model import db, User, UserProfile
+from cache_utils import TTLCache
+
+CurrentUser = namedtuple('CurrentUser', [
+    'user_id', 'email', 'username', 'user_role', 'parent_email', 'is_premium_user', 'token_version', 'has_profile'
+])
+
+# Stored identity by user_id. Requests only need it to confirm that the
+# user still exists and that their token_version is current; entries are
+# dropped whenever the user or profile row changes.
+_user_cache = TTLCache(maxsize=10000)
+
+# Attributes copied into the access token at login. Changing any of them
+# bumps User.token_version, which retires the claims of earlier tokens.
+_USER_CLAIM_ATTRIBUTES = ('user_role',)
+_PROFILE_CLAIM_ATTRIBUTES = ('is_premium_user', 'parent_email')
+
+
+def get_user_record(user_id):
+    """Returns the CurrentUser for user_id as stored in the database, or None if there is no such user."""
+    user_id = int(user_id)
+    record = _user_cache.get(user_id)
+    if record is not None:
+        return record
+
+    row = db.session.query(
+        User.user_id, User.email, User.username, User.user_role,
+        UserProfile.parent_email, UserProfile.is_premium_user, User.token_version, UserProfile.profile_id
+    ).outerjoin(UserProfile, UserProfile.user_id == User.user_id).filter(User.user_id == user_id).first()
+    if not row:
+        return None
+    user_id, email, username, user_role, parent_email, is_premium_user, token_version, profile_id = row
+    record = CurrentUser(
+        user_id, email, username, user_role, parent_email, bool(is_premium_user), token_version or 0, profile_id is not None
+    )
+    _user_cache.set(user_id, record, ttl=current_app.config.get('USER_CACHE_TTL', 60))
+    return record
+
+
+def load_current_user():
+    """
+    Returns the authenticated user as a CurrentUser, or None if the account no
+    longer exists. Role, premium status and parent email come from the signed
+    token claims while the token's token_version matches the user's; tokens
+    issued before a change to any of them fall back to the stored values.
+    """
+    record = get_user_record(get_jwt_identity())
+    if record is None:
+        return None
+
+    claims = get_jwt()
+    if claims.get('token_version') != record.token_version:
+        return record
+    return record._replace(
+        user_role=claims['user_role'],
+        parent_email=claims.get('parent_email'),
+        is_premium_user=bool(claims.get('is_premium_user'))
+    )
+
+
+def invalidate_user(user_id):
+    _user_cache.pop(int(user_id))
+
+
+def _claims_changed(obj, attributes):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in attributes)
+
+
+@event.listens_for(Session, 'before_flush')
+def _bump_token_versions(session, flush_context, instances):
+    """Bumps User.token_version when a value carried in access tokens changes."""
+    users = set()
+    for obj in session.dirty:
+        if isinstance(obj, User) and _claims_changed(obj, _USER_CLAIM_ATTRIBUTES):
+            users.add(obj)
+        elif isinstance(obj, UserProfile) and _claims_changed(obj, _PROFILE_CLAIM_ATTRIBUTES):
+            user = session.get(User, obj.user_id)
+            if user is not None:
+                users.add(user)
+    for user in users:
+        user.token_version = (user.token_version or 0) + 1
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_changed_users(session, flush_context):
+    changed = session.info.setdefault('changed_users', set())
+    # A new profile changes has_profile and the premium flag of a cached user
+    new_profiles = [obj for obj in session.new if isinstance(obj, UserProfile)]
+    for obj in list(session.dirty) + list(session.deleted) + new_profiles:
+        if isinstance(obj, (User, UserProfile)):
+            changed.add(obj.user_id)
+            invalidate_user(obj.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _invalidate_committed_users(session):
+    # Another request may have cached the pre-commit row after the flush
+    for user_id in session.info.pop('changed_users', ()):
+        invalidate_user(user_id)
+
+
+# --- Password hashing ---
+
+_hash_executor = None
+_hash_executor_lock = threading.Lock()
+
+
+def _get_hash_executor():
+    """Returns the pool that runs password hashing, sized by PASSWORD_HASH_WORKERS."""
+    global _hash_executor
+    with _hash_executor_lock:
+        if _hash_executor is None:
+            _hash_executor = ThreadPoolExecutor(
+                max_workers=current_app.config.get('PASSWORD_HASH_WORKERS', 4),
+                thread_name_prefix='password-hash'
+            )
+        return _hash_executor
+
+
+@lru_cache(maxsize=16)
+def _hash_parameters(method):
+    """Expands a method such as 'pbkdf2' to the full prefix werkzeug stores, e.g. 'pbkdf2:sha256:600000'."""
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+
+def hash_password(password):
+    """Hashes a password with PASSWORD_HASH_METHOD on the hashing pool."""
+    method = current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt')
+    return _get_hash_executor().submit(generate_password_hash, password, method=method).result()
+
+
+def verify_password(password_hash, password):
+    """
+    Checks a password on the hashing pool. hashlib releases the GIL while it
+    works, so the pool bounds how many hashes run at once without stalling
+    other request threads.
+    """
+    return _get_hash_executor().submit(check_password_hash, password_hash, password).result()
+
+
+def password_needs_rehash(password_hash):
+    """True when a stored hash was made with other parameters than PASSWORD_HASH_METHOD."""
+    method = current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt')
+    return password_hash.split('$', 1)[0] != _hash_parameters(method)
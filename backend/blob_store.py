@@ -0,0 +1,139 @@
+import hashlib
+import os
+import tempfile
+import time
+
+import click
+from flask import current_app
+
+from model import db, Topic
+
+
+class BlobStore:
+    """
+    Interface for content-addressed storage. Blobs are keyed by the SHA-256
+    hex digest of their bytes, so identical uploads are only stored once.
+    """
+
+    def put(self, stream):
+        """Stores the bytes read from stream and returns (digest, size)."""
+        raise NotImplementedError
+
+    def open(self, digest):
+        """Returns a readable binary file object for the blob."""
+        raise NotImplementedError
+
+    def exists(self, digest):
+        raise NotImplementedError
+
+    def delete(self, digest):
+        raise NotImplementedError
+
+    def iter_digests(self, stored_before):
+        """Yields the digests of blobs last stored before the given epoch time."""
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    """Keeps blobs on the local filesystem under root/<first two hex chars>/<digest>."""
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, stream):
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in iter(lambda: stream.read(self.CHUNK_SIZE), b''):
+                    sha256.update(chunk)
+                    temp_file.write(chunk)
+                    size += len(chunk)
+            digest = sha256.hexdigest()
+            if self.exists(digest):
+                os.remove(temp_path)
+                # Mark the blob as freshly stored so a sweep leaves it alone
+                # until the upload's topic row is committed
+                os.utime(self.path(digest))
+            else:
+                os.makedirs(os.path.dirname(self.path(digest)), exist_ok=True)
+                os.replace(temp_path, self.path(digest))
+            return digest, size
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def open(self, digest):
+        return open(self.path(digest), 'rb')
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def delete(self, digest):
+        if self.exists(digest):
+            os.remove(self.path(digest))
+
+    def iter_digests(self, stored_before):
+        for directory, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                if file_name.startswith('.upload-'):
+                    continue
+                if os.path.getmtime(os.path.join(directory, file_name)) < stored_before:
+                    yield file_name
+
+
+# Available backends, selected with the TOPIC_BLOB_STORE config value.
+BLOB_STORE_BACKENDS = {
+    'local': LocalBlobStore,
+}
+
+_stores = {}
+
+
+def get_blob_store():
+    """Returns the blob store configured for the current app."""
+    backend = current_app.config.get('TOPIC_BLOB_STORE', 'local')
+    root = current_app.config.get('TOPIC_BLOB_STORE_PATH') or os.path.join(current_app.instance_path, 'topic_content')
+    key = (backend, root)
+    if key not in _stores:
+        if backend not in BLOB_STORE_BACKENDS:
+            raise ValueError(f"Unknown blob store backend: {backend}")
+        _stores[key] = BLOB_STORE_BACKENDS[backend](root)
+    return _stores[key]
+
+
+def sweep_unreferenced_blobs(grace=None):
+    """
+    Deletes blobs that no topic points at. Uploads are not deleted inline, since
+    a concurrent upload of the same file could reference the blob between the
+    check and the delete; blobs stored within the last TOPIC_BLOB_SWEEP_GRACE
+    seconds are skipped so in-flight uploads keep theirs. Returns the count.
+    """
+    grace = current_app.config.get('TOPIC_BLOB_SWEEP_GRACE', 3600) if grace is None else grace
+    store = get_blob_store()
+    referenced = {digest for (digest,) in db.session.query(Topic.content_digest).filter(
+        Topic.content_digest.isnot(None)
+    ).distinct()}
+    swept = 0
+    for digest in list(store.iter_digests(time.time() - grace)):
+        if digest not in referenced:
+            store.delete(digest)
+            swept += 1
+    return swept
+
+
+def init_blob_store(app):
+    """Registers the `flask sweep-topic-blobs` command."""
+
+    @app.cli.command('sweep-topic-blobs')
+    def sweep_topic_blobs_command():
+        """Delete topic content blobs that no topic references any more."""
+        click.echo(f"Deleted {sweep_unreferenced_blobs()} unreferenced blob(s).")
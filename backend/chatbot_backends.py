@@ -0,0 +1,275 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from langchain_groq import ChatGroq
+from langchain_core.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
+from langchain_core.messages import HumanMessage
+
+# Chatbot LLM backends. All of them expose the same interface as the original
+# GroqLangChainService, so the chat endpoints do not care which one is active:
+#
+#   groq    the real model (needs GROQ_API_KEY)
+#   echo    a deterministic local stand-in with configurable latency, for load tests
+#   replay  serves replies recorded earlier with CHATBOT_RECORD_PATH
+#
+# Select one with the CHATBOT_BACKEND environment variable (there is no app
+# config setting for it, since the service is built at import). Setting
+# CHATBOT_RECORD_PATH wraps the chosen backend so every reply is appended to
+# that JSON Lines file.
+
+
+class ChatService:
+    """Base interface for chatbot backends."""
+
+    @classmethod
+    def from_env(cls):
+        raise NotImplementedError
+
+    def get_chat_response(self, chat_history, user_message):
+        raise NotImplementedError
+
+    def stream_chat_response(self, chat_history, user_message):
+        """Yields the reply in pieces. Backends without native streaming yield it whole."""
+        yield self.get_chat_response(chat_history, user_message)
+
+    def summarize_conversation(self, previous_summary, messages):
+        """Extractive fallback: keeps the child's most recent questions."""
+        asked = ' '.join(f"The child asked: {message.content}" for message in messages if isinstance(message, HumanMessage))
+        summary = f"{previous_summary} {asked}" if previous_summary else asked
+        return summary[-1000:]
+
+
+class GroqLangChainService(ChatService):
+    """
+    A service class to encapsulate interactions with the Groq API using LangChain.
+    """
+    def __init__(self, api_key):
+        if not api_key:
+            raise ValueError("Groq API key is not set.")
+        # Using the model specified in your code
+        self.chat_model = ChatGroq(temperature=0.7, model_name="llama3-70b-8192", api_key=api_key)
+
+    @classmethod
+    def from_env(cls):
+        return cls(api_key=os.environ.get("GROQ_API_KEY"))
+
+    def _build_chain(self):
+        """
+        Builds the prompt -> model chain with the predefined system prompt.
+        """
+        system_prompt_text = (
+            "You are a friendly and encouraging financial literacy chatbot for children aged 8-14. "
+            "Your name is 'FinBot'. Your goal is to explain financial concepts in a simple, engaging, and easy-to-understand way. "
+            "Use analogies and examples that kids can relate to (like saving allowance, video game currency, or trading cards). "
+            "Keep your answers concise and positive. If a question is not related to finance, money, saving, investing, or economics, "
+            "politely steer the conversation back by saying something like, 'That's an interesting question! But my specialty is money. "
+            "Do you have any questions about saving or earning?'"
+        )
+        
+        prompt = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(system_prompt_text),
+            MessagesPlaceholder(variable_name="chat_history"),
+            HumanMessagePromptTemplate.from_template("{human_input}")
+        ])
+
+        return prompt | self.chat_model
+
+    def get_chat_response(self, chat_history, user_message):
+        """
+        Generates a chat response using a predefined system prompt and chat history.
+        """
+        response = self._build_chain().invoke({
+            "chat_history": chat_history,
+            "human_input": user_message
+        })
+        
+        return response.content
+
+    def stream_chat_response(self, chat_history, user_message):
+        """
+        Same as get_chat_response, but yields the reply text piece by piece as the model produces it.
+        """
+        for chunk in self._build_chain().stream({
+            "chat_history": chat_history,
+            "human_input": user_message
+        }):
+            if chunk.content:
+                yield chunk.content
+
+    def summarize_conversation(self, previous_summary, messages):
+        """
+        Folds older messages into a short running summary of the conversation.
+        """
+        prompt = ChatPromptTemplate.from_messages([
+            SystemMessagePromptTemplate.from_template(
+                "You keep a short running summary of a conversation between a child and FinBot, a financial literacy chatbot. "
+                "Update the summary with the new messages in at most 120 words, keeping what the child asked about and what was explained."
+            ),
+            HumanMessagePromptTemplate.from_template("Summary so far:\n{previous_summary}\n\nNew messages:\n{transcript}")
+        ])
+        transcript = "\n".join(
+            f"{'Child' if isinstance(message, HumanMessage) else 'FinBot'}: {message.content}" for message in messages
+        )
+        response = (prompt | self.chat_model).invoke({
+            "previous_summary": previous_summary or "(none)",
+            "transcript": transcript
+        })
+        return response.content
+
+
+def parse_latency(spec):
+    """
+    Turns a latency spec into a sampler of seconds. Values are milliseconds:
+    "fixed:200", "uniform:100-500" or "normal:300,50". "0" or "" means no delay.
+    """
+    if not spec or spec == '0':
+        return lambda rng: 0.0
+    kind, _, params = spec.partition(':')
+    try:
+        if kind == 'fixed':
+            value = float(params)
+            return lambda rng: value / 1000
+        if kind == 'uniform':
+            low, high = (float(p) for p in params.split('-'))
+            return lambda rng: rng.uniform(low, high) / 1000
+        if kind == 'normal':
+            mean, stddev = (float(p) for p in params.split(','))
+            return lambda rng: max(0.0, rng.gauss(mean, stddev)) / 1000
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid latency spec: {spec}")
+
+
+class EchoChatService(ChatService):
+    """
+    Deterministic local backend. Replies echo the question after a sampled
+    delay, so load tests measure the server's own overhead plus a known
+    latency instead of the remote model's.
+    """
+
+    def __init__(self, latency='0', token_delay_ms=0, seed=0):
+        self.sample_latency = parse_latency(latency)
+        self.token_delay = token_delay_ms / 1000
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            latency=os.environ.get("CHATBOT_ECHO_LATENCY", "0"),
+            token_delay_ms=float(os.environ.get("CHATBOT_ECHO_TOKEN_DELAY_MS", 0)),
+            seed=int(os.environ.get("CHATBOT_ECHO_SEED", 0))
+        )
+
+    def _wait(self):
+        with self._rng_lock:
+            delay = self.sample_latency(self._rng)
+        if delay:
+            time.sleep(delay)
+
+    @staticmethod
+    def _reply(user_message):
+        return f"FinBot heard you ask: {user_message}"
+
+    def get_chat_response(self, chat_history, user_message):
+        self._wait()
+        return self._reply(user_message)
+
+    def stream_chat_response(self, chat_history, user_message):
+        self._wait()
+        for index, word in enumerate(self._reply(user_message).split(' ')):
+            if index and self.token_delay:
+                time.sleep(self.token_delay)
+            yield word if index == 0 else f" {word}"
+
+
+def _replay_key(text):
+    return ' '.join(re.findall(r'[a-z0-9]+', text.lower()))
+
+
+class ReplayChatService(ChatService):
+    """
+    Serves replies recorded in a JSON Lines file of {"message", "reply"}
+    objects. Unknown questions get the recorded replies in rotation.
+    """
+
+    def __init__(self, path):
+        self.replies = {}
+        self.rotation = []
+        with open(path, encoding='utf-8') as recording:
+            for line in recording:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.replies[_replay_key(entry['message'])] = entry['reply']
+                    self.rotation.append(entry['reply'])
+        if not self.rotation:
+            raise ValueError(f"No recorded replies in {path}")
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        path = os.environ.get("CHATBOT_REPLAY_PATH")
+        if not path:
+            raise ValueError("CHATBOT_REPLAY_PATH is not set.")
+        return cls(path)
+
+    def get_chat_response(self, chat_history, user_message):
+        reply = self.replies.get(_replay_key(user_message))
+        if reply is not None:
+            return reply
+        with self._lock:
+            reply = self.rotation[self._next % len(self.rotation)]
+            self._next += 1
+        return reply
+
+
+class RecordingChatService(ChatService):
+    """Wraps a backend and appends every question and reply to a JSON Lines file for later replay."""
+
+    def __init__(self, service, path):
+        self.service = service
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _record(self, user_message, reply):
+        with self._lock, open(self.path, 'a', encoding='utf-8') as recording:
+            recording.write(json.dumps({'message': user_message, 'reply': reply}) + '\n')
+
+    def get_chat_response(self, chat_history, user_message):
+        reply = self.service.get_chat_response(chat_history, user_message)
+        self._record(user_message, reply)
+        return reply
+
+    def stream_chat_response(self, chat_history, user_message):
+        parts = []
+        for part in self.service.stream_chat_response(chat_history, user_message):
+            parts.append(part)
+            yield part
+        self._record(user_message, ''.join(parts))
+
+    def summarize_conversation(self, previous_summary, messages):
+        return self.service.summarize_conversation(previous_summary, messages)
+
+
+CHATBOT_BACKENDS = {
+    'groq': GroqLangChainService,
+    'echo': EchoChatService,
+    'replay': ReplayChatService,
+}
+
+
+def create_chatbot_service(backend=None):
+    """Builds the backend named by CHATBOT_BACKEND (default "groq"). Raises ValueError if it cannot be set up."""
+    backend = backend or os.environ.get("CHATBOT_BACKEND", "groq")
+    if backend not in CHATBOT_BACKENDS:
+        raise ValueError(f"Unknown chatbot backend: {backend}")
+    service = CHATBOT_BACKENDS[backend].from_env()
+    record_path = os.environ.get("CHATBOT_RECORD_PATH")
+    if record_path:
+        service = RecordingChatService(service, record_path)
+    return service
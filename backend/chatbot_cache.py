@@ -0,0 +1,63 @@
+import math
+import re
+from collections import Counter
+
+from flask import current_app
+
+from cache_utils import TTLCache
+
+# Words that carry no meaning for matching questions like "what is interest?"
+_STOP_WORDS = frozenset({
+    'a', 'an', 'the', 'is', 'are', 'was', 'what', 'whats', 'how', 'do', 'does', 'i', 'me', 'my',
+    'you', 'can', 'to', 'of', 'and', 'or', 'in', 'on', 'for', 'it', 'please', 'tell', 'about', 'explain'
+})
+
+# Replies to first-turn questions, keyed by normalized question text
+_response_cache = TTLCache(maxsize=2048)
+
+
+def normalize_question(text):
+    """Lowercases, drops punctuation and collapses whitespace."""
+    return ' '.join(re.findall(r'[a-z0-9]+', text.lower()))
+
+
+def _term_vector(normalized):
+    return Counter(word for word in normalized.split() if word not in _STOP_WORDS)
+
+
+def _cosine(a, b):
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b[word] for word, count in a.items() if word in b)
+    return dot / (math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values())))
+
+
+def get_cached_reply(question):
+    """
+    Returns a cached reply for a first-turn question. Tries the exact
+    normalized text first, then, if CHAT_RESPONSE_CACHE_SIMILARITY is set, the
+    most similar cached question whose bag-of-words cosine meets the threshold.
+    """
+    normalized = normalize_question(question)
+    entry = _response_cache.get(normalized)
+    if entry is not None:
+        return entry[0]
+
+    threshold = current_app.config.get('CHAT_RESPONSE_CACHE_SIMILARITY', 0)
+    if not threshold:
+        return None
+    vector = _term_vector(normalized)
+    best_score, best_reply = 0.0, None
+    for _, (reply, cached_vector) in _response_cache.items():
+        score = _cosine(vector, cached_vector)
+        if score > best_score:
+            best_score, best_reply = score, reply
+    return best_reply if best_score >= threshold else None
+
+
+def cache_reply(question, reply):
+    """Stores the reply to a first-turn question for CHAT_RESPONSE_CACHE_TTL seconds."""
+    normalized = normalize_question(question)
+    if normalized and reply:
+        _response_cache.set(normalized, (reply, _term_vector(normalized)),
+                            ttl=current_app.config.get('CHAT_RESPONSE_CACHE_TTL', 3600))
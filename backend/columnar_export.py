@@ -0,0 +1,128 @@
+import importlib.util
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime
+from itertools import groupby
+
+from flask import current_app
+from sqlalchemy import select, Boolean, Date, DateTime, Float, Integer
+
+from model import db, QuizAttempt, QuestionAttempt, UserSession, ChatbotMessage, Transaction
+from reports import get_time_filter
+
+# Rows are fetched and written as Arrow record batches of this size.
+PARQUET_BATCH_SIZE = 10000
+
+# Tables in the engagement dump, with the column their files are partitioned by.
+ENGAGEMENT_TABLES = {
+    'quiz_attempts': (QuizAttempt, 'started_at'),
+    'question_attempts': (QuestionAttempt, 'attempted_at'),
+    'user_sessions': (UserSession, 'login_at'),
+    'chatbot_messages': (ChatbotMessage, 'sent_at'),
+    'transactions': (Transaction, 'transaction_date'),
+}
+
+# Bearer secrets, left out of the dump
+_EXCLUDED_COLUMNS = {'quiz_attempt_access_token', 'session_token'}
+
+# Partition name for rows without a date, as pyarrow and pandas read it
+_NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def parquet_available():
+    """Parquet exports need pyarrow, which the requirements files install."""
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def _arrow_type(pa, column):
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp('us')
+    if isinstance(column.type, Date):
+        return pa.date32()
+    return pa.string()
+
+
+def _partition_key(value):
+    if value is None:
+        return _NULL_PARTITION
+    return (value.date() if isinstance(value, datetime) else value).isoformat()
+
+
+def _write_table(pa, pq, root, name, period, progress):
+    """
+    Writes one table as <name>/date=YYYY-MM-DD/part-0.parquet files. Rows are
+    read in date order with a batched cursor, so only one partition file is
+    open at a time. Returns the number of rows written.
+    """
+    model, date_name = ENGAGEMENT_TABLES[name]
+    table = model.__table__
+    columns = [column for column in table.columns if column.name not in _EXCLUDED_COLUMNS]
+    schema = pa.schema([pa.field(column.name, _arrow_type(pa, column)) for column in columns])
+    date_index = [column.name for column in columns].index(date_name)
+
+    statement = select(*columns).order_by(table.c[date_name], *table.primary_key.columns)
+    time_filter = get_time_filter(table.c[date_name], period)
+    if time_filter is not None:
+        statement = statement.where(time_filter)
+    result = db.session.execute(statement.execution_options(yield_per=PARQUET_BATCH_SIZE))
+
+    compression = current_app.config.get('PARQUET_COMPRESSION', 'zstd')
+    writer, current_day, written = None, None, 0
+    try:
+        for batch in result.partitions():
+            # A batch can span several days; each run goes to its own partition
+            for day, rows in groupby(batch, key=lambda row: _partition_key(row[date_index])):
+                if day != current_day:
+                    if writer is not None:
+                        writer.close()
+                    directory = os.path.join(root, name, f"date={day}")
+                    os.makedirs(directory, exist_ok=True)
+                    writer = pq.ParquetWriter(os.path.join(directory, 'part-0.parquet'), schema, compression=compression)
+                    current_day = day
+                rows = list(rows)
+                writer.write_batch(pa.RecordBatch.from_arrays(
+                    [pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(schema)],
+                    schema=schema
+                ))
+                written += len(rows)
+                progress(written)
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
+
+
+def write_engagement_parquet(path, period, progress=None):
+    """
+    Writes ENGAGEMENT_TABLES for all users as zstd-compressed Parquet, one
+    date-partitioned dataset per table, and packs them into a zip at path.
+    Each extracted table directory loads with pandas.read_parquet. Returns
+    the number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    progress = progress or (lambda rows: None)
+    staging = tempfile.mkdtemp(dir=os.path.dirname(path))
+    try:
+        total = 0
+        for name in ENGAGEMENT_TABLES:
+            total += _write_table(pa, pq, staging, name, period, lambda rows: progress(total + rows))
+
+        # Parquet pages are compressed already, so the files are stored as is
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+            for directory, _, file_names in sorted(os.walk(staging)):
+                for file_name in sorted(file_names):
+                    file_path = os.path.join(directory, file_name)
+                    archive.write(file_path, os.path.relpath(file_path, staging))
+        return total
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
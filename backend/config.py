@@ -1,5 +1,6 @@
 # config.py
 import os
+import tempfile
 from dotenv import load_dotenv
 from datetime import timedelta
 
@@ -49,6 +50,91 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get("SQLALCHEMY_DATABASE_URI")
     SQLALCHEMY_TRACK_MODIFICATIONS = os.getenv("SQLALCHEMY_TRACK_MODIFICATIONS", "false").lower() == "true"
     
+    # In-process caches (seconds; 0 disables)
+    CONTENT_PATH_CACHE_TTL = int(os.environ.get("CONTENT_PATH_CACHE_TTL", 60))
+    CONTENT_SNAPSHOT_MAX_AGE = int(os.environ.get("CONTENT_SNAPSHOT_MAX_AGE", 300))
+    ANSWER_KEY_CACHE_TTL = int(os.environ.get("ANSWER_KEY_CACHE_TTL", 300))
+    ATTEMPT_TOKEN_CACHE_TTL = int(os.environ.get("ATTEMPT_TOKEN_CACHE_TTL", 3600))
+    SESSION_CACHE_TTL = int(os.environ.get("SESSION_CACHE_TTL", 300))
+    USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 60))
+
+    # Active sessions older than SESSION_STALE_AFTER seconds (0 means the access
+    # token lifetime) are closed every SESSION_REAPER_INTERVAL seconds (0 disables)
+    SESSION_STALE_AFTER = int(os.environ.get("SESSION_STALE_AFTER", 0))
+    SESSION_REAPER_INTERVAL = int(os.environ.get("SESSION_REAPER_INTERVAL", 600))
+    SESSION_REAPER_BATCH_SIZE = int(os.environ.get("SESSION_REAPER_BATCH_SIZE", 1000))
+
+    # Password hashing policy as a werkzeug method string ('scrypt:N:r:p' or
+    # 'pbkdf2:sha256:iterations'). Stored hashes made with other parameters
+    # are upgraded the next time their password is verified.
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 4))
+
+    # Topic PDFs are stored in a content-addressed blob store ('local' keeps
+    # them under TOPIC_BLOB_STORE_PATH, defaulting to instance/topic_content)
+    TOPIC_BLOB_STORE = os.environ.get("TOPIC_BLOB_STORE", "local")
+    TOPIC_BLOB_STORE_PATH = os.environ.get("TOPIC_BLOB_STORE_PATH")
+    # `flask sweep-topic-blobs` deletes unreferenced blobs stored more than
+    # TOPIC_BLOB_SWEEP_GRACE seconds ago, leaving in-flight uploads alone
+    TOPIC_BLOB_SWEEP_GRACE = int(os.environ.get("TOPIC_BLOB_SWEEP_GRACE", 3600))
+
+    # Legacy in-database PDFs are streamed in chunks of this many bytes
+    TOPIC_CONTENT_CHUNK_SIZE = int(os.environ.get("TOPIC_CONTENT_CHUNK_SIZE", 256 * 1024))
+
+    # Quiz autosave: 'sync' writes every answer immediately, 'buffered' queues
+    # answers in memory and writes them in batches every
+    # ANSWER_BUFFER_FLUSH_INTERVAL seconds, once ANSWER_BUFFER_MAX_PENDING are
+    # waiting, and when the quiz is evaluated. Buffered answers are lost if the
+    # process crashes and are invisible to other processes, so 'buffered' is
+    # opt-in and only safe when the app runs as a single worker process
+    ANSWER_SAVE_MODE = os.environ.get("ANSWER_SAVE_MODE", "sync")
+    ANSWER_BUFFER_FLUSH_INTERVAL = float(os.environ.get("ANSWER_BUFFER_FLUSH_INTERVAL", 2))
+    ANSWER_BUFFER_MAX_PENDING = int(os.environ.get("ANSWER_BUFFER_MAX_PENDING", 500))
+
+    # Chatbot prompts carry a running summary plus every turn after it (within
+    # an estimated CHAT_HISTORY_TOKEN_BUDGET). Once twice CHAT_HISTORY_MAX_TURNS
+    # turns are unsummarised, all but the last CHAT_HISTORY_MAX_TURNS are folded
+    CHAT_HISTORY_MAX_TURNS = int(os.environ.get("CHAT_HISTORY_MAX_TURNS", 6))
+    CHAT_HISTORY_TOKEN_BUDGET = int(os.environ.get("CHAT_HISTORY_TOKEN_BUDGET", 2000))
+
+    # Replies to first-turn chatbot questions are cached by normalized text for
+    # CHAT_RESPONSE_CACHE_TTL seconds (0 disables). Setting
+    # CHAT_RESPONSE_CACHE_SIMILARITY (e.g. 0.9) also serves near-identical
+    # questions by bag-of-words cosine similarity
+    CHAT_RESPONSE_CACHE_TTL = int(os.environ.get("CHAT_RESPONSE_CACHE_TTL", 3600))
+    CHAT_RESPONSE_CACHE_SIMILARITY = float(os.environ.get("CHAT_RESPONSE_CACHE_SIMILARITY", 0))
+
+    # The chatbot LLM backend ('groq', 'echo' or 'replay') is not a config
+    # setting: it is chosen only by the CHATBOT_BACKEND environment variable,
+    # read when routes/chatbot.py is imported (see chatbot_backends.py)
+
+    # Chatbot throttling: each user gets a token bucket of CHATBOT_RATE_LIMIT_BURST
+    # messages refilled at CHATBOT_RATE_LIMIT_PER_MINUTE, and at most
+    # CHATBOT_MAX_CONCURRENT_CALLS LLM calls run at once; requests wait up to
+    # CHATBOT_QUEUE_TIMEOUT seconds for a slot before getting a 429
+    CHATBOT_RATE_LIMIT_BURST = int(os.environ.get("CHATBOT_RATE_LIMIT_BURST", 5))
+    CHATBOT_RATE_LIMIT_PER_MINUTE = float(os.environ.get("CHATBOT_RATE_LIMIT_PER_MINUTE", 20))
+    CHATBOT_MAX_CONCURRENT_CALLS = int(os.environ.get("CHATBOT_MAX_CONCURRENT_CALLS", 8))
+    CHATBOT_QUEUE_TIMEOUT = float(os.environ.get("CHATBOT_QUEUE_TIMEOUT", 5))
+
+    # Admin chatbot statistics are cached for CHATBOT_STATS_CACHE_TTL seconds (0 disables)
+    CHATBOT_STATS_CACHE_TTL = int(os.environ.get("CHATBOT_STATS_CACHE_TTL", 30))
+
+    # Report exports run on EXPORT_WORKERS background threads ('inline' runs
+    # them in the request instead) and are written to EXPORT_DIR (defaulting
+    # to instance/exports), where they are kept for EXPORT_RETENTION_HOURS
+    EXPORT_JOB_MODE = os.environ.get("EXPORT_JOB_MODE", "thread")
+    EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", 2))
+    EXPORT_DIR = os.environ.get("EXPORT_DIR")
+    EXPORT_RETENTION_HOURS = int(os.environ.get("EXPORT_RETENTION_HOURS", 24))
+    # Queued or running jobs older than this are taken to have lost their
+    # worker (restart or crash) and are marked failed by the purge
+    EXPORT_JOB_TIMEOUT_MINUTES = int(os.environ.get("EXPORT_JOB_TIMEOUT_MINUTES", 60))
+
+    # Compression codec of the admin Parquet engagement export, which needs
+    # pyarrow (listed in the requirements files; without it the export is 501)
+    PARQUET_COMPRESSION = os.environ.get("PARQUET_COMPRESSION", "zstd")
+
     # Groq API Key
     GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
     
@@ -65,6 +151,11 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    TOPIC_BLOB_STORE_PATH = os.path.join(tempfile.gettempdir(), 'se_project_test_topic_content')
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    SESSION_REAPER_INTERVAL = 0
+    EXPORT_JOB_MODE = 'inline'
+    EXPORT_DIR = os.path.join(tempfile.gettempdir(), 'se_project_test_exports')
     WTF_CSRF_ENABLED = False 
 
 class ProductionConfig(Config):
@@ -0,0 +1,319 @@
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+from flask import current_app
+from flask_restx import abort
+from sqlalchemy import event, func, update
+from sqlalchemy.orm import Session
+
+from model import db, Lesson, Module, Topic, Quiz, Question
+from cache_utils import TTLCache
+
+# Validated (lesson_id, module_id, topic_id, quiz_id) paths. Only successful
+# lookups are cached; entries are dropped whenever a row on the path changes.
+_path_cache = TTLCache(maxsize=4096)
+
+# Position of each model's id inside a path cache key.
+_PATH_KEY_INDEX = {
+    Lesson: (0, 'lesson_id'),
+    Module: (1, 'module_id'),
+    Topic: (2, 'topic_id'),
+    Quiz: (3, 'quiz_id'),
+}
+
+
+def resolve_content_path(lesson_id, module_id=None, topic_id=None, quiz_id=None, use_cache=True):
+    """
+    Validates a /lesson/module/topic/quiz path with a single joined query.
+    Aborts with 404 naming the first missing level, mirroring the checks the
+    routes used to run one query at a time.
+    """
+    key = (lesson_id, module_id, topic_id, quiz_id)
+    if use_cache and _path_cache.get(key):
+        return
+
+    query = db.session.query(Lesson.lesson_id).filter(Lesson.lesson_id == lesson_id)
+    if module_id is not None:
+        query = query.outerjoin(Module, db.and_(
+            Module.module_id == module_id,
+            Module.lesson_id == Lesson.lesson_id,
+            Module.deleted_at.is_(None)
+        )).add_columns(Module.module_id)
+    if topic_id is not None:
+        query = query.outerjoin(Topic, db.and_(
+            Topic.topic_id == topic_id,
+            Topic.module_id == Module.module_id,
+            Topic.deleted_at.is_(None)
+        )).add_columns(Topic.topic_id)
+    if quiz_id is not None:
+        query = query.outerjoin(Quiz, db.and_(
+            Quiz.quiz_id == quiz_id,
+            Quiz.module_id == Module.module_id,
+            Quiz.topic_id == Topic.topic_id,
+            Quiz.deleted_at.is_(None)
+        )).add_columns(Quiz.quiz_id)
+
+    row = query.first()
+    if not row:
+        abort(404, 'Lesson not found')
+    for found, label in zip(row[1:], ('Module', 'Topic', 'Quiz')):
+        if found is None:
+            abort(404, f'{label} not found')
+
+    _path_cache.set(key, True, ttl=current_app.config.get('CONTENT_PATH_CACHE_TTL', 60))
+
+
+def invalidate_content_path(model, object_id):
+    """Drops cached paths that pass through the given lesson, module, topic or quiz."""
+    index, _ = _PATH_KEY_INDEX[model]
+    _path_cache.invalidate_where(lambda key: key[index] == object_id)
+
+
+# --- Published content tree ---
+
+# Models whose rows make up the catalog served from the snapshot.
+_CATALOG_MODELS = (Lesson, Module, Topic, Quiz, Question)
+
+_content_version = 0
+_version_lock = threading.Lock()
+_rebuild_lock = threading.Lock()
+
+# Holds at most one snapshot. The TTL is only a safety net for writes made by
+# other worker processes; in-process writes invalidate it via the version.
+_snapshot_cache = TTLCache(maxsize=1)
+
+
+def get_content_version():
+    return _content_version
+
+
+def bump_content_version():
+    """Marks the published catalog as stale so the next read rebuilds it."""
+    global _content_version
+    with _version_lock:
+        _content_version += 1
+
+
+class ContentSnapshot:
+    """
+    An immutable copy of the catalog (lessons -> modules -> topics -> quizzes
+    with question stats) as the read endpoints return it.
+    """
+
+    def __init__(self, version, lessons, modules, topics, quizzes):
+        self.version = version
+        self.lessons = tuple(lessons)
+        self.modules = tuple(modules)
+        self.topics = tuple(topics)
+        self.lessons_by_id = MappingProxyType({l['lesson_id']: l for l in self.lessons})
+        self.modules_by_id = MappingProxyType({m['module_id']: m for m in self.modules})
+        self.topics_by_id = MappingProxyType({t['topic_id']: t for t in self.topics})
+        self.modules_by_lesson = _group_by(self.modules, 'lesson_id')
+        self.topics_by_module = _group_by(self.topics, 'module_id')
+        self.quizzes_by_topic = _group_by(quizzes, 'topic_id')
+
+    def validate_path(self, lesson_id, module_id=None, topic_id=None):
+        """Same contract as resolve_content_path, answered from the snapshot."""
+        if lesson_id not in self.lessons_by_id:
+            abort(404, 'Lesson not found')
+        if module_id is not None:
+            module = self.modules_by_id.get(module_id)
+            if not module or module['lesson_id'] != lesson_id:
+                abort(404, 'Module not found')
+        if topic_id is not None:
+            topic = self.topics_by_id.get(topic_id)
+            if not topic or topic['module_id'] != module_id:
+                abort(404, 'Topic not found')
+
+
+def _group_by(rows, field):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row[field], []).append(row)
+    return MappingProxyType({key: tuple(value) for key, value in grouped.items()})
+
+
+def _build_content_snapshot(version):
+    lessons = [MappingProxyType({
+        'lesson_id': lesson.lesson_id,
+        'lesson_name': lesson.lesson_name,
+        'lesson_description': lesson.lesson_description,
+        'created_at': lesson.created_at,
+        'updated_at': lesson.updated_at
+    }) for lesson in Lesson.query.order_by(Lesson.lesson_id).all()]
+
+    modules = [MappingProxyType({
+        'module_id': module.module_id,
+        'lesson_id': module.lesson_id,
+        'created_by_admin_id': module.created_by_admin_id,
+        'module_title': module.module_title,
+        'module_description': module.module_description,
+        'created_at': module.created_at,
+        'updated_at': module.updated_at
+    }) for module in Module.query.filter_by(deleted_at=None).order_by(Module.module_id).all()]
+
+    # content_size is stored on upload; legacy rows not yet backfilled are
+    # measured in SQL, so the BLOB itself is never loaded here.
+    topic_rows = db.session.query(
+        Topic.topic_id, Topic.module_id, Topic.created_by_admin_id, Topic.topic_title,
+        func.coalesce(Topic.content_size, func.length(Topic.topic_content)),
+        Topic.created_at, Topic.updated_at
+    ).filter(Topic.deleted_at.is_(None)).order_by(Topic.topic_id).all()
+    topics = [MappingProxyType({
+        'topic_id': topic_id,
+        'module_id': module_id,
+        'created_by_admin_id': created_by_admin_id,
+        'topic_title': topic_title,
+        'has_content': bool(content_size),
+        'created_at': created_at,
+        'updated_at': updated_at
+    }) for topic_id, module_id, created_by_admin_id, topic_title, content_size, created_at, updated_at in topic_rows]
+
+    question_stats = db.session.query(
+        Question.quiz_id,
+        func.count(Question.question_id).label('total_questions'),
+        func.sum(Question.score_points).label('total_score')
+    ).filter(Question.deleted_at.is_(None)).group_by(Question.quiz_id).subquery()
+    quiz_rows = db.session.query(
+        Quiz, question_stats.c.total_questions, question_stats.c.total_score
+    ).outerjoin(
+        question_stats, Quiz.quiz_id == question_stats.c.quiz_id
+    ).filter(Quiz.deleted_at.is_(None)).order_by(Quiz.quiz_id).all()
+    quizzes = [MappingProxyType({
+        'quiz_id': quiz.quiz_id,
+        'module_id': quiz.module_id,
+        'topic_id': quiz.topic_id,
+        'quiz_title': quiz.quiz_title,
+        'duration_minutes': quiz.duration_minutes,
+        'is_visible': quiz.is_visible,
+        'created_at': quiz.created_at,
+        'updated_at': quiz.updated_at,
+        'total_questions': total_questions or 0,
+        'total_score': int(total_score) if total_score is not None else 0
+    }) for quiz, total_questions, total_score in quiz_rows]
+
+    return ContentSnapshot(version, lessons, modules, topics, quizzes)
+
+
+def get_content_snapshot():
+    """Returns the current catalog snapshot, rebuilding it if an admin write made it stale."""
+    snapshot = _snapshot_cache.get('tree')
+    if snapshot is not None and snapshot.version == _content_version:
+        return snapshot
+
+    with _rebuild_lock:
+        snapshot = _snapshot_cache.get('tree')
+        if snapshot is not None and snapshot.version == _content_version:
+            return snapshot
+        version = _content_version
+        snapshot = _build_content_snapshot(version)
+        _snapshot_cache.set('tree', snapshot, ttl=current_app.config.get('CONTENT_SNAPSHOT_MAX_AGE', 300))
+        return snapshot
+
+
+# --- Quiz answer keys ---
+
+QuestionKey = namedtuple('QuestionKey', ['options', 'correct_answer', 'score_points'])
+
+# Compiled answer keys by quiz_id. Each entry records the quiz's stored
+# questions_version and is only used while that still matches, so a question
+# write retires just its own quiz's key, in every worker process.
+_answer_key_cache = TTLCache(maxsize=1024)
+
+
+class AnswerKey:
+    """Everything needed to validate and score answers to one quiz, without touching the database."""
+
+    def __init__(self, quiz_id, version, questions):
+        self.quiz_id = quiz_id
+        self.version = version
+        self.questions = MappingProxyType(questions)
+        self.total_questions = len(questions)
+        self.total_score = sum(question.score_points for question in questions.values())
+
+    def get(self, question_id):
+        return self.questions.get(question_id)
+
+
+def get_answer_key(quiz_id):
+    """
+    Returns the quiz's answer key (question_id -> options, correct answer,
+    points, plus totals). A cached key costs one primary-key lookup of the
+    quiz's questions_version; the questions are only read when it changed.
+    """
+    version = db.session.query(Quiz.questions_version).filter(Quiz.quiz_id == quiz_id).scalar()
+    answer_key = _answer_key_cache.get(quiz_id)
+    if answer_key is not None and answer_key.version == version:
+        return answer_key
+
+    rows = db.session.query(
+        Question.question_id, Question.option1, Question.option2, Question.option3, Question.option4,
+        Question.correct_answer, Question.score_points
+    ).filter(Question.quiz_id == quiz_id, Question.deleted_at.is_(None)).all()
+    answer_key = AnswerKey(quiz_id, version, {
+        question_id: QuestionKey(frozenset((option1, option2, option3, option4)), correct_answer, score_points)
+        for question_id, option1, option2, option3, option4, correct_answer, score_points in rows
+    })
+    _answer_key_cache.set(quiz_id, answer_key, ttl=current_app.config.get('ANSWER_KEY_CACHE_TTL', 300))
+    return answer_key
+
+
+# --- Invalidation ---
+
+def mark_content_changed(session):
+    """
+    Flags catalog rows as changed in this session. Bulk statements bypass the
+    unit of work, so callers that write with them must call this themselves.
+    """
+    # Bump now so this transaction's own reads see its writes, and again
+    # once it ends so no snapshot built in between outlives it.
+    bump_content_version()
+    session.info['content_changed'] = True
+
+
+def mark_questions_changed(session, quiz_ids):
+    """
+    Bumps questions_version for the given quizzes, retiring their answer keys.
+    Bulk statements bypass the unit of work, so callers that write questions
+    with them must call this themselves.
+    """
+    quiz_ids = {quiz_id for quiz_id in quiz_ids if quiz_id is not None}
+    if quiz_ids:
+        session.connection().execute(
+            update(Quiz).where(Quiz.quiz_id.in_(quiz_ids)).values(questions_version=Quiz.questions_version + 1)
+        )
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_changed_questions(session, flush_context):
+    mark_questions_changed(session, [
+        obj.quiz_id for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+        if isinstance(obj, Question)
+    ])
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_changed_content(session, flush_context):
+    """Keeps the path cache and catalog snapshot honest when hierarchy rows change."""
+    changed_paths = session.info.setdefault('changed_content_paths', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        entry = _PATH_KEY_INDEX.get(type(obj))
+        if entry:
+            changed_paths.add((type(obj), getattr(obj, entry[1])))
+            invalidate_content_path(type(obj), getattr(obj, entry[1]))
+
+    changed = list(session.new) + list(session.dirty) + list(session.deleted)
+    if any(isinstance(obj, _CATALOG_MODELS) for obj in changed):
+        mark_content_changed(session)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _publish_content_changes(session):
+    # A request running alongside may have cached a path between the flush
+    # and the commit, so the flushed paths are dropped again now
+    for model, object_id in session.info.pop('changed_content_paths', ()):
+        invalidate_content_path(model, object_id)
+    if session.info.pop('content_changed', False):
+        bump_content_version()
@@ -0,0 +1,18 @@
+from sqlalchemy.dialects import postgresql, sqlite
+
+# INSERT constructs that support ON CONFLICT, by dialect name
+_UPSERT_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+def upsert_insert(table, bind):
+    """
+    Returns an INSERT into table for the dialect of bind (an engine or
+    connection), with on_conflict_do_update / on_conflict_do_nothing available.
+    """
+    dialect = bind.dialect.name
+    if dialect not in _UPSERT_INSERTS:
+        raise NotImplementedError(f"Upserts are not supported on {dialect}")
+    return _UPSERT_INSERTS[dialect](table)
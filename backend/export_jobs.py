@@ -0,0 +1,217 @@
+import glob
+import gzip
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import func
+
+from model import db, User, ExportJob
+from api_utils import get_current_ist
+from reports import iter_report_csv
+from columnar_export import write_engagement_parquet
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Rows written so far by jobs running in this process. Progress is only
+# stored on the job row when it finishes, since committing mid-export would
+# end the transaction the report is being read from.
+_progress = {}
+
+
+def _now():
+    """Export timestamps are stored and compared as naive IST, like the rest of the schema."""
+    return get_current_ist().replace(tzinfo=None)
+
+
+def _expiry(now):
+    return now + timedelta(hours=current_app.config.get('EXPORT_RETENTION_HOURS', 24))
+
+
+def _get_executor():
+    """Returns the pool that runs export jobs, sized by EXPORT_WORKERS."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=current_app.config.get('EXPORT_WORKERS', 2),
+                thread_name_prefix='report-export'
+            )
+        return _executor
+
+
+def get_export_dir():
+    """Directory holding finished exports: EXPORT_DIR, defaulting to instance/exports."""
+    path = current_app.config.get('EXPORT_DIR') or os.path.join(current_app.instance_path, 'exports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _extension(job):
+    if job.file_format == 'parquet':
+        return '.parquet.zip'
+    return '.csv.gz' if job.compressed else '.csv'
+
+
+def export_filename(job):
+    """The name a finished export is downloaded as."""
+    scope = 'all_users_' if job.all_users else ''
+    return f"{job.report_type}_report_{scope}{job.period}{_extension(job)}"
+
+
+def get_job_progress(job):
+    return _progress.get(job.job_id, job.rows_written)
+
+
+def is_export_expired(job):
+    return job.expires_at is not None and job.expires_at < _now()
+
+
+def enqueue_export(requested_by, report_type, period, all_users=False, compressed=False, file_format='csv'):
+    """
+    Records an export job and hands it to the worker pool, or runs it right
+    away when EXPORT_JOB_MODE is 'inline'. Returns the job.
+    """
+    purge_expired_exports()
+    job = ExportJob(
+        requested_by=requested_by,
+        report_type=report_type,
+        period=period,
+        all_users=all_users,
+        compressed=compressed,
+        file_format=file_format
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    if current_app.config.get('EXPORT_JOB_MODE', 'thread') == 'inline':
+        run_export_job(job.job_id)
+    else:
+        _get_executor().submit(_run_with_app, current_app._get_current_object(), job.job_id)
+    return job
+
+
+def run_export_job(job_id):
+    """Writes a queued job's report to disk and marks it completed, or failed with the error."""
+    job = ExportJob.query.get(job_id)
+    if not job or job.status != 'queued':
+        return
+    job.status = 'running'
+    job.started_at = _now()
+    db.session.commit()
+
+    path = os.path.join(get_export_dir(), f"export_{job.job_id}_{uuid.uuid4().hex}{_extension(job)}")
+    _progress[job_id] = 0
+    try:
+        if job.file_format == 'parquet':
+            rows_written = write_engagement_parquet(
+                path, job.period, progress=lambda rows: _progress.__setitem__(job_id, rows)
+            )
+        else:
+            rows_written = _write_csv(job, path)
+
+        now = _now()
+        job.status = 'completed'
+        job.rows_written = rows_written
+        job.file_path = path
+        job.file_size = os.path.getsize(path)
+        job.completed_at = now
+        job.expires_at = _expiry(now)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        if os.path.exists(path):
+            os.remove(path)
+        job = ExportJob.query.get(job_id)
+        job.status = 'failed'
+        job.error_message = str(e)
+        job.completed_at = _now()
+        job.expires_at = _expiry(job.completed_at)
+        db.session.commit()
+    finally:
+        _progress.pop(job_id, None)
+
+
+def _write_csv(job, path):
+    if job.all_users:
+        user_id, username = None, 'All users'
+    else:
+        user_id, username = job.requested_by, User.query.get(job.requested_by).username
+
+    rows_written = 0
+
+    def count_row():
+        nonlocal rows_written
+        rows_written += 1
+        _progress[job.job_id] = rows_written
+
+    opener = gzip.open if job.compressed else open
+    with opener(path, 'wt', newline='', encoding='utf-8') as output:
+        for chunk in iter_report_csv(job.report_type, user_id, username, job.period, on_row=count_row):
+            output.write(chunk)
+    return rows_written
+
+
+def _run_with_app(app, job_id):
+    with app.app_context():
+        try:
+            run_export_job(job_id)
+        except Exception as e:
+            print(f"Error running export job {job_id}: {e}")
+        finally:
+            db.session.remove()
+
+
+def fail_stale_exports():
+    """
+    Marks queued or running jobs that have not finished within
+    EXPORT_JOB_TIMEOUT_MINUTES as failed and removes their partial files.
+    Their worker went away with its process (a restart or crash), so they
+    would otherwise never finish or expire. Returns the count.
+    """
+    now = _now()
+    cutoff = now - timedelta(minutes=current_app.config.get('EXPORT_JOB_TIMEOUT_MINUTES', 60))
+    stale = ExportJob.query.filter(
+        ExportJob.status.in_(('queued', 'running')),
+        func.coalesce(ExportJob.started_at, ExportJob.created_at) < cutoff
+    ).all()
+    for job in stale:
+        for path in glob.glob(os.path.join(get_export_dir(), f"export_{job.job_id}_*")):
+            os.remove(path)
+        job.status = 'failed'
+        job.error_message = 'Export did not finish; the worker running it stopped.'
+        job.completed_at = now
+        job.expires_at = _expiry(now)
+    if stale:
+        db.session.commit()
+    return len(stale)
+
+
+def purge_expired_exports():
+    """
+    Fails stalled jobs, then deletes exports past their EXPORT_RETENTION_HOURS,
+    files and job rows. Returns the number deleted.
+    """
+    fail_stale_exports()
+    expired = ExportJob.query.filter(ExportJob.expires_at < _now()).all()
+    for job in expired:
+        if job.file_path and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+        db.session.delete(job)
+    if expired:
+        db.session.commit()
+    return len(expired)
+
+
+def init_export_jobs(app):
+    """Registers the `flask purge-exports` command."""
+
+    @app.cli.command('purge-exports')
+    def purge_exports_command():
+        """Fail stalled report exports and delete those past their retention period."""
+        click.echo(f"Purged {purge_expired_exports()} expired export(s).")
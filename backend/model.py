@@ -14,6 +14,7 @@ class User(db.Model):
     username = db.Column(db.String(100), nullable=False, unique=True, index=True)
     password_hash = db.Column(db.String(255), nullable=False)
     user_role = db.Column(db.String(50), nullable=False, default='user')  # 'user' or 'admin'
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Bumped when role or premium status changes
     created_at = db.Column(db.DateTime, default=get_current_ist)
     updated_at = db.Column(db.DateTime, default=get_current_ist, onupdate=get_current_ist)
 
@@ -63,13 +64,20 @@ class UserSession(db.Model):
 
     session_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id', ondelete='CASCADE'), nullable=False, index=True)
-    session_token = db.Column(db.String(255), nullable=False, unique=True)
+    session_token = db.Column(db.String(36), nullable=False, unique=True)  # JTI of the access token issued at login
     login_at = db.Column(db.DateTime, default=get_current_ist)
     logout_at = db.Column(db.DateTime)
     session_duration_seconds = db.Column(db.Integer)
     is_active = db.Column(db.Boolean, nullable=False, default=True)
+    chat_summary = db.Column(db.Text)  # Running summary of chatbot messages older than the prompt window
+    chat_summary_until_id = db.Column(db.Integer)  # Last chat_id folded into chat_summary
     chatbot_messages = db.relationship('ChatbotMessage', backref='session', lazy=True, cascade='all, delete-orphan')
 
+    __table_args__ = (
+        db.Index('idx_user_sessions_user_active', 'user_id', 'is_active'),
+        db.Index('idx_user_sessions_active_login', 'is_active', 'login_at'),
+    )
+
 # Lesson Model
 class Lesson(db.Model):
     __tablename__ = 'lessons'
@@ -106,7 +114,11 @@ class Topic(db.Model):
     module_id = db.Column(db.Integer, db.ForeignKey('modules.module_id', ondelete='CASCADE'), nullable=False, index=True)
     created_by_admin_id = db.Column(db.Integer, db.ForeignKey('users.user_id', ondelete='RESTRICT'), nullable=False)
     topic_title = db.Column(db.String(255), nullable=False)
-    topic_content = db.Column(db.LargeBinary, nullable=True)
+    # Legacy in-database PDFs only. Deferred so metadata reads never pull the BLOB.
+    topic_content = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    content_digest = db.Column(db.String(64), index=True)  # SHA-256 key into the blob store
+    content_size = db.Column(db.Integer)  # Set whenever content is stored; drives has_content
+    content_mime_type = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=get_current_ist)
     updated_at = db.Column(db.DateTime, default=get_current_ist, onupdate=get_current_ist)
     deleted_at = db.Column(db.DateTime)
@@ -143,6 +155,7 @@ class Quiz(db.Model):
     quiz_title = db.Column(db.String(255), nullable=False)
     duration_minutes = db.Column(db.Integer, nullable=False)
     is_visible = db.Column(db.Boolean, nullable=False, default=True)
+    questions_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Bumped when the quiz's questions change
     created_at = db.Column(db.DateTime, default=get_current_ist)
     updated_at = db.Column(db.DateTime, default=get_current_ist, onupdate=get_current_ist)
     deleted_at = db.Column(db.DateTime)
@@ -181,7 +194,7 @@ class QuizAttempt(db.Model):
 
     attempt_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id', ondelete='CASCADE'), nullable=False, index=True)
-    quiz_attempt_access_token = db.Column(db.String(255))
+    quiz_attempt_access_token = db.Column(db.String(255), unique=True, index=True)
     quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.quiz_id', ondelete='SET NULL'), nullable=True, index=True)
     total_questions = db.Column(db.Integer, nullable=False, default=0)
     total_score_possible = db.Column(db.Integer, nullable=False, default=0)
@@ -208,6 +221,11 @@ class QuestionAttempt(db.Model):
     is_correct = db.Column(db.Boolean, nullable=False)
     attempted_at = db.Column(db.DateTime, default=get_current_ist)
 
+    __table_args__ = (
+        # One answer per question and attempt; autosave writes upsert on it
+        db.Index('idx_question_attempts_attempt_question', 'attempt_id', 'question_id', unique=True),
+    )
+
 # Chatbot Message Model
 class ChatbotMessage(db.Model):
     __tablename__ = 'chatbot_messages'
@@ -219,6 +237,12 @@ class ChatbotMessage(db.Model):
     message_type = db.Column(db.String(50), nullable=False)  # 'user' or 'bot'
     sent_at = db.Column(db.DateTime, default=get_current_ist)
 
+    __table_args__ = (
+        # Covers the chatbot statistics scan, which groups by user and reads
+        # only these columns; also serves per-user history ordered by time
+        db.Index('idx_chatbot_messages_stats', 'user_id', 'sent_at', 'message_type', 'session_id'),
+    )
+
 # Transaction Model
 class Transaction(db.Model):
     __tablename__ = 'transactions'
@@ -261,3 +285,57 @@ class StoryInteraction(db.Model):
     __table_args__ = (
         db.UniqueConstraint('user_id', 'story_id', name='idx_interactions_user_story'),
     )
+
+# Daily Activity Rollup Model (maintained by activity_rollup on every flush)
+class DailyActivity(db.Model):
+    __tablename__ = 'daily_activity'
+
+    activity_date = db.Column(db.Date, primary_key=True)
+    sessions_started = db.Column(db.Integer, nullable=False, default=0)
+    completed_sessions = db.Column(db.Integer, nullable=False, default=0)  # Sessions with a recorded duration
+    session_duration_total = db.Column(db.Integer, nullable=False, default=0)
+    quiz_attempts = db.Column(db.Integer, nullable=False, default=0)
+    quiz_score_total = db.Column(db.Float, nullable=False, default=0.0)
+    quiz_time_total = db.Column(db.Float, nullable=False, default=0.0)
+
+# Daily Active User Model
+class DailyActiveUser(db.Model):
+    __tablename__ = 'daily_active_users'
+
+    activity_date = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id', ondelete='CASCADE'), primary_key=True)
+
+# User Activity Summary Model (per-user stats refreshed on logout and quiz evaluation)
+class UserActivitySummary(db.Model):
+    __tablename__ = 'user_activity_summaries'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id', ondelete='CASCADE'), primary_key=True)
+    quiz_attempts = db.Column(db.Integer, nullable=False, default=0)
+    quiz_average_score = db.Column(db.Float, nullable=False, default=0.0)
+    quiz_time_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    session_time_seconds = db.Column(db.Integer, nullable=False, default=0)  # Completed sessions only
+    active_days = db.Column(db.Integer, nullable=False, default=0)
+    last_active_date = db.Column(db.Date)
+    streak_days = db.Column(db.Integer, nullable=False, default=0)  # Consecutive active days ending on last_active_date
+    refreshed_at = db.Column(db.DateTime, default=get_current_ist, onupdate=get_current_ist)
+
+# Export Job Model (report exports produced in the background)
+class ExportJob(db.Model):
+    __tablename__ = 'export_jobs'
+
+    job_id = db.Column(db.Integer, primary_key=True)
+    requested_by = db.Column(db.Integer, db.ForeignKey('users.user_id', ondelete='CASCADE'), nullable=False, index=True)
+    report_type = db.Column(db.String(50), nullable=False)  # 'analytics' or 'chatbot'
+    period = db.Column(db.String(10), nullable=False, default='all')
+    all_users = db.Column(db.Boolean, nullable=False, default=False)  # Admin bulk export
+    compressed = db.Column(db.Boolean, nullable=False, default=False)
+    file_format = db.Column(db.String(20), nullable=False, default='csv')  # 'csv' or 'parquet'
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # 'queued', 'running', 'completed', 'failed'
+    rows_written = db.Column(db.Integer, nullable=False, default=0)
+    error_message = db.Column(db.Text)
+    file_path = db.Column(db.String(500))
+    file_size = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=get_current_ist)
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime, index=True)
@@ -0,0 +1,76 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from werkzeug.exceptions import TooManyRequests
+
+
+class TokenBucketLimiter:
+    """
+    In-memory token buckets keyed by an arbitrary id (e.g. user_id). Each
+    bucket holds up to `capacity` tokens and refills at `rate` tokens per
+    second. The least recently used buckets are dropped past `maxsize`; a
+    dropped bucket simply starts full again.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate):
+        """Takes one token. Returns (allowed, seconds until a token is available)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        retry_after = 0 if allowed else (1 - tokens) / rate if rate > 0 else math.inf
+        return allowed, retry_after
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+chatbot_rate_limiter = TokenBucketLimiter()
+
+# One semaphore per configured limit, so a config change takes effect without a restart
+_llm_slots = {}
+_llm_slots_lock = threading.Lock()
+
+
+def check_chatbot_rate_limit(user_id):
+    """
+    Spends one of the user's chatbot tokens (CHATBOT_RATE_LIMIT_BURST, refilled at
+    CHATBOT_RATE_LIMIT_PER_MINUTE). Raises 429 with Retry-After when the bucket is empty.
+    """
+    capacity = current_app.config.get('CHATBOT_RATE_LIMIT_BURST', 5)
+    rate = current_app.config.get('CHATBOT_RATE_LIMIT_PER_MINUTE', 20) / 60
+    allowed, retry_after = chatbot_rate_limiter.consume(user_id, capacity, rate)
+    if not allowed:
+        raise TooManyRequests(
+            'You are sending messages too quickly. Please wait a moment and try again.',
+            retry_after=max(1, math.ceil(retry_after)) if math.isfinite(retry_after) else None
+        )
+
+
+def acquire_llm_slot():
+    """
+    Waits up to CHATBOT_QUEUE_TIMEOUT seconds for one of CHATBOT_MAX_CONCURRENT_CALLS
+    in-flight LLM call slots. Returns the function that releases it, or raises 429.
+    """
+    limit = current_app.config.get('CHATBOT_MAX_CONCURRENT_CALLS', 8)
+    with _llm_slots_lock:
+        semaphore = _llm_slots.setdefault(limit, threading.BoundedSemaphore(limit))
+    if not semaphore.acquire(timeout=current_app.config.get('CHATBOT_QUEUE_TIMEOUT', 5)):
+        raise TooManyRequests('The chatbot is busy right now. Please try again in a moment.', retry_after=1)
+    return semaphore.release
@@ -0,0 +1,144 @@
+import csv
+import io
+from datetime import timedelta
+
+from model import db, User, QuizAttempt, Quiz, UserModuleProgress, ChatbotMessage, Topic, Module
+from api_utils import get_current_ist
+
+# Rows are pulled from the database in batches of this size while a report streams.
+REPORT_BATCH_SIZE = 500
+
+
+def get_time_filter(model_field, period):
+    """Helper function to create a time-based filter for report queries."""
+    end_date = get_current_ist()
+    if period == '1d':
+        start_date = end_date - timedelta(days=1)
+    elif period == '7d':
+        start_date = end_date - timedelta(days=7)
+    elif period == '30d':
+        start_date = end_date - timedelta(days=30)
+    else: # 'all'
+        return None
+    return model_field.between(start_date, end_date)
+
+
+def _format_time(value, fmt='%Y-%m-%d %H:%M'):
+    return value.strftime(fmt) if value else 'N/A'
+
+
+def _section_query(model, user_column, user_id, *columns):
+    """
+    Starts a section query over `model`. For one user it filters on them; for
+    all users (user_id None) it prefixes every row with the user's id and
+    username instead. Returns the query and the number of prefix columns.
+    """
+    if user_id is not None:
+        return db.session.query(*columns).select_from(model).filter(user_column == user_id), 0
+    return db.session.query(user_column, User.username, *columns).select_from(model).join(
+        User, User.user_id == user_column
+    ), 2
+
+
+def iter_quiz_attempt_rows(user_id, period):
+    """Yields [attempt id, quiz title, score, time, completed at] with one query, titles joined in."""
+    query, prefix = _section_query(
+        QuizAttempt, QuizAttempt.user_id, user_id,
+        QuizAttempt.attempt_id, Quiz.quiz_title, QuizAttempt.score_earned,
+        QuizAttempt.time_taken_seconds, QuizAttempt.completed_at
+    )
+    query = query.outerjoin(Quiz, Quiz.quiz_id == QuizAttempt.quiz_id)
+    time_filter = get_time_filter(QuizAttempt.completed_at, period)
+    if time_filter is not None:
+        query = query.filter(time_filter)
+
+    for row in query.yield_per(REPORT_BATCH_SIZE):
+        attempt_id, quiz_title, score_earned, time_taken_seconds, completed_at = row[prefix:]
+        yield list(row[:prefix]) + [attempt_id, quiz_title or 'N/A', score_earned, time_taken_seconds, _format_time(completed_at)]
+
+
+def iter_learning_progress_rows(user_id, period):
+    """Yields [topic, module, completed at] for completed topics with one query."""
+    query, prefix = _section_query(
+        UserModuleProgress, UserModuleProgress.user_id, user_id,
+        Topic.topic_title, Module.module_title, UserModuleProgress.completed_at
+    )
+    query = query.join(
+        Topic, Topic.topic_id == UserModuleProgress.topic_id
+    ).join(
+        Module, Module.module_id == Topic.module_id
+    ).filter(UserModuleProgress.completed_at.isnot(None))
+    time_filter = get_time_filter(UserModuleProgress.completed_at, period)
+    if time_filter is not None:
+        query = query.filter(time_filter)
+
+    for row in query.yield_per(REPORT_BATCH_SIZE):
+        topic_title, module_title, completed_at = row[prefix:]
+        yield list(row[:prefix]) + [topic_title, module_title, _format_time(completed_at)]
+
+
+def iter_chat_history_rows(user_id, period):
+    """Yields [timestamp, sender, message] in the order the messages were sent."""
+    query, prefix = _section_query(
+        ChatbotMessage, ChatbotMessage.user_id, user_id,
+        ChatbotMessage.sent_at, ChatbotMessage.message_type, ChatbotMessage.message_content
+    )
+    time_filter = get_time_filter(ChatbotMessage.sent_at, period)
+    if time_filter is not None:
+        query = query.filter(time_filter)
+
+    for row in query.order_by(ChatbotMessage.sent_at).yield_per(REPORT_BATCH_SIZE):
+        sent_at, message_type, message_content = row[prefix:]
+        yield list(row[:prefix]) + [_format_time(sent_at, '%Y-%m-%d %H:%M:%S'), message_type.capitalize(), message_content]
+
+
+# Sections of each report type: (title, column headers, row iterator).
+REPORT_SECTIONS = {
+    'analytics': [
+        ('Quiz Attempts', ['Attempt ID', 'Quiz Title', 'Score (%)', 'Time (sec)', 'Completed At'], iter_quiz_attempt_rows),
+        ('Learning Progress', ['Topic', 'Module', 'Completed At'], iter_learning_progress_rows),
+    ],
+    'chatbot': [
+        ('Chat History', ['Timestamp', 'Sender', 'Message'], iter_chat_history_rows),
+    ],
+}
+
+
+def iter_report_csv(report_type, user_id, username, period, on_row=None):
+    """
+    Yields a report as CSV text, a row at a time, so memory use does not
+    depend on its length. Sections without rows are left out. A user_id of
+    None reports on all users, with User ID and Username columns added.
+    on_row, if given, is called once per data row (not for metadata,
+    section headers or spacers).
+    """
+    user_headers = ['User ID', 'Username'] if user_id is None else []
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def take():
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    # Write metadata
+    writer.writerow([f"Report for: {username}"])
+    writer.writerow([f"Period: {period}"])
+    writer.writerow([]) # Spacer
+    yield take()
+
+    for title, headers, iter_rows in REPORT_SECTIONS[report_type]:
+        has_rows = False
+        for row in iter_rows(user_id, period):
+            if not has_rows:
+                writer.writerow([f'--- {title} ---'])
+                writer.writerow(user_headers + headers)
+                has_rows = True
+            writer.writerow(row)
+            if on_row:
+                on_row()
+            yield take()
+        if has_rows:
+            writer.writerow([]) # Spacer
+            yield take()
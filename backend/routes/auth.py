@@ -2,10 +2,13 @@ from flask import Blueprint
 from flask_restx import Namespace, Resource, fields, abort
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from model import db, User, UserProfile, UserSession
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 from api_utils import get_current_ist
+from activity_rollup import refresh_user_summary
+from auth_utils import load_current_user, hash_password, verify_password, password_needs_rehash
+from session_cache import get_active_session_id, invalidate_session
 import pytz
+import uuid
 
 
 # Define the auth namespace
@@ -86,7 +89,7 @@ class Signup(Resource):
             user = User(
                 email=data['email'],
                 username=data['username'],
-                password_hash=generate_password_hash(data['password']),
+                password_hash=hash_password(data['password']),
             )
             db.session.add(user)
             db.session.flush()
@@ -141,14 +144,28 @@ class Login(Resource):
             user = User.query.filter_by(username=data['username']).first()
             if not user:
                 abort(401, 'Invalid username')
-            if not check_password_hash(user.password_hash, data['password']):
+            if not verify_password(user.password_hash, data['password']):
                 abort(401, 'Invalid password')
+            if password_needs_rehash(user.password_hash):
+                user.password_hash = hash_password(data['password'])
 
             # Fetch user profile
             user_profile = UserProfile.query.filter_by(user_id=user.user_id).first()
             parent_email = user_profile.parent_email if user_profile else None
             is_premium_user = user_profile.is_premium_user if user_profile else False
 
+            # Create the session first so its id can go into the token; the
+            # session is keyed by the token's JTI rather than the token itself
+            jti = str(uuid.uuid4())
+            session = UserSession(
+                user_id=user.user_id,
+                session_token=jti,
+                login_at=get_current_ist(),
+                is_active=True
+            )
+            db.session.add(session)
+            db.session.flush()
+
             # Generate JWT
             access_token = create_access_token(
                 identity=str(user.user_id),
@@ -158,18 +175,12 @@ class Login(Resource):
                     'username': user.username,
                     'user_role': user.user_role,
                     'parent_email': parent_email,
-                    'is_premium_user': is_premium_user
+                    'is_premium_user': is_premium_user,
+                    'jti': jti,
+                    'session_id': session.session_id,
+                    'token_version': user.token_version or 0
                 }
             )
-
-            # Create session
-            session = UserSession(
-                user_id=user.user_id,
-                session_token=access_token,
-                login_at=get_current_ist(),
-                is_active=True
-            )
-            db.session.add(session)
             db.session.commit()
 
             return {
@@ -201,10 +212,8 @@ class Logout(Resource):
         """Deactivate user session and log out."""
         try:
             user_id = get_jwt_identity()
-            session = UserSession.query.filter_by(
-                user_id=user_id,
-                is_active=True
-            ).first()
+            session_id = get_active_session_id(user_id)
+            session = UserSession.query.get(session_id) if session_id else None
 
             if not session:
                 abort(404, 'No active session found')
@@ -227,7 +236,9 @@ class Logout(Resource):
             print(f"Session duration seconds: {int(session_duration_seconds)}")
 
             session.session_duration_seconds = int(session_duration_seconds)
+            refresh_user_summary(session.user_id)
             db.session.commit()
+            invalidate_session(session.session_id)
 
             return {'message': 'Logout successful'}, 200
 
@@ -247,22 +258,17 @@ class ValidateToken(Resource):
     def get(self):
         """Validate JWT token and return user details."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
-            user_profile = UserProfile.query.filter_by(user_id=user.user_id).first()
-            parent_email = user_profile.parent_email if user_profile else None
-            is_premium_user = user_profile.is_premium_user if user_profile else False
-
             return {
                 'user_id': user.user_id,
                 'email': user.email,
                 'username': user.username,
                 'user_role': user.user_role,
-                'parent_email': parent_email,
-                'is_premium_user': is_premium_user
+                'parent_email': user.parent_email,
+                'is_premium_user': user.is_premium_user
             }, 200
 
         except Exception as e:
@@ -1,63 +1,26 @@
-import os
-from flask import request
+import json
+from flask import request, Response, stream_with_context, current_app
 from flask_restx import Namespace, Resource, fields
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import func, cast, Date
-from datetime import timedelta
-from langchain_groq import ChatGroq
-from langchain_core.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
-from langchain_core.messages import AIMessage, HumanMessage
-from model import db, User, ChatbotMessage, UserSession, UserProfile
+from sqlalchemy import func, case
+from datetime import datetime, time, timedelta
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from model import db, ChatbotMessage, UserSession, UserProfile
 from api_utils import get_current_ist
-
-# --- Service Class for LLM Interaction ---
-
-class GroqLangChainService:
-    """
-    A service class to encapsulate interactions with the Groq API using LangChain.
-    """
-    def __init__(self, api_key):
-        if not api_key:
-            raise ValueError("Groq API key is not set.")
-        # Using the model specified in your code
-        self.chat_model = ChatGroq(temperature=0.7, model_name="llama3-70b-8192", api_key=api_key)
-
-    def get_chat_response(self, chat_history, user_message):
-        """
-        Generates a chat response using a predefined system prompt and chat history.
-        """
-        system_prompt_text = (
-            "You are a friendly and encouraging financial literacy chatbot for children aged 8-14. "
-            "Your name is 'FinBot'. Your goal is to explain financial concepts in a simple, engaging, and easy-to-understand way. "
-            "Use analogies and examples that kids can relate to (like saving allowance, video game currency, or trading cards). "
-            "Keep your answers concise and positive. If a question is not related to finance, money, saving, investing, or economics, "
-            "politely steer the conversation back by saying something like, 'That's an interesting question! But my specialty is money. "
-            "Do you have any questions about saving or earning?'"
-        )
-        
-        prompt = ChatPromptTemplate.from_messages([
-            SystemMessagePromptTemplate.from_template(system_prompt_text),
-            MessagesPlaceholder(variable_name="chat_history"),
-            HumanMessagePromptTemplate.from_template("{human_input}")
-        ])
-
-        chain = prompt | self.chat_model
-        
-        response = chain.invoke({
-            "chat_history": chat_history,
-            "human_input": user_message
-        })
-        
-        return response.content
+from chatbot_cache import get_cached_reply, cache_reply
+from chatbot_backends import create_chatbot_service
+from auth_utils import load_current_user
+from session_cache import get_active_session_id
+from rate_limit import check_chatbot_rate_limit, acquire_llm_slot
+from werkzeug.exceptions import TooManyRequests
+from cache_utils import TTLCache
 
 # --- API Initialization ---
 
-# It's recommended to set your API key as an environment variable
-GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
-
-# Initialize the service
+# The backend is chosen with CHATBOT_BACKEND (see chatbot_backends.py). The
+# name groq_service is kept for the real default backend and existing callers.
 try:
-    groq_service = GroqLangChainService(api_key=GROQ_API_KEY)
+    groq_service = create_chatbot_service()
 except ValueError as e:
     print(f"Initialization Error: {e}")
     groq_service = None
@@ -95,6 +58,167 @@ stats_model = chatbot_ns.model('ChatbotStats', {
     'avg_messages_per_session': fields.Float(description='Overall average number of messages per chat session.')
 })
 
+# --- Helpers shared by the blocking and streaming endpoints ---
+
+def start_chat_turn():
+    """
+    Validates the request, stores the user's message and returns
+    (user_id, session_id, user_message_db). Aborts on any rule violation.
+    """
+    if not groq_service:
+        chatbot_ns.abort(503, "Chatbot service is currently unavailable.")
+
+    user_id = get_jwt_identity()
+    user = load_current_user()
+    if not user:
+        chatbot_ns.abort(404, "User not found.")
+
+    session_id = get_active_session_id(user_id)
+    if not session_id:
+        chatbot_ns.abort(400, "No active session found for the user.")
+
+    if not user.is_premium_user:
+        user_message_count = ChatbotMessage.query.filter_by(
+            session_id=session_id,
+            message_type='user'
+        ).count()
+        if user_message_count >= 10:
+            chatbot_ns.abort(403, 'You have reached your message limit for this session. Please upgrade to premium for unlimited chats.')
+
+    data = request.get_json()
+    user_message_text = data.get('message')
+    if not user_message_text:
+        chatbot_ns.abort(400, "Message content cannot be empty.")
+
+    # Per-user token bucket, charged only for messages that will be sent;
+    # also stops rapid double-submits
+    check_chatbot_rate_limit(user_id)
+
+    user_message_db = ChatbotMessage(
+        user_id=user_id,
+        session_id=session_id,
+        message_content=user_message_text,
+        message_type='user',
+        sent_at=get_current_ist()
+    )
+    db.session.add(user_message_db)
+    db.session.commit()
+    return user_id, session_id, user_message_db
+
+
+def estimate_tokens(text):
+    """Rough token count for prompt budgeting (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+def to_langchain_message(msg):
+    return HumanMessage(content=msg.message_content) if msg.message_type == 'user' else AIMessage(content=msg.message_content)
+
+
+def load_chat_history(user_id, session_id, before_chat_id):
+    """
+    Builds the prompt history for a turn: the session's running summary, then
+    every message after it and before the current one, dropping the oldest
+    until the estimate fits CHAT_HISTORY_TOKEN_BUDGET. refresh_chat_summary
+    keeps fewer than twice CHAT_HISTORY_MAX_TURNS turns outside the summary,
+    so nothing falls between the summary and the prompt.
+    """
+    max_messages = current_app.config.get('CHAT_HISTORY_MAX_TURNS', 6) * 2
+    token_budget = current_app.config.get('CHAT_HISTORY_TOKEN_BUDGET', 2000)
+
+    user_session = UserSession.query.get(session_id)
+    recent_messages_db = ChatbotMessage.query.filter(
+        ChatbotMessage.user_id == user_id,
+        ChatbotMessage.session_id == session_id,
+        ChatbotMessage.chat_id > (user_session.chat_summary_until_id or 0),
+        ChatbotMessage.chat_id < before_chat_id
+    ).order_by(ChatbotMessage.chat_id.desc()).limit(2 * max_messages).all()
+
+    history = []
+    if user_session.chat_summary:
+        history.append(SystemMessage(content=f"Summary of the earlier conversation: {user_session.chat_summary}"))
+        token_budget -= estimate_tokens(user_session.chat_summary)
+
+    window = []
+    for msg in recent_messages_db:
+        token_budget -= estimate_tokens(msg.message_content)
+        if token_budget < 0:
+            break
+        window.append(to_langchain_message(msg))
+    return history + window[::-1]
+
+
+def refresh_chat_summary(session_id):
+    """
+    Folds all but the last CHAT_HISTORY_MAX_TURNS turns into the session's
+    running summary. Runs once twice that many have built up, so the
+    summarisation call happens every few turns rather than on each one; until
+    then load_chat_history sends the unsummarised messages as they are.
+    """
+    max_messages = current_app.config.get('CHAT_HISTORY_MAX_TURNS', 6) * 2
+    user_session = UserSession.query.get(session_id)
+    unsummarized = ChatbotMessage.query.filter(
+        ChatbotMessage.session_id == session_id,
+        ChatbotMessage.chat_id > (user_session.chat_summary_until_id or 0)
+    ).order_by(ChatbotMessage.chat_id.asc()).all()
+    if len(unsummarized) < 2 * max_messages:
+        return
+
+    to_fold = unsummarized[:-max_messages]
+    user_session.chat_summary = groq_service.summarize_conversation(
+        user_session.chat_summary, [to_langchain_message(msg) for msg in to_fold]
+    )
+    user_session.chat_summary_until_id = to_fold[-1].chat_id
+    db.session.commit()
+
+
+def finish_chat_turn(session_id):
+    """Post-reply housekeeping; a failure here never fails the user's turn."""
+    try:
+        refresh_chat_summary(session_id)
+    except Exception as e:
+        db.session.rollback()
+        print(f"An error occurred while summarizing the chat: {e}")
+
+
+def reserve_llm_call(user_message_db):
+    """
+    Takes one of the global in-flight LLM call slots and returns its release
+    function. If none frees up in time the user's message is withdrawn, so a
+    retry does not leave an unanswered duplicate, and the 429 is re-raised.
+    """
+    try:
+        return acquire_llm_slot()
+    except TooManyRequests:
+        db.session.delete(user_message_db)
+        db.session.commit()
+        raise
+
+
+def save_bot_reply(user_id, session_id, bot_reply_text):
+    """Stores the bot's reply and returns it in the API's message format."""
+    bot_message_db = ChatbotMessage(
+        user_id=user_id,
+        session_id=session_id,
+        message_content=bot_reply_text,
+        message_type='bot',
+        sent_at=get_current_ist()
+    )
+    db.session.add(bot_message_db)
+    db.session.commit()
+    return {
+        'sender': 'bot',
+        'text': bot_reply_text,
+        'timestamp': bot_message_db.sent_at.strftime('%I:%M %p')
+    }
+
+
+def sse_event(data, event=None):
+    """Formats one server-sent event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
 @chatbot_ns.route('/send_message')
 class SendMessage(Resource):
     @chatbot_ns.doc('send_message', security='BearerAuth')
@@ -103,72 +227,81 @@ class SendMessage(Resource):
     @jwt_required()
     def post(self):
         """Send a message to the chatbot and get a reply."""
-        if not groq_service:
-            chatbot_ns.abort(503, "Chatbot service is currently unavailable.")
+        user_id, session_id, user_message_db = start_chat_turn()
+        chat_history_for_langchain = load_chat_history(user_id, session_id, user_message_db.chat_id)
 
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        if not user:
-            chatbot_ns.abort(404, "User not found.")
-
-        user_session = UserSession.query.filter_by(user_id=user_id, is_active=True).first()
-        if not user_session:
-            chatbot_ns.abort(400, "No active session found for the user.")
-
-        if not user.profile or not user.profile.is_premium_user:
-            user_message_count = ChatbotMessage.query.filter_by(
-                session_id=user_session.session_id,
-                message_type='user'
-            ).count()
-            if user_message_count >= 10:
-                chatbot_ns.abort(403, 'You have reached your message limit for this session. Please upgrade to premium for unlimited chats.')
-
-        data = request.get_json()
-        user_message_text = data.get('message')
-        if not user_message_text:
-            chatbot_ns.abort(400, "Message content cannot be empty.")
-            
-        user_message_db = ChatbotMessage(
-            user_id=user_id,
-            session_id=user_session.session_id,
-            message_content=user_message_text,
-            message_type='user',
-            sent_at=get_current_ist()
-        )
-        db.session.add(user_message_db)
-        db.session.commit()
+        # First-turn questions don't depend on history, so their replies can be shared
+        bot_reply_text = None
+        if not chat_history_for_langchain:
+            bot_reply_text = get_cached_reply(user_message_db.message_content)
+        release_llm_slot = reserve_llm_call(user_message_db) if bot_reply_text is None else None
         
         try:
-            previous_messages_db = ChatbotMessage.query.filter_by(user_id=user_id, session_id=user_session.session_id)\
-                                                      .order_by(ChatbotMessage.sent_at.asc()).all()
-            
-            chat_history_for_langchain = [
-                HumanMessage(content=msg.message_content) if msg.message_type == 'user' else AIMessage(content=msg.message_content)
-                for msg in previous_messages_db
-            ]
-
-            bot_reply_text = groq_service.get_chat_response(chat_history_for_langchain, user_message_text)
-
-            bot_message_db = ChatbotMessage(
-                user_id=user_id,
-                session_id=user_session.session_id,
-                message_content=bot_reply_text,
-                message_type='bot',
-                sent_at=get_current_ist()
-            )
-            db.session.add(bot_message_db)
-            db.session.commit()
-            
-            bot_reply = {
-                'sender': 'bot',
-                'text': bot_reply_text,
-                'timestamp': bot_message_db.sent_at.strftime('%I:%M %p')
-            }
+            if bot_reply_text is None:
+                bot_reply_text = groq_service.get_chat_response(chat_history_for_langchain, user_message_db.message_content)
+                if not chat_history_for_langchain:
+                    cache_reply(user_message_db.message_content, bot_reply_text)
+            bot_reply = save_bot_reply(user_id, session_id, bot_reply_text)
+            finish_chat_turn(session_id)
             return {'reply': bot_reply}
         except Exception as e:
             db.session.rollback()
             print(f"An error occurred while processing the message: {e}")
             chatbot_ns.abort(500, "An error occurred while processing your message.")
+        finally:
+            if release_llm_slot:
+                release_llm_slot()
+
+@chatbot_ns.route('/send_message_stream')
+class SendMessageStream(Resource):
+    @chatbot_ns.doc('send_message_stream', security='BearerAuth', description=(
+        'Send a message and receive the reply as server-sent events: one "data: {\"token\": ...}" '
+        'event per chunk, then a "done" event carrying the saved reply, or an "error" event.'
+    ))
+    @chatbot_ns.expect(chat_request_model)
+    @jwt_required()
+    def post(self):
+        """Send a message to the chatbot and stream the reply as it is generated."""
+        user_id, session_id, user_message_db = start_chat_turn()
+        user_message_text = user_message_db.message_content
+        chat_history_for_langchain = load_chat_history(user_id, session_id, user_message_db.chat_id)
+
+        first_turn = not chat_history_for_langchain
+        cached_reply = get_cached_reply(user_message_text) if first_turn else None
+        release_llm_slot = reserve_llm_call(user_message_db) if cached_reply is None else None
+
+        def generate():
+            reply_parts = []
+            try:
+                if cached_reply is not None:
+                    tokens = [cached_reply]
+                else:
+                    tokens = groq_service.stream_chat_response(chat_history_for_langchain, user_message_text)
+                for token in tokens:
+                    reply_parts.append(token)
+                    yield sse_event({'token': token})
+                if first_turn and cached_reply is None:
+                    cache_reply(user_message_text, ''.join(reply_parts))
+                # The reply is only stored once the model has finished
+                bot_reply = save_bot_reply(user_id, session_id, ''.join(reply_parts))
+                # Clients usually close the stream as soon as they see "done",
+                # so the turn is finished before it is sent
+                finish_chat_turn(session_id)
+                yield sse_event({'reply': bot_reply}, event='done')
+            except Exception as e:
+                db.session.rollback()
+                print(f"An error occurred while streaming the message: {e}")
+                yield sse_event({'message': 'An error occurred while processing your message.'}, event='error')
+
+        response = Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        # Released when the stream ends, including when the client goes away
+        if release_llm_slot:
+            response.call_on_close(release_llm_slot)
+        return response
 
 @chatbot_ns.route('/chat_history')
 class ChatHistory(Resource):
@@ -178,11 +311,11 @@ class ChatHistory(Resource):
     def get(self):
         """Retrieve the user's chat history for the current session."""
         user_id = get_jwt_identity()
-        user_session = UserSession.query.filter_by(user_id=user_id, is_active=True).first()
-        if not user_session:
+        session_id = get_active_session_id(user_id)
+        if not session_id:
             return {'history': []}
 
-        messages_db = ChatbotMessage.query.filter_by(session_id=user_session.session_id)\
+        messages_db = ChatbotMessage.query.filter_by(session_id=session_id)\
                                           .order_by(ChatbotMessage.sent_at.asc()).all()
         history = [
             {
@@ -195,6 +328,54 @@ class ChatHistory(Resource):
     
 
 
+# Admin dashboard statistics by day, kept for CHATBOT_STATS_CACHE_TTL seconds
+_stats_cache = TTLCache(maxsize=1)
+
+
+def compute_chatbot_stats(today):
+    """
+    Computes the chatbot usage statistics in a single query: messages are
+    grouped per user (a covering index scan), and the per-user rows are then
+    folded with conditional aggregates. Sessions belong to one user, so the
+    per-user distinct session counts add up to the overall session count.
+    """
+    today_start = datetime.combine(today, time.min)
+    seven_days_ago = today_start - timedelta(days=7)
+
+    per_user = db.session.query(
+        ChatbotMessage.user_id.label('user_id'),
+        func.count(ChatbotMessage.chat_id).label('messages'),
+        func.count(case((ChatbotMessage.message_type == 'user', 1))).label('user_messages'),
+        func.count(func.distinct(ChatbotMessage.session_id)).label('sessions'),
+        func.max(ChatbotMessage.sent_at).label('last_sent_at')
+    ).group_by(ChatbotMessage.user_id).subquery()
+
+    (total_messages, total_user_messages, unique_users_chatted, premium_users_chatted,
+     non_premium_users_chatted, active_users_today, active_users_last_7_days, total_sessions) = db.session.query(
+        func.coalesce(func.sum(per_user.c.messages), 0),
+        func.coalesce(func.sum(per_user.c.user_messages), 0),
+        func.count(per_user.c.user_id),
+        func.count(case((UserProfile.is_premium_user == True, 1))),
+        func.count(case((UserProfile.is_premium_user == False, 1))),
+        func.count(case((per_user.c.last_sent_at >= today_start, 1))),
+        func.count(case((per_user.c.last_sent_at >= seven_days_ago, 1))),
+        func.coalesce(func.sum(per_user.c.sessions), 0)
+    ).select_from(per_user).outerjoin(UserProfile, UserProfile.user_id == per_user.c.user_id).one()
+
+    return {
+        'total_messages': total_messages,
+        'total_user_messages': total_user_messages,
+        'total_bot_responses': total_messages - total_user_messages,
+        'unique_users_chatted': unique_users_chatted,
+        'premium_users_chatted': premium_users_chatted,
+        'non_premium_users_chatted': non_premium_users_chatted,
+        'active_users_today': active_users_today,
+        'active_users_last_7_days': active_users_last_7_days,
+        'avg_messages_per_user': round(total_user_messages / unique_users_chatted, 2) if unique_users_chatted else 0,
+        'avg_messages_per_session': round(total_messages / total_sessions, 2) if total_sessions else 0
+    }
+
+
 @chatbot_ns.route('/chatbot_stats')
 class ChatbotStats(Resource):
     @chatbot_ns.doc('get_chatbot_stats', security='BearerAuth')
@@ -202,67 +383,17 @@ class ChatbotStats(Resource):
     @jwt_required()
     def get(self):
         """Retrieve expanded, overall statistics about chatbot usage."""
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        user = load_current_user()
         if not user or user.user_role != 'admin':
             chatbot_ns.abort(403, 'Admin access required to view statistics.')
 
         try:
-            # --- Overall Message Counts ---
-            total_messages = db.session.query(func.count(ChatbotMessage.chat_id)).scalar() or 0
-            total_user_messages = db.session.query(func.count(ChatbotMessage.chat_id)).filter(ChatbotMessage.message_type == 'user').scalar() or 0
-            total_bot_responses = total_messages - total_user_messages
-            
-            # --- Unique User Counts ---
-            unique_users_chatted = db.session.query(func.count(func.distinct(ChatbotMessage.user_id))).scalar() or 0
-            
-            # --- Premium vs. Non-Premium User Counts ---
-            premium_users_chatted = db.session.query(func.count(func.distinct(User.user_id)))\
-                .join(UserProfile).join(ChatbotMessage)\
-                .filter(UserProfile.is_premium_user == True).scalar() or 0
-            
-            non_premium_users_chatted = db.session.query(func.count(func.distinct(User.user_id)))\
-                .join(UserProfile).join(ChatbotMessage)\
-                .filter(UserProfile.is_premium_user == False).scalar() or 0
-
-            # --- User Activity / Frequency ---
             today = get_current_ist().date()
-            seven_days_ago = today - timedelta(days=7)
-            
-            active_users_today = db.session.query(func.count(func.distinct(ChatbotMessage.user_id)))\
-                .filter(cast(ChatbotMessage.sent_at, Date) == today).scalar() or 0
-            
-            active_users_last_7_days = db.session.query(func.count(func.distinct(ChatbotMessage.user_id)))\
-                .filter(ChatbotMessage.sent_at >= seven_days_ago).scalar() or 0
-
-            # --- Averages ---
-            avg_messages_per_user = 0
-            if unique_users_chatted > 0:
-                avg_messages_per_user = round(total_user_messages / unique_users_chatted, 2)
-
-            # Subquery to count messages per session
-            subquery = db.session.query(
-                ChatbotMessage.session_id,
-                func.count(ChatbotMessage.chat_id).label('message_count')
-            ).group_by(ChatbotMessage.session_id).subquery()
-            
-            # Average of the counts from the subquery
-            avg_messages_per_session_result = db.session.query(func.avg(subquery.c.message_count)).scalar() or 0
-            avg_messages_per_session = round(float(avg_messages_per_session_result), 2)
-
-
-            return {
-                'total_messages': total_messages,
-                'total_user_messages': total_user_messages,
-                'total_bot_responses': total_bot_responses,
-                'unique_users_chatted': unique_users_chatted,
-                'premium_users_chatted': premium_users_chatted,
-                'non_premium_users_chatted': non_premium_users_chatted,
-                'active_users_today': active_users_today,
-                'active_users_last_7_days': active_users_last_7_days,
-                'avg_messages_per_user': avg_messages_per_user,
-                'avg_messages_per_session': avg_messages_per_session
-            }
+            stats = _stats_cache.get(today)
+            if stats is None:
+                stats = compute_chatbot_stats(today)
+                _stats_cache.set(today, stats, ttl=current_app.config.get('CHATBOT_STATS_CACHE_TTL', 30))
+            return stats
         except Exception as e:
             print(f"Error fetching chatbot stats: {e}")
             chatbot_ns.abort(500, "An error occurred while fetching chatbot statistics.")
@@ -1,7 +1,8 @@
 from flask import Blueprint, request
 from flask_restx import Namespace, Resource, fields, abort
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from model import db, Transaction, User, UserProfile
+from model import db, Transaction, UserProfile
+from auth_utils import load_current_user
 from api_utils import get_current_ist
 from datetime import datetime
 
@@ -64,7 +65,7 @@ class SubmitPasscode(Resource):
     def post(self):
         try:
             user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
@@ -96,7 +97,7 @@ class CreatePasscode(Resource):
     def post(self):
         try:
             user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
@@ -128,7 +129,7 @@ class CheckPasscode(Resource):
     def get(self):
         try:
             user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
@@ -150,7 +151,7 @@ class Transactions(Resource):
     def get(self):
         try:
             user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
@@ -179,7 +180,7 @@ class Categories(Resource):
     def get(self):
         try:
             user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
@@ -203,7 +204,7 @@ class CreateTransaction(Resource):
     def post(self):
         try:
             user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
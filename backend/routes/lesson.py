@@ -1,8 +1,10 @@
 from flask import Blueprint
 from flask_restx import Namespace, Resource, fields, abort
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from model import db, Lesson, User
+from flask_jwt_extended import jwt_required
+from model import db, Lesson
+from auth_utils import load_current_user
 from api_utils import get_current_ist
+from content_cache import get_content_snapshot
 
 # Define the lesson namespace
 lesson_ns = Namespace('lesson', description='Lesson operations (Learn Module/Admin Module - Teach about so many fundamental topics like Stock Market ,Money Management, Budgeting Techniques , Financial Planning and Other Financial Literacy topics.)')
@@ -29,19 +31,11 @@ class Lessons(Resource):
     @lesson_ns.response(500, 'Unexpected error', error_model)
     def get(self):
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
-            lessons = Lesson.query.all()
-            return [{
-                'lesson_id': lesson.lesson_id,
-                'lesson_name': lesson.lesson_name,
-                'lesson_description': lesson.lesson_description,
-                'created_at': lesson.created_at,
-                'updated_at': lesson.updated_at
-            } for lesson in lessons], 200
+            return list(get_content_snapshot().lessons), 200
 
         except Exception as e:
             abort(500, f'An unexpected error occurred: {str(e)}')
\ No newline at end of file
@@ -1,8 +1,10 @@
 from flask import Blueprint
 from flask_restx import Namespace, Resource, fields, abort
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from model import db, Module, User, Lesson
+from model import db, Module
+from auth_utils import load_current_user
 from api_utils import get_current_ist
+from content_cache import resolve_content_path, get_content_snapshot
 from datetime import datetime
 
 # Define the module namespace
@@ -47,21 +49,11 @@ class Modules(Resource):
     def get(self):
         """Retrieve all modules."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
-            modules = Module.query.filter_by(deleted_at=None).all()
-            return [{
-                'module_id': module.module_id,
-                'lesson_id': module.lesson_id,
-                'created_by_admin_id': module.created_by_admin_id,
-                'module_title': module.module_title,
-                'module_description': module.module_description,
-                'created_at': module.created_at,
-                'updated_at': module.updated_at
-            } for module in modules], 200
+            return list(get_content_snapshot().modules), 200
 
         except Exception as e:
             abort(500, f'An unexpected error occurred: {str(e)}')
@@ -77,25 +69,13 @@ class ModulesByLesson(Resource):
     def get(self, lesson_id):
         """Retrieve all modules for a specific lesson."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            modules = Module.query.filter_by(lesson_id=lesson_id, deleted_at=None).all()
-            return [{
-                'module_id': module.module_id,
-                'lesson_id': module.lesson_id,
-                'created_by_admin_id': module.created_by_admin_id,
-                'module_title': module.module_title,
-                'module_description': module.module_description,
-                'created_at': module.created_at,
-                'updated_at': module.updated_at
-            } for module in modules], 200
+            snapshot = get_content_snapshot()
+            snapshot.validate_path(lesson_id)
+            return list(snapshot.modules_by_lesson.get(lesson_id, ())), 200
 
         except Exception as e:
             abort(500, f'An unexpected error occurred: {str(e)}')
@@ -115,13 +95,11 @@ class CreateModule(Resource):
         """Create a new module."""
         try:
             user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user or user.user_role != 'admin':
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
+            resolve_content_path(lesson_id)
 
             data = module_ns.payload
             if not data.get('module_title'):
@@ -165,18 +143,12 @@ class UpdateModule(Resource):
     def put(self, lesson_id, module_id):
         """Update a module."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user or user.user_role != 'admin':
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
+            resolve_content_path(lesson_id, module_id, use_cache=False)
+            module = Module.query.get(module_id)
 
             data = module_ns.payload
             if 'module_title' in data:
@@ -213,18 +185,12 @@ class DeleteModule(Resource):
     def delete(self, lesson_id, module_id):
         """Delete a module (soft delete)."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user or user.user_role != 'admin':
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
+            resolve_content_path(lesson_id, module_id, use_cache=False)
+            module = Module.query.get(module_id)
 
             module.deleted_at = get_current_ist()
             db.session.commit()
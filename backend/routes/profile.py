@@ -3,7 +3,7 @@ from flask_restx import Namespace, Resource, fields, abort
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from model import db, User, UserProfile, UserSession
 from api_utils import get_current_ist
-from werkzeug.security import generate_password_hash
+from auth_utils import hash_password
 from datetime import datetime
 
 # Define the profile namespace
@@ -161,7 +161,7 @@ class ParentEmail(Resource):
                 abort(400, 'Parent email and password are required')
 
             user_profile.parent_email = data['parent_email']
-            user_profile.parent_password_hash = generate_password_hash(data['parent_password'])
+            user_profile.parent_password_hash = hash_password(data['parent_password'])
             user_profile.updated_at = get_current_ist()
             db.session.commit()
 
@@ -1,11 +1,18 @@
-from flask import Blueprint, request
+from flask import Blueprint, request, current_app
 from flask_restx import Namespace, Resource, fields, abort
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from model import db, Quiz, Question, User, Topic, Module, Lesson, QuizAttempt, QuestionAttempt, UserModuleProgress
+from model import db, Quiz, Question, Topic, Module, Lesson, QuizAttempt, QuestionAttempt, UserModuleProgress
+from auth_utils import load_current_user
+from activity_rollup import refresh_user_summary
 from api_utils import get_current_ist
-from datetime import datetime
+from content_cache import resolve_content_path, get_content_snapshot, get_answer_key, mark_content_changed, mark_questions_changed
+from cache_utils import TTLCache
+from answer_buffer import answer_buffer, buffer_answers, queue_answer, write_question_attempts
 import hashlib
-from sqlalchemy.sql import func
+import uuid
+import csv
+import io
+from sqlalchemy import insert
 
 # Define the Blueprint
 quiz_bp = Blueprint('quiz', __name__)
@@ -70,6 +77,17 @@ create_question_model = quiz_ns.model('CreateQuestion', {
     'score_points': fields.Integer(description='Score points', default=1)
 })
 
+import_error_model = quiz_ns.model('ImportError', {
+    'row': fields.Integer(description='1-based row number in the submitted data'),
+    'message': fields.String(description='Why the row was rejected')
+})
+
+import_questions_response_model = quiz_ns.model('ImportQuestionsResponse', {
+    'message': fields.String(description='Import outcome'),
+    'imported': fields.Integer(description='Number of questions inserted'),
+    'errors': fields.List(fields.Nested(import_error_model), description='Per-row validation errors')
+})
+
 update_question_model = quiz_ns.model('UpdateQuestion', {
     'question_text': fields.String(description='Question text'),
     'option1': fields.String(description='Option 1'),
@@ -156,59 +174,13 @@ class QuizzesByTopic(Resource):
         """Retrieve all quizzes for a specific topic with question count and total score."""
         try:
             # --- User and path validation (remains the same) ---
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
-
-            # 1. Create a subquery for question count and total score
-            question_stats = db.session.query(
-                Question.quiz_id,
-                func.count(Question.question_id).label('total_questions'),
-                func.sum(Question.score_points).label('total_score')
-            ).filter(Question.deleted_at.is_(None)).group_by(Question.quiz_id).subquery()
-
-            # 2. Join the Quiz query with the subquery
-            quizzes_with_stats = db.session.query(
-                Quiz,
-                question_stats.c.total_questions,
-                question_stats.c.total_score
-            ).outerjoin(
-                question_stats, Quiz.quiz_id == question_stats.c.quiz_id
-            ).filter(
-                Quiz.topic_id == topic_id,
-                Quiz.deleted_at.is_(None)
-            ).all()
-
-            # 3. Format the response data
-            results = []
-            for quiz, total_questions, total_score in quizzes_with_stats:
-                results.append({
-                    'quiz_id': quiz.quiz_id,
-                    'module_id': quiz.module_id,
-                    'topic_id': quiz.topic_id,
-                    'quiz_title': quiz.quiz_title,
-                    'duration_minutes': quiz.duration_minutes,
-                    'is_visible': quiz.is_visible,
-                    'created_at': quiz.created_at,
-                    'updated_at': quiz.updated_at,
-                    'total_questions': total_questions or 0,
-                    'total_score': int(total_score) if total_score is not None else 0
-                })
-            
-            return results, 200
+            snapshot = get_content_snapshot()
+            snapshot.validate_path(lesson_id, module_id, topic_id)
+            return list(snapshot.quizzes_by_topic.get(topic_id, ())), 200
 
         except Exception as e:
             abort(500, f'An unexpected error occurred: {str(e)}')
@@ -228,21 +200,11 @@ class CreateQuiz(Resource):
         """Create a new quiz for a topic."""
         try:
             user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user or user.user_role != 'admin':
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
+            resolve_content_path(lesson_id, module_id, topic_id)
 
             data = quiz_ns.payload
             if not data.get('quiz_title') or not data.get('duration_minutes'):
@@ -290,26 +252,12 @@ class UpdateQuizVisibility(Resource):
     def put(self, lesson_id, module_id, topic_id, quiz_id):
         """Update quiz visibility."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user or user.user_role != 'admin':
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
-
-            quiz = Quiz.query.filter_by(quiz_id=quiz_id, module_id=module_id, topic_id=topic_id, deleted_at=None).first()
-            if not quiz:
-                abort(404, 'Quiz not found')
+            resolve_content_path(lesson_id, module_id, topic_id, quiz_id, use_cache=False)
+            quiz = Quiz.query.get(quiz_id)
 
             data = quiz_ns.payload
             quiz.is_visible = data['is_visible']
@@ -343,26 +291,12 @@ class DeleteQuiz(Resource):
     def delete(self, lesson_id, module_id, topic_id, quiz_id):
         """Delete a quiz (soft delete)."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user or user.user_role != 'admin':
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
-
-            quiz = Quiz.query.filter_by(quiz_id=quiz_id, module_id=module_id, topic_id=topic_id, deleted_at=None).first()
-            if not quiz:
-                abort(404, 'Quiz not found')
+            resolve_content_path(lesson_id, module_id, topic_id, quiz_id, use_cache=False)
+            quiz = Quiz.query.get(quiz_id)
 
             quiz.deleted_at = get_current_ist()
             db.session.commit()
@@ -384,26 +318,11 @@ class QuestionsByQuiz(Resource):
     def get(self, lesson_id, module_id, topic_id, quiz_id):
         """Retrieve all questions for a specific quiz."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(403, 'User not found or access denied')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
-
-            quiz = Quiz.query.filter_by(quiz_id=quiz_id, module_id=module_id, topic_id=topic_id, deleted_at=None).first()
-            if not quiz:
-                abort(404, 'Quiz not found')
+            resolve_content_path(lesson_id, module_id, topic_id, quiz_id)
 
             questions = Question.query.filter_by(quiz_id=quiz_id, deleted_at=None).all()
             return [{
@@ -438,25 +357,11 @@ class CreateQuestion(Resource):
         """Create a new question for a quiz."""
         try:
             user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user or user.user_role != 'admin':
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
-
-            quiz = Quiz.query.filter_by(quiz_id=quiz_id, module_id=module_id, topic_id=topic_id, deleted_at=None).first()
-            if not quiz:
-                abort(404, 'Quiz not found')
+            resolve_content_path(lesson_id, module_id, topic_id, quiz_id)
 
             data = quiz_ns.payload
             required_fields = ['question_text', 'option1', 'option2', 'option3', 'option4', 'correct_answer']
@@ -503,6 +408,105 @@ class CreateQuestion(Resource):
             db.session.rollback()
             abort(500, f'An unexpected error occurred: {str(e)}')
 
+# --- Helpers for bulk question import ---
+
+QUESTION_FIELDS = ['question_text', 'option1', 'option2', 'option3', 'option4', 'correct_answer']
+
+
+def read_question_rows():
+    """Reads import rows from an uploaded CSV file (questions_file) or a JSON array body."""
+    if 'questions_file' in request.files:
+        stream = io.TextIOWrapper(request.files['questions_file'].stream, encoding='utf-8-sig')
+        return list(csv.DictReader(stream))
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('questions')
+    if not isinstance(data, list):
+        abort(400, 'Provide a JSON array of questions or a CSV file named questions_file')
+    return data
+
+
+def validate_question_row(row):
+    """Applies the CreateQuestion rules to one import row. Returns (values, error message)."""
+    if not isinstance(row, dict):
+        return None, 'Row must be an object'
+
+    values = {field: str(row.get(field) or '').strip() for field in QUESTION_FIELDS}
+    missing = [field for field in QUESTION_FIELDS if not values[field]]
+    if missing:
+        return None, f"Missing required fields: {', '.join(missing)}"
+
+    if values['correct_answer'] not in [values['option1'], values['option2'], values['option3'], values['option4']]:
+        return None, 'Correct answer must be one of the provided options'
+
+    score_points = row.get('score_points')
+    if score_points in (None, ''):
+        score_points = 1
+    try:
+        score_points = int(score_points)
+    except (TypeError, ValueError):
+        return None, 'Score points must be an integer'
+    if score_points <= 0:
+        return None, 'Score points must be positive'
+
+    values['score_points'] = score_points
+    return values, None
+
+
+@quiz_ns.route('/<int:lesson_id>/module/<int:module_id>/topic/<int:topic_id>/quizzes/<int:quiz_id>/questions/import')
+class ImportQuestions(Resource):
+    @quiz_ns.doc('import_questions', description='Bulk import questions from a JSON array or a CSV file (questions_file). Nothing is imported if any row is invalid.', security='BearerAuth')
+    @jwt_required()
+    @quiz_ns.response(201, 'Questions imported', import_questions_response_model)
+    @quiz_ns.response(400, 'Invalid input; per-row errors are listed', import_questions_response_model)
+    @quiz_ns.response(401, 'Unauthorized: Missing or invalid token', error_model)
+    @quiz_ns.response(403, 'Admin access required', error_model)
+    @quiz_ns.response(404, 'Lesson, module, topic, or quiz not found', error_model)
+    @quiz_ns.response(500, 'Unexpected error', error_model)
+    def post(self, lesson_id, module_id, topic_id, quiz_id):
+        """Bulk import questions into a quiz in a single transaction."""
+        try:
+            user_id = get_jwt_identity()
+            user = load_current_user()
+            if not user or user.user_role != 'admin':
+                abort(403, 'Admin access required')
+
+            resolve_content_path(lesson_id, module_id, topic_id, quiz_id)
+
+            rows = read_question_rows()
+            if not rows:
+                abort(400, 'No questions to import')
+
+            now = get_current_ist()
+            new_questions, errors = [], []
+            for row_number, row in enumerate(rows, start=1):
+                values, error = validate_question_row(row)
+                if error:
+                    errors.append({'row': row_number, 'message': error})
+                    continue
+                new_questions.append({
+                    **values,
+                    'quiz_id': quiz_id,
+                    'created_by_admin_id': user_id,
+                    'created_at': now,
+                    'updated_at': now
+                })
+
+            if errors:
+                return {'message': 'No questions were imported', 'imported': 0, 'errors': errors}, 400
+
+            # One executemany for the whole batch
+            db.session.execute(insert(Question), new_questions)
+            mark_content_changed(db.session)
+            mark_questions_changed(db.session, [quiz_id])
+            db.session.commit()
+
+            return {'message': f'{len(new_questions)} questions imported', 'imported': len(new_questions), 'errors': []}, 201
+        except Exception as e:
+            db.session.rollback()
+            abort(500, f'An unexpected error occurred: {str(e)}')
+
 @quiz_ns.route('/<int:lesson_id>/module/<int:module_id>/topic/<int:topic_id>/quizzes/<int:quiz_id>/question/<int:question_id>/update')
 class UpdateQuestion(Resource):
     @quiz_ns.doc('update_question', description='Update a question.', security='BearerAuth')
@@ -517,26 +521,11 @@ class UpdateQuestion(Resource):
     def put(self, lesson_id, module_id, topic_id, quiz_id, question_id):
         """Update a question."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user or user.user_role != 'admin':
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
-
-            quiz = Quiz.query.filter_by(quiz_id=quiz_id, module_id=module_id, topic_id=topic_id, deleted_at=None).first()
-            if not quiz:
-                abort(404, 'Quiz not found')
+            resolve_content_path(lesson_id, module_id, topic_id, quiz_id)
 
             question = Question.query.filter_by(question_id=question_id, quiz_id=quiz_id, deleted_at=None).first()
             if not question:
@@ -601,26 +590,11 @@ class DeleteQuestion(Resource):
     def delete(self, lesson_id, module_id, topic_id, quiz_id, question_id):
         """Delete a question (soft delete)."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user or user.user_role != 'admin':
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
-
-            quiz = Quiz.query.filter_by(quiz_id=quiz_id, module_id=module_id, topic_id=topic_id, deleted_at=None).first()
-            if not quiz:
-                abort(404, 'Quiz not found')
+            resolve_content_path(lesson_id, module_id, topic_id, quiz_id)
 
             question = Question.query.filter_by(question_id=question_id, quiz_id=quiz_id, deleted_at=None).first()
             if not question:
@@ -635,6 +609,28 @@ class DeleteQuestion(Resource):
             abort(500, f'An unexpected error occurred: {str(e)}')
 
 
+# --- Helpers for quiz attempts ---
+
+# Access tokens never change once issued, so token -> attempt_id is safe to
+# keep for as long as it stays in the LRU.
+_attempt_token_cache = TTLCache(maxsize=10000)
+
+
+def find_attempt_by_token(access_token):
+    """Returns the QuizAttempt for an access token, or None, via the token cache and a primary-key get."""
+    attempt_id = _attempt_token_cache.get(access_token)
+    if attempt_id is not None:
+        attempt = db.session.get(QuizAttempt, attempt_id)
+        if attempt:
+            return attempt
+        _attempt_token_cache.pop(access_token)
+
+    attempt = QuizAttempt.query.filter_by(quiz_attempt_access_token=access_token).first()
+    if attempt:
+        _attempt_token_cache.set(access_token, attempt.attempt_id, ttl=current_app.config.get('ATTEMPT_TOKEN_CACHE_TTL', 3600))
+    return attempt
+
+
 # --- API Endpoint ---
 @quiz_ns.route('/quiz_details/<string:access_token>')
 @quiz_ns.param('access_token', 'The access token for a specific quiz attempt.')
@@ -651,7 +647,7 @@ class QuizDetails(Resource):
         try:
             user_id = get_jwt_identity()
             # 1. Find the quiz attempt using the access token
-            attempt = QuizAttempt.query.filter_by(quiz_attempt_access_token=access_token).first()
+            attempt = find_attempt_by_token(access_token)
             if not attempt:
                 abort(404, 'Quiz attempt not found.')
             
@@ -673,6 +669,8 @@ class QuizDetails(Resource):
                 qa.question_id: qa.selected_answer
                 for qa in QuestionAttempt.query.filter_by(attempt_id=attempt.attempt_id).all()
             }
+            # Answers still waiting in the autosave buffer are newer than the saved ones
+            saved_answers.update(answer_buffer.pending_for(attempt.attempt_id))
 
             # 7. Structure the response
             response_questions = []
@@ -716,7 +714,7 @@ class StartQuiz(Resource):
         """Start a new quiz attempt."""
         try:
             user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(401, 'User not found')
 
@@ -754,13 +752,15 @@ class StartQuiz(Resource):
                 progress.last_accessed_at = get_current_ist()
             db.session.commit()
 
-            # Generate quiz_attempt_access_token
+            # Generate quiz_attempt_access_token; the random part keeps it unique
+            # when the same user starts the same quiz twice within a second
             timestamp = get_current_ist().strftime('%Y%m%d%H%M%S')
-            token_base = f"{timestamp}_{user_id}_{data['quiz_id']}_{topic.topic_id}_{module.module_id}_{lesson.lesson_id}"
+            token_base = f"{timestamp}_{user_id}_{data['quiz_id']}_{topic.topic_id}_{module.module_id}_{lesson.lesson_id}_{uuid.uuid4().hex}"
             quiz_attempt_access_token = hashlib.sha256(token_base.encode()).hexdigest()
 
-            total_questions = Question.query.filter_by(quiz_id=data['quiz_id'], deleted_at=None).count()
-            total_score_possible = Question.query.filter_by(quiz_id=data['quiz_id'], deleted_at=None).with_entities(func.sum(Question.score_points)).scalar() or 0
+            answer_key = get_answer_key(quiz.quiz_id)
+            total_questions = answer_key.total_questions
+            total_score_possible = answer_key.total_score
 
             attempt = QuizAttempt(
                 user_id=user_id,
@@ -802,7 +802,7 @@ class SaveAnswer(Resource):
             abort(400, 'Missing required fields')
 
         # Fetch the quiz attempt by access token
-        attempt = QuizAttempt.query.filter_by(quiz_attempt_access_token=data['quiz_attempt_access_token']).first()
+        attempt = find_attempt_by_token(data['quiz_attempt_access_token'])
         if not attempt:
             abort(404, 'Quiz attempt not found')
 
@@ -811,34 +811,42 @@ class SaveAnswer(Resource):
             abort(403, 'Quiz attempt already completed')
 
         # print(f"Attempt found: {attempt.quiz_attempt_access_token}, User ID: {attempt.user_id}")
-        question = Question.query.filter_by(question_id=data['question_id'], quiz_id=attempt.quiz_id, deleted_at=None).first()
+        question = get_answer_key(attempt.quiz_id).get(data['question_id'])
         if not question:
             abort(404, 'Question not found')
         
         # print(f"Selected answer: {data['selected_answer']}, Correct answer: {question.correct_answer}")
-        if data['selected_answer'] not in [question.option1, question.option2, question.option3, question.option4]:
+        if data['selected_answer'] not in question.options:
             abort(400, 'Selected answer must be one of the provided options')
         
+        # In buffered mode the answer is queued and written later in a batch
+        if buffer_answers():
+            try:
+                queue_answer(
+                    attempt.attempt_id,
+                    user_id,
+                    data['question_id'],
+                    data['selected_answer'],
+                    data['selected_answer'] == question.correct_answer,
+                    get_current_ist()
+                )
+            except Exception as e:
+                abort(500, f'An unexpected error occurred: {str(e)}')
+            return {'message': 'Answer saved successfully'}, 200
+
         # === The try block should only protect the database transaction ===
         # print(f"Processing answer for question ID: {data['question_id']}, Selected answer: {data['selected_answer']}")
         try:
-            # Update or create question attempt
-            existing_attempt = QuestionAttempt.query.filter_by(attempt_id=attempt.attempt_id, question_id=data['question_id']).first()
-            if existing_attempt:
-                existing_attempt.selected_answer = data['selected_answer']
-                existing_attempt.is_correct = (data['selected_answer'] == question.correct_answer)
-                existing_attempt.attempted_at = get_current_ist()
-            else:
-                new_attempt = QuestionAttempt(
-                    attempt_id=attempt.attempt_id,
-                    user_id=user_id,
-                    question_id=data['question_id'],
-                    selected_answer=data['selected_answer'],
-                    is_correct=(data['selected_answer'] == question.correct_answer),
-                    attempted_at=get_current_ist()
-                )
-                db.session.add(new_attempt)
-
+            # Update or create question attempt with one upsert, so two saves
+            # of a new question arriving together cannot both insert
+            write_question_attempts([{
+                'attempt_id': attempt.attempt_id,
+                'user_id': user_id,
+                'question_id': data['question_id'],
+                'selected_answer': data['selected_answer'],
+                'is_correct': data['selected_answer'] == question.correct_answer,
+                'attempted_at': get_current_ist()
+            }])
             db.session.commit()
             return {'message': 'Answer saved successfully'}, 200
         except Exception as e:
@@ -857,18 +865,29 @@ class EvaluateQuiz(Resource):
     @quiz_ns.response(500, 'Unexpected error', error_model)
     def post(self):
         """Evaluate and submit quiz."""
+        buffered_answers = []
         try:
             user_id = get_jwt_identity()
             data = quiz_ns.payload
-            attempt = QuizAttempt.query.filter_by(quiz_attempt_access_token=data['quiz_attempt_access_token']).first()
+            attempt = find_attempt_by_token(data['quiz_attempt_access_token'])
             if not attempt:
                 abort(404, 'Quiz attempt not found')
 
             if attempt.completed_at:
                 abort(400, 'Quiz already submitted')
 
-            # Validate all questions are answered
-            total_questions = Question.query.filter_by(quiz_id=attempt.quiz_id, deleted_at=None).count()
+            # Validation and scoring use the quiz's cached answer key, so the
+            # query count does not grow with the quiz length
+            answer_key = get_answer_key(attempt.quiz_id)
+            total_questions = answer_key.total_questions
+
+            # Autosaved answers still in the buffer are written along with the
+            # submitted responses, which take precedence over them
+            buffered_answers = answer_buffer.take(attempt.attempt_id)
+            answers = {entry['question_id']: entry for entry in buffered_answers}
+
+            # Validate and score in memory
+            now = get_current_ist()
             total_score = 0
             question_ids = set()
             for response in data['responses']:
@@ -876,32 +895,28 @@ class EvaluateQuiz(Resource):
                     abort(400, 'Duplicate question ID in responses')
                 question_ids.add(response['question_id'])
 
-                question = Question.query.filter_by(question_id=response['question_id'], quiz_id=attempt.quiz_id, deleted_at=None).first()
+                question = answer_key.get(response['question_id'])
                 if not question:
                     abort(404, f'Question {response["question_id"]} not found')
-                if response['selected_option'] not in [question.option1, question.option2, question.option3, question.option4]:
+                if response['selected_option'] not in question.options:
                     abort(400, f'Invalid option for question {response["question_id"]}')
 
-                # Save or update question attempt
-                existing_attempt = QuestionAttempt.query.filter_by(attempt_id=attempt.attempt_id, question_id=response['question_id']).first()
-                if existing_attempt:
-                    existing_attempt.selected_answer = response['selected_option']
-                    existing_attempt.is_correct = (response['selected_option'] == question.correct_answer)
-                    existing_attempt.attempted_at = get_current_ist()
-                else:
-                    new_attempt = QuestionAttempt(
-                        attempt_id=attempt.attempt_id,
-                        user_id=user_id,
-                        question_id=response['question_id'],
-                        selected_answer=response['selected_option'],
-                        is_correct=(response['selected_option'] == question.correct_answer),
-                        attempted_at=get_current_ist()
-                    )
-                    db.session.add(new_attempt)
-
-                if response['selected_option'] == question.correct_answer:
+                is_correct = response['selected_option'] == question.correct_answer
+                answers[response['question_id']] = {
+                    'attempt_id': attempt.attempt_id,
+                    'user_id': user_id,
+                    'question_id': response['question_id'],
+                    'selected_answer': response['selected_option'],
+                    'is_correct': is_correct,
+                    'attempted_at': now
+                }
+
+                if is_correct:
                     total_score += question.score_points
 
+            # Write all question attempts with one bulk upsert
+            write_question_attempts(list(answers.values()))
+
             # Update progress
             progress = UserModuleProgress.query.filter_by(user_id=user_id, module_id=attempt.quiz.module_id, topic_id=attempt.quiz.topic_id).first()
             if progress:
@@ -927,6 +942,7 @@ class EvaluateQuiz(Resource):
                 attempt.time_taken_seconds = 0
             # --- END CORRECTION ---
 
+            refresh_user_summary(attempt.user_id)
             db.session.commit()
 
             return {
@@ -936,6 +952,7 @@ class EvaluateQuiz(Resource):
             }, 200
         except Exception as e:
             db.session.rollback()
+            answer_buffer.requeue(buffered_answers)
             # Log the full exception for debugging
             print(f"Error in /evaluate_quiz: {e}")
             import traceback
@@ -949,6 +966,7 @@ quiz_ns.add_resource(CreateQuiz, '/<int:lesson_id>/module/<int:module_id>/topic/
 quiz_ns.add_resource(UpdateQuizVisibility, '/<int:lesson_id>/module/<int:module_id>/topic/<int:topic_id>/quizzes/<int:quiz_id>/visibility')
 quiz_ns.add_resource(DeleteQuiz, '/<int:lesson_id>/module/<int:module_id>/topic/<int:topic_id>/quizzes/<int:quiz_id>/delete')
 quiz_ns.add_resource(QuestionsByQuiz, '/<int:lesson_id>/module/<int:module_id>/topic/<int:topic_id>/quizzes/<int:quiz_id>/questions')
+quiz_ns.add_resource(ImportQuestions, '/<int:lesson_id>/module/<int:module_id>/topic/<int:topic_id>/quizzes/<int:quiz_id>/questions/import')
 quiz_ns.add_resource(CreateQuestion, '/<int:lesson_id>/module/<int:module_id>/topic/<int:topic_id>/quizzes/<int:quiz_id>/question/create')
 quiz_ns.add_resource(UpdateQuestion, '/<int:lesson_id>/module/<int:module_id>/topic/<int:topic_id>/quizzes/<int:quiz_id>/question/<int:question_id>/update')
 quiz_ns.add_resource(DeleteQuestion, '/<int:lesson_id>/module/<int:module_id>/topic/<int:topic_id>/quizzes/<int:quiz_id>/question/<int:question_id>/delete')
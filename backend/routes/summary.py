@@ -1,62 +1,23 @@
-from flask import jsonify, make_response
-from flask_restx import Namespace, Resource, fields, reqparse
+import os
+
+from flask import jsonify, Response, stream_with_context, send_file
+from flask_restx import Namespace, Resource, fields, reqparse, inputs
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import func, cast, Date, desc
-from datetime import timedelta
-from werkzeug.security import check_password_hash
-import csv
-import io
+from sqlalchemy import func, desc
 
 # Import your models and utility functions
-from model import db, User, UserProfile, UserSession, QuizAttempt, Quiz, UserModuleProgress, ChatbotMessage, Topic, Module
+from model import db, User, UserProfile, UserSession, Quiz, UserModuleProgress, ExportJob
+from activity_rollup import get_activity_totals, count_active_users, get_user_summary, current_streak
+from auth_utils import load_current_user, hash_password, verify_password, password_needs_rehash
 from api_utils import get_current_ist
+from reports import iter_report_csv, REPORT_SECTIONS
+from export_jobs import enqueue_export, export_filename, get_job_progress, fail_stale_exports, is_export_expired
+from columnar_export import parquet_available
 
 # --- Namespace Definition ---
 summary_ns = Namespace('summary', description='Access detailed analytical reports or chatbot interaction history, including comprehensive user engagement summaries with graphical illustrations. Report access can be restricted through parental verification where applicable.')
 
 
-# --- Helper function to generate CSV response ---
-def json_to_csv_response(data, report_type):
-    """Generates a CSV file response from JSON data."""
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # Write metadata
-    writer.writerow([f"Report for: {data.get('username', 'N/A')}"])
-    writer.writerow([f"Period: {data.get('period', 'N/A')}"])
-    writer.writerow([]) # Spacer
-
-    if report_type == 'analytics' and data.get('quiz_attempts'):
-        writer.writerow(['--- Quiz Attempts ---'])
-        headers = ['Attempt ID', 'Quiz Title', 'Score (%)', 'Time (sec)', 'Completed At']
-        writer.writerow(headers)
-        for row in data['quiz_attempts']:
-            writer.writerow([row['attempt_id'], row['quiz_title'], row['score_earned_percent'], row['time_taken_seconds'], row['completed_at']])
-        writer.writerow([]) # Spacer
-
-    if report_type == 'analytics' and data.get('learning_progress'):
-        writer.writerow(['--- Learning Progress ---'])
-        headers = ['Topic', 'Module', 'Completed At']
-        writer.writerow(headers)
-        for row in data['learning_progress']:
-            writer.writerow([row['topic_title'], row['module_title'], row['completed_at']])
-        writer.writerow([]) # Spacer
-
-    if report_type == 'chatbot' and data.get('chat_history'):
-        writer.writerow(['--- Chat History ---'])
-        headers = ['Timestamp', 'Sender', 'Message']
-        writer.writerow(headers)
-        for row in data['chat_history']:
-            writer.writerow([row['timestamp'], row['sender'], row['message']])
-
-    output.seek(0)
-    
-    response = make_response(output.getvalue())
-    response.headers['Content-Disposition'] = f"attachment; filename={report_type}_report_{data.get('period', 'all')}.csv"
-    response.headers['Content-Type'] = 'text/csv'
-    return response
-
-
 # --- API Models for Swagger ---
 admin_summary_model = summary_ns.model('AdminDashboardSummary', {
     'total_users': fields.Integer(description='Total number of registered users'),
@@ -67,6 +28,22 @@ admin_summary_model = summary_ns.model('AdminDashboardSummary', {
     'total_quizzes': fields.Integer(description='Total number of available quizzes')
 })
 
+export_job_model = summary_ns.model('ExportJob', {
+    'job_id': fields.Integer(description='Export job ID'),
+    'report_type': fields.String(description='Report type (analytics or chatbot)'),
+    'period': fields.String(description='Time period of the report'),
+    'all_users': fields.Boolean(description='Whether the export covers all users'),
+    'compressed': fields.Boolean(description='Whether the file is gzip-compressed'),
+    'file_format': fields.String(description='csv, or parquet for the engagement dump'),
+    'status': fields.String(description='queued, running, completed or failed'),
+    'rows_written': fields.Integer(attribute=get_job_progress, description='Data rows written so far, excluding metadata, headers and spacers'),
+    'file_size': fields.Integer(description='Size of the finished file in bytes'),
+    'error_message': fields.String(description='Why the export failed'),
+    'created_at': fields.DateTime(description='When the export was requested'),
+    'completed_at': fields.DateTime(description='When the export finished'),
+    'expires_at': fields.DateTime(description='When the file will be deleted')
+})
+
 password_model = summary_ns.model('ParentPassword', {
     'password': fields.String(required=True, description='Parent password for verification')
 })
@@ -84,22 +61,23 @@ class AdminDashboardSummary(Resource):
     @jwt_required()
     def get(self):
         """Retrieve admin dashboard summary statistics"""
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        user = load_current_user()
         if not user or user.user_role != 'admin':
             summary_ns.abort(403, 'Admin access required to view statistics.')
 
         try:
             today_ist = get_current_ist().date()
             total_users = User.query.filter_by(user_role='user').count()
-            daily_active_users = db.session.query(func.count(func.distinct(UserSession.user_id)))\
-                .filter(cast(UserSession.login_at, Date) == today_ist).scalar() or 0
-            avg_duration_sec = db.session.query(func.avg(UserSession.session_duration_seconds))\
-                .filter(UserSession.session_duration_seconds.isnot(None)).scalar() or 0
+            daily_active_users = count_active_users(today_ist) or 0
+
+            # Session and quiz averages come from the daily rollups, so their
+            # cost does not grow with the session and attempt history
+            totals = get_activity_totals()
+            avg_duration_sec = totals.session_duration_total / totals.completed_sessions if totals.completed_sessions else 0
             avg_session_duration = f"{round(avg_duration_sec / 60)} Min" if avg_duration_sec else "0 Min"
-            avg_score = db.session.query(func.avg(QuizAttempt.score_earned)).scalar() or 0
+            avg_score = totals.quiz_score_total / totals.quiz_attempts if totals.quiz_attempts else 0
             avg_quiz_score = f"{round(avg_score, 1)}%"
-            avg_time_sec = db.session.query(func.avg(QuizAttempt.time_taken_seconds)).scalar() or 0
+            avg_time_sec = totals.quiz_time_total / totals.quiz_attempts if totals.quiz_attempts else 0
             avg_quiz_time = f"{round(avg_time_sec / 60)} Min" if avg_time_sec else "0 Min"
             total_quizzes = Quiz.query.filter_by(deleted_at=None).count()
 
@@ -119,20 +97,6 @@ class AdminDashboardSummary(Resource):
 period_parser = reqparse.RequestParser()
 period_parser.add_argument('period', type=str, default='30d', choices=('1d', '7d', '30d', 'all'), help='Time period for the report')
 
-def get_time_filter(model_field, period):
-    """Helper function to create a time-based filter for report queries."""
-    end_date = get_current_ist()
-    if period == '1d':
-        start_date = end_date - timedelta(days=1)
-    elif period == '7d':
-        start_date = end_date - timedelta(days=7)
-    elif period == '30d':
-        start_date = end_date - timedelta(days=30)
-    else: # 'all'
-        return None
-    return model_field.between(start_date, end_date)
-
-
 @summary_ns.route('/user-summary')
 class UserSummary(Resource):
     @summary_ns.doc('get_user_summary', security='BearerAuth')
@@ -140,52 +104,32 @@ class UserSummary(Resource):
     def get(self):
         """Fetches a comprehensive summary for the logged-in user."""
         user_id = get_jwt_identity()
-        user = User.query.options(db.joinedload(User.profile)).get(user_id)
-        if not user or not user.profile:
+        user = load_current_user()
+        if not user or not user.has_profile:
             return {'message': 'User profile not found'}, 404
 
-        # Quiz Stats
-        quiz_stats_query = db.session.query(
-            func.count(QuizAttempt.attempt_id),
-            func.avg(QuizAttempt.score_earned),
-            func.sum(QuizAttempt.time_taken_seconds)
-        ).filter(QuizAttempt.user_id == user_id).first()
-        quiz_time_sec = quiz_stats_query[2] or 0
+        # Quiz and session stats come from the user's stored summary,
+        # refreshed whenever they log out or finish a quiz
+        summary = get_user_summary(user.user_id)
+        quiz_time_sec = summary.quiz_time_seconds
         quiz_stats = {
-            'attempted': quiz_stats_query[0] or 0,
-            'averageScore': round(quiz_stats_query[1] or 0, 1),
+            'attempted': summary.quiz_attempts,
+            'averageScore': round(summary.quiz_average_score, 1),
             'totalTime': round(quiz_time_sec / 60)
         }
-        learning_stats = {
-            'modulesCompleted': UserModuleProgress.query.filter_by(user_id=user_id)
-                .filter(UserModuleProgress.progress_percentage >= 10)
-                .distinct(UserModuleProgress.module_id).count(),
-            'topicsLearned': UserModuleProgress.query.filter_by(user_id=user_id)
-                .filter(UserModuleProgress.progress_percentage >= 10)
-                .distinct(UserModuleProgress.topic_id).count()
-        }
-        print(learning_stats)
-        
-        print(f"Learning Stats: {learning_stats} for user {user_id}")
-        # Session and Overall Stats
-        all_user_sessions = UserSession.query.filter_by(user_id=user_id).filter(UserSession.session_duration_seconds.isnot(None)).all()
-        total_time_spent_sec = sum(s.session_duration_seconds for s in all_user_sessions)
-        login_dates = {s.login_at.date() for s in all_user_sessions}
-        daily_average_min = (total_time_spent_sec / len(login_dates) / 60) if login_dates else 0
-
-        # Streak Calculation
-        streak = 0
-        if login_dates:
-            sorted_dates = sorted(list(login_dates), reverse=True)
-            today = get_current_ist().date()
-            if sorted_dates[0] == today or sorted_dates[0] == today - timedelta(days=1):
-                streak = 1
-                for i in range(len(sorted_dates) - 1):
-                    if sorted_dates[i] - timedelta(days=1) == sorted_dates[i+1]:
-                        streak += 1
-                    else:
-                        break
-        
+        modules_completed, topics_learned = db.session.query(
+            func.count(func.distinct(UserModuleProgress.module_id)),
+            func.count(func.distinct(UserModuleProgress.topic_id))
+        ).filter(
+            UserModuleProgress.user_id == user_id,
+            UserModuleProgress.progress_percentage >= 10
+        ).one()
+        learning_stats = {'modulesCompleted': modules_completed, 'topicsLearned': topics_learned}
+
+        total_time_spent_sec = summary.session_time_seconds
+        daily_average_min = (total_time_spent_sec / summary.active_days / 60) if summary.active_days else 0
+        streak = current_streak(summary, get_current_ist().date())
+
         learning_time_min = round((total_time_spent_sec - quiz_time_sec) / 60)
         recent_sessions = UserSession.query.filter_by(user_id=user_id).order_by(desc(UserSession.login_at)).limit(10).all()
 
@@ -199,8 +143,8 @@ class UserSummary(Resource):
                 'labels': ['Learning', 'Quizzes'],
                 'datasets': [{'data': [max(0, learning_time_min), quiz_stats['totalTime']], 'backgroundColor': ['#34a853', '#4285f4']}]
             },
-            'isPremium': user.profile.is_premium_user,
-            'hasParentEmail': bool(user.profile.parent_email)
+            'isPremium': user.is_premium_user,
+            'hasParentEmail': bool(user.parent_email)
         }
 
 @summary_ns.route('/verify-parent-password')
@@ -217,12 +161,27 @@ class ParentPasswordVerification(Resource):
         if not user_profile or not user_profile.parent_password_hash:
             summary_ns.abort(403, 'Parent password is not set for this account.')
         
-        if check_password_hash(user_profile.parent_password_hash, password):
+        if verify_password(user_profile.parent_password_hash, password):
+            if password_needs_rehash(user_profile.parent_password_hash):
+                user_profile.parent_password_hash = hash_password(password)
+                db.session.commit()
             return jsonify({'verified': True})
         else:
             return jsonify({'verified': False})
 
 
+def check_report_access(user, report_type):
+    """Aborts unless the user may download reports of this type."""
+    if not user or not user.has_profile:
+        summary_ns.abort(404, "User not found.")
+    if not user.is_premium_user:
+        summary_ns.abort(403, "Access denied. This feature is for premium users only.")
+    if report_type == 'chatbot' and not user.parent_email:
+        summary_ns.abort(403, "Access denied. Chat history report requires a registered parent email.")
+    if report_type not in REPORT_SECTIONS:
+        summary_ns.abort(400, "Invalid report type specified.")
+
+
 @summary_ns.route('/user-reports/<string:report_type>')
 @summary_ns.param('report_type', 'The type of report to generate (analytics or chatbot)')
 class UserReports(Resource):
@@ -230,56 +189,124 @@ class UserReports(Resource):
     @jwt_required()
     def get(self, report_type):
         """Generates and returns a user report as a downloadable CSV file."""
-        user_id = get_jwt_identity()
-        user = User.query.options(db.joinedload(User.profile)).get(user_id)
-        
-        # Security Checks
-        if not user or not user.profile:
-            summary_ns.abort(404, "User not found.")
-        if not user.profile.is_premium_user:
-            summary_ns.abort(403, "Access denied. This feature is for premium users only.")
-        if report_type == 'chatbot' and not user.profile.parent_email:
-            summary_ns.abort(403, "Access denied. Chat history report requires a registered parent email.")
-        if report_type not in ['analytics', 'chatbot']:
+        user = load_current_user()
+        check_report_access(user, report_type)
+
+        args = period_parser.parse_args()
+        period = args['period']
+        return Response(
+            stream_with_context(iter_report_csv(report_type, user.user_id, user.username, period)),
+            content_type='text/csv',
+            headers={'Content-Disposition': f"attachment; filename={report_type}_report_{period}.csv"}
+        )
+
+
+# --- Report Export Jobs ---
+
+# Request parser for export options
+export_parser = period_parser.copy()
+export_parser.add_argument('compress', type=inputs.boolean, default=False, help='Gzip the exported file')
+
+@summary_ns.route('/user-reports/<string:report_type>/export')
+@summary_ns.param('report_type', 'The type of report to export (analytics or chatbot)')
+class UserReportExport(Resource):
+    @summary_ns.doc('export_user_report', security='BearerAuth', params={'period': 'Time period (1d, 7d, 30d, all)', 'compress': 'Gzip the file (true/false)'})
+    @summary_ns.marshal_with(export_job_model, code=202)
+    @jwt_required()
+    def post(self, report_type):
+        """Starts a background export of the user's report. Poll the job, then download it."""
+        user = load_current_user()
+        check_report_access(user, report_type)
+
+        args = export_parser.parse_args()
+        job = enqueue_export(user.user_id, report_type, args['period'], compressed=args['compress'])
+        return job, 202
+
+
+@summary_ns.route('/admin/user-reports/<string:report_type>/export')
+@summary_ns.param('report_type', 'The type of report to export (analytics or chatbot)')
+class AdminReportExport(Resource):
+    @summary_ns.doc('export_all_user_reports', security='BearerAuth', params={'period': 'Time period (1d, 7d, 30d, all)', 'compress': 'Gzip the file (true/false)'})
+    @summary_ns.marshal_with(export_job_model, code=202)
+    @jwt_required()
+    def post(self, report_type):
+        """Starts a background export of a report covering all users (admin only)."""
+        user = load_current_user()
+        if not user or user.user_role != 'admin':
+            summary_ns.abort(403, 'Admin access required to export reports.')
+        if report_type not in REPORT_SECTIONS:
             summary_ns.abort(400, "Invalid report type specified.")
 
+        args = export_parser.parse_args()
+        job = enqueue_export(user.user_id, report_type, args['period'], all_users=True, compressed=args['compress'])
+        return job, 202
+
+
+@summary_ns.route('/admin/engagement-export')
+class AdminEngagementExport(Resource):
+    @summary_ns.doc('export_engagement_parquet', security='BearerAuth', params={'period': 'Time period (1d, 7d, 30d, all)'})
+    @summary_ns.marshal_with(export_job_model, code=202)
+    @jwt_required()
+    def post(self):
+        """
+        Starts a background export of quiz attempts, question attempts, sessions,
+        chatbot messages and transactions for all users, as a zip of
+        date-partitioned Parquet datasets (admin only).
+        """
+        user = load_current_user()
+        if not user or user.user_role != 'admin':
+            summary_ns.abort(403, 'Admin access required to export engagement data.')
+        if not parquet_available():
+            summary_ns.abort(501, 'Parquet export requires the pyarrow package.')
+
         args = period_parser.parse_args()
-        report_data = {'username': user.username, 'period': args['period']}
-
-        if report_type == 'analytics':
-            # Fetch quiz attempts
-            quiz_query = db.session.query(QuizAttempt).filter(QuizAttempt.user_id == user_id)
-            time_filter_quiz = get_time_filter(QuizAttempt.completed_at, args['period'])
-            if time_filter_quiz is not None:
-                quiz_query = quiz_query.filter(time_filter_quiz)
-            
-            report_data['quiz_attempts'] = [{
-                'attempt_id': a.attempt_id, 'quiz_title': a.quiz.quiz_title if a.quiz else 'N/A',
-                'score_earned_percent': a.score_earned, 'time_taken_seconds': a.time_taken_seconds,
-                'completed_at': a.completed_at.strftime('%Y-%m-%d %H:%M') if a.completed_at else 'N/A'
-            } for a in quiz_query.all()]
-
-            # Fetch learning progress
-            progress_query = db.session.query(UserModuleProgress).join(Topic).join(Module).filter(UserModuleProgress.user_id == user_id, UserModuleProgress.completed_at.isnot(None))
-            time_filter_prog = get_time_filter(UserModuleProgress.completed_at, args['period'])
-            if time_filter_prog is not None:
-                progress_query = progress_query.filter(time_filter_prog)
-            
-            report_data['learning_progress'] = [{
-                'topic_title': p.topic.topic_title, 'module_title': p.topic.module.module_title,
-                'completed_at': p.completed_at.strftime('%Y-%m-%d %H:%M')
-            } for p in progress_query.all()]
-
-        elif report_type == 'chatbot':
-            # Fetch chat history
-            chat_query = db.session.query(ChatbotMessage).filter(ChatbotMessage.user_id == user_id)
-            time_filter_chat = get_time_filter(ChatbotMessage.sent_at, args['period'])
-            if time_filter_chat is not None:
-                chat_query = chat_query.filter(time_filter_chat)
-            
-            report_data['chat_history'] = [{
-                'timestamp': msg.sent_at.strftime('%Y-%m-%d %H:%M:%S'), 'sender': msg.message_type.capitalize(),
-                'message': msg.message_content
-            } for msg in chat_query.order_by(ChatbotMessage.sent_at).all()]
-
-        return json_to_csv_response(report_data, report_type)
\ No newline at end of file
+        job = enqueue_export(user.user_id, 'engagement', args['period'], all_users=True, file_format='parquet')
+        return job, 202
+
+
+EXPORT_MIMETYPES = {
+    ('csv', False): 'text/csv',
+    ('csv', True): 'application/gzip',
+    ('parquet', False): 'application/zip',
+}
+
+def get_own_export(job_id):
+    """Returns the export job if it belongs to the current user, aborting with 404 otherwise."""
+    job = ExportJob.query.get(job_id)
+    if not job or job.requested_by != int(get_jwt_identity()):
+        summary_ns.abort(404, "Export not found.")
+    return job
+
+
+@summary_ns.route('/exports/<int:job_id>')
+@summary_ns.param('job_id', 'The export job ID')
+class ExportJobStatus(Resource):
+    @summary_ns.doc('get_export_job', security='BearerAuth')
+    @summary_ns.marshal_with(export_job_model)
+    @jwt_required()
+    def get(self, job_id):
+        """Returns the status and progress of an export job."""
+        # Jobs whose worker stopped are reported as failed instead of running forever
+        fail_stale_exports()
+        return get_own_export(job_id)
+
+
+@summary_ns.route('/exports/<int:job_id>/download')
+@summary_ns.param('job_id', 'The export job ID')
+class ExportJobDownload(Resource):
+    @summary_ns.doc('download_export', security='BearerAuth')
+    @jwt_required()
+    def get(self, job_id):
+        """Downloads the file of a completed export job."""
+        job = get_own_export(job_id)
+        if job.status != 'completed':
+            summary_ns.abort(409, f"Export is {job.status}.")
+        if is_export_expired(job) or not os.path.exists(job.file_path):
+            summary_ns.abort(410, "Export has expired.")
+
+        return send_file(
+            job.file_path,
+            mimetype=EXPORT_MIMETYPES[job.file_format, job.compressed],
+            as_attachment=True,
+            download_name=export_filename(job)
+        )
\ No newline at end of file
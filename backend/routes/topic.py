@@ -1,11 +1,14 @@
-from flask import Blueprint, request, send_file
+from flask import Blueprint, request, send_file, current_app, Response, stream_with_context
 from flask_restx import Namespace, Resource, fields, abort
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from model import UserModuleProgress, db, Topic, User, Module, Lesson
+from model import UserModuleProgress, db, Topic
+from auth_utils import load_current_user
 from api_utils import get_current_ist
+from content_cache import resolve_content_path, get_content_snapshot
+from blob_store import get_blob_store
 from datetime import datetime
+from sqlalchemy import func
 import magic
-import io
 
 # Define the topic namespace
 topic_ns = Namespace('topic', description='Topic operations  (Learn Module/Admin Module - Teach about so many fundamental topics like Stock Market ,Money Management, Budgeting Techniques , Financial Planning and Other Financial Literacy topics.)')
@@ -50,6 +53,102 @@ error_model = topic_ns.model('Error', {
     'error': fields.String(description='Error message')
 })
 
+# --- Helpers for serving topic PDFs ---
+
+def load_topic_content_info(topic_id, **filters):
+    """Reads a topic's content metadata without loading any PDF bytes."""
+    return db.session.query(
+        Topic.topic_id,
+        Topic.topic_title,
+        Topic.content_digest,
+        Topic.content_mime_type,
+        Topic.updated_at,
+        func.length(Topic.topic_content).label('legacy_content_length')
+    ).filter_by(topic_id=topic_id, deleted_at=None, **filters).first()
+
+
+def topic_content_response(content_info, filename):
+    """
+    Serves a topic's PDF. Blob-store content goes through send_file with the
+    digest as a strong ETag, so If-None-Match/If-Modified-Since get a 304 and
+    Range requests a 206. Legacy rows still holding the PDF in the database
+    are streamed from there.
+    """
+    if content_info.content_digest:
+        return send_file(
+            get_blob_store().open(content_info.content_digest),
+            mimetype=content_info.content_mime_type or 'application/pdf',
+            as_attachment=False,
+            download_name=filename,
+            conditional=True,
+            etag=content_info.content_digest,
+            last_modified=content_info.updated_at
+        )
+    return legacy_topic_content_response(content_info.topic_id, content_info.legacy_content_length, filename)
+
+
+def iter_topic_content(topic_id, start, stop):
+    """
+    Yields bytes [start, stop) of a topic's in-database PDF one chunk at a time,
+    reading each chunk with substr() so the whole BLOB is never held in memory.
+    """
+    chunk_size = current_app.config.get('TOPIC_CONTENT_CHUNK_SIZE', 256 * 1024)
+    offset = start
+    while offset < stop:
+        length = min(chunk_size, stop - offset)
+        chunk = db.session.query(
+            func.substr(Topic.topic_content, offset + 1, length)
+        ).filter(Topic.topic_id == topic_id).scalar()
+        if not chunk:
+            break
+        yield bytes(chunk)
+        offset += length
+
+
+def legacy_topic_content_response(topic_id, content_length, filename):
+    """
+    Builds a streamed PDF response for a topic stored in the database,
+    honouring a single HTTP byte range so browser PDF viewers can fetch pages lazily.
+    """
+    start, stop, status = 0, content_length, 200
+    if request.range and len(request.range.ranges) == 1:
+        byte_range = request.range.range_for_length(content_length)
+        if byte_range is None:
+            return Response(status=416, headers={'Content-Range': f'bytes */{content_length}'})
+        (start, stop), status = byte_range, 206
+
+    response = Response(
+        stream_with_context(iter_topic_content(topic_id, start, stop)),
+        status=status,
+        mimetype='application/pdf',
+        headers={
+            'Content-Disposition': f'inline; filename="{filename}"',
+            'Content-Length': str(stop - start),
+            'Accept-Ranges': 'bytes'
+        }
+    )
+    if status == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{content_length}'
+    return response
+
+
+def is_legacy_pdf(topic_id):
+    """Checks an in-database topic's header so a PDF BLOB is recognised without loading it."""
+    header = db.session.query(
+        func.substr(Topic.topic_content, 1, 5)
+    ).filter(Topic.topic_id == topic_id).scalar()
+    return bool(header) and bytes(header) == b'%PDF-'
+
+
+def store_topic_content(topic, file):
+    """Writes an uploaded PDF to the blob store and points the topic at it."""
+    digest, size = get_blob_store().put(file.stream)
+    topic.content_digest = digest
+    topic.content_size = size
+    topic.content_mime_type = 'application/pdf'
+    topic.topic_content = None
+
+
 @topic_ns.route('/get_all_topics')
 class Topics(Resource):
     @topic_ns.doc('get_all_topics', description='Retrieve all topics.', security='BearerAuth')
@@ -60,21 +159,11 @@ class Topics(Resource):
     def get(self):
         """Retrieve all topics."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
-            topics = Topic.query.filter_by(deleted_at=None).all()
-            return [{
-                'topic_id': topic.topic_id,
-                'module_id': topic.module_id,
-                'created_by_admin_id': topic.created_by_admin_id,
-                'topic_title': topic.topic_title,
-                'has_content': bool(topic.topic_content),
-                'created_at': topic.created_at,
-                'updated_at': topic.updated_at
-            } for topic in topics], 200
+            return list(get_content_snapshot().topics), 200
 
         except Exception as e:
             abort(500, f'An unexpected error occurred: {str(e)}')
@@ -90,29 +179,13 @@ class TopicsByLessonAndModule(Resource):
     def get(self, lesson_id, module_id):
         """Retrieve all topics for a specific lesson and module."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topics = Topic.query.filter_by(module_id=module_id, deleted_at=None).all()
-            return [{
-                'topic_id': topic.topic_id,
-                'module_id': topic.module_id,
-                'created_by_admin_id': topic.created_by_admin_id,
-                'topic_title': topic.topic_title,
-                'has_content': bool(topic.topic_content),
-                'created_at': topic.created_at,
-                'updated_at': topic.updated_at
-            } for topic in topics], 200
+            snapshot = get_content_snapshot()
+            snapshot.validate_path(lesson_id, module_id)
+            return list(snapshot.topics_by_module.get(module_id, ())), 200
 
         except Exception as e:
             abort(500, f'An unexpected error occurred: {str(e)}')
@@ -138,16 +211,16 @@ class SpecificTopic(Resource):
             
             # Handle binary content (PDF files)
             pdf_available = False
-            if topic.topic_content:
+            topic_content = None
+            if topic.content_digest or is_legacy_pdf(topic.topic_id):
+                pdf_available = True
+            elif topic.topic_content:
                 try:
-                    # Try to decode as UTF-8 first (text content)
+                    # Only legacy text content gets this far, so loading it is cheap
                     topic_content = topic.topic_content.decode('utf-8')
                 except UnicodeDecodeError:
                     # If it fails, it's likely a PDF file
-                    topic_content = None
                     pdf_available = True
-            else:
-                topic_content = None
             
             return {
                 'topic_id': topic.topic_id,
@@ -183,24 +256,12 @@ class TopicPDF(Resource):
             except:
                 abort(401, 'Invalid token')
             
-            topic = Topic.query.filter_by(
-                topic_id=topic_id,
-                module_id=module_id,
-                deleted_at=None
-            ).first()
+            content_info = load_topic_content_info(topic_id, module_id=module_id)
             
-            if not topic or not topic.topic_content:
+            if not content_info or not (content_info.content_digest or content_info.legacy_content_length):
                 abort(404, 'PDF not found')
             
-            # Return the PDF binary data
-            from flask import Response
-            return Response(
-                topic.topic_content,
-                mimetype='application/pdf',
-                headers={
-                    'Content-Disposition': f'inline; filename="{topic.topic_title}.pdf"'
-                }
-            )
+            return topic_content_response(content_info, f'{content_info.topic_title}.pdf')
             
         except Exception as e:
             print(f"PDF serve error: {str(e)}")
@@ -218,21 +279,11 @@ class StartProgress(Resource):
     def post(self, lesson_id, module_id, topic_id):
         try:
             user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
+            resolve_content_path(lesson_id, module_id, topic_id)
 
             progress = UserModuleProgress.query.filter_by(
                 user_id=user_id,
@@ -278,21 +329,11 @@ class CompleteProgress(Resource):
     def post(self, lesson_id, module_id, topic_id):
         try:
             user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
+            resolve_content_path(lesson_id, module_id, topic_id)
 
             progress = UserModuleProgress.query.filter_by(
                 user_id=user_id,
@@ -339,21 +380,11 @@ class ProgressStatus(Resource):
     def get(self, lesson_id, module_id, topic_id):
         try:
             user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
+            resolve_content_path(lesson_id, module_id, topic_id)
 
             progress = UserModuleProgress.query.filter_by(
                 user_id=user_id,
@@ -400,17 +431,11 @@ class CreateTopic(Resource):
         """Create a new topic."""
         try:
             user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user or user.user_role != 'admin':
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
+            resolve_content_path(lesson_id, module_id)
 
             data = topic_ns.payload
             if not data.get('topic_title'):
@@ -453,22 +478,12 @@ class UpdateTopic(Resource):
     def put(self, lesson_id, module_id, topic_id):
         """Update a topic."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user or user.user_role != 'admin':
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
+            resolve_content_path(lesson_id, module_id, topic_id, use_cache=False)
+            topic = Topic.query.get(topic_id)
 
             data = topic_ns.payload
             if 'topic_title' in data:
@@ -482,7 +497,7 @@ class UpdateTopic(Resource):
                 'module_id': topic.module_id,
                 'created_by_admin_id': topic.created_by_admin_id,
                 'topic_title': topic.topic_title,
-                'has_content': bool(topic.topic_content),
+                'has_content': bool(topic.content_size),
                 'created_at': topic.created_at,
                 'updated_at': topic.updated_at
             }, 200
@@ -503,22 +518,12 @@ class DeleteTopic(Resource):
     def delete(self, lesson_id, module_id, topic_id):
         """Delete a topic (soft delete)."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user or user.user_role != 'admin':
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
+            resolve_content_path(lesson_id, module_id, topic_id, use_cache=False)
+            topic = Topic.query.get(topic_id)
 
             topic.deleted_at = get_current_ist()
             db.session.commit()
@@ -543,22 +548,12 @@ class UploadContent(Resource):
     def post(self, lesson_id, module_id, topic_id):
         """Upload PDF content for a topic."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user or user.user_role != 'admin':
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
+            resolve_content_path(lesson_id, module_id, topic_id, use_cache=False)
+            topic = Topic.query.get(topic_id)
 
             if 'content_file' not in request.files:
                 abort(400, 'No file part in the request')
@@ -574,7 +569,8 @@ class UploadContent(Resource):
             if file_mime_type != 'application/pdf':
                 abort(400, 'Only PDF files are allowed')
 
-            topic.topic_content = file.read()
+            # The replaced blob, if no longer referenced, is removed by `flask sweep-topic-blobs`
+            store_topic_content(topic, file)
             topic.updated_at = get_current_ist()
             db.session.commit()
 
@@ -598,22 +594,12 @@ class UpdateContent(Resource):
     def post(self, lesson_id, module_id, topic_id):
         """Update PDF content for a topic."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user or user.user_role != 'admin':
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
+            resolve_content_path(lesson_id, module_id, topic_id, use_cache=False)
+            topic = Topic.query.get(topic_id)
 
             if 'content_file' not in request.files:
                 abort(400, 'No file part in the request')
@@ -629,7 +615,8 @@ class UpdateContent(Resource):
             if file_mime_type != 'application/pdf':
                 abort(400, 'Only PDF files are allowed')
 
-            topic.topic_content = file.read()
+            # The replaced blob, if no longer referenced, is removed by `flask sweep-topic-blobs`
+            store_topic_content(topic, file)
             topic.updated_at = get_current_ist()
             db.session.commit()
 
@@ -650,32 +637,17 @@ class DownloadContent(Resource):
     def get(self, lesson_id, module_id, topic_id):
         """Download PDF content for a topic."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user:
                 abort(404, 'User not found')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
+            resolve_content_path(lesson_id, module_id, topic_id)
+            content_info = load_topic_content_info(topic_id)
 
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
-
-            if not topic.topic_content:
+            if not (content_info.content_digest or content_info.legacy_content_length):
                 abort(404, 'No content available for this topic')
 
-            return send_file(
-                io.BytesIO(topic.topic_content),
-                mimetype='application/pdf',
-                as_attachment=False,
-                download_name=f'topic_{topic_id}_content.pdf'
-            )
+            return topic_content_response(content_info, f'topic_{topic_id}_content.pdf')
 
         except Exception as e:
             abort(500, f'An unexpected error occurred: {str(e)}')
@@ -692,28 +664,21 @@ class DeleteContent(Resource):
     def delete(self, lesson_id, module_id, topic_id):
         """Delete the PDF content for a topic."""
         try:
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(user_id=user_id).first()
+            user = load_current_user()
             if not user or user.user_role != 'admin':
                 abort(403, 'Admin access required')
 
-            lesson = Lesson.query.filter_by(lesson_id=lesson_id).first()
-            if not lesson:
-                abort(404, 'Lesson not found')
-
-            module = Module.query.filter_by(module_id=module_id, lesson_id=lesson_id, deleted_at=None).first()
-            if not module:
-                abort(404, 'Module not found')
-
-            topic = Topic.query.filter_by(topic_id=topic_id, module_id=module_id, deleted_at=None).first()
-            if not topic:
-                abort(404, 'Topic not found')
+            resolve_content_path(lesson_id, module_id, topic_id, use_cache=False)
+            topic = Topic.query.get(topic_id)
             
-            if not topic.topic_content:
+            if not topic.content_digest and not topic.topic_content:
                 return {'message': 'No content to delete'}, 200
 
-            # Set content to NULL and update timestamp
+            # Set content to NULL and update timestamp; the blob is left to `flask sweep-topic-blobs`
             topic.topic_content = None
+            topic.content_digest = None
+            topic.content_size = None
+            topic.content_mime_type = None
             topic.updated_at = get_current_ist()
             db.session.commit()
 
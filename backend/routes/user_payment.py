@@ -6,6 +6,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from dotenv import load_dotenv
 
 from model import db, User, UserProfile
+from auth_utils import load_current_user
 
 # Load environment variables
 load_dotenv()
@@ -104,8 +105,7 @@ class UserStatus(Resource):
     @jwt_required()
     def get(self):
         """Gets the premium status of the current user."""
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        if not user or not user.profile:
+        user = load_current_user()
+        if not user or not user.has_profile:
              return {'message': 'User or profile not found'}, 404
-        return {'is_premium': user.profile.is_premium_user}, 200
\ No newline at end of file
+        return {'is_premium': user.is_premium_user}, 200
\ No newline at end of file
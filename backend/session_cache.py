@@ -0,0 +1,69 @@
+from collections import namedtuple
+
+from flask import current_app
+from flask_jwt_extended import get_jwt
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from model import db, UserSession
+from cache_utils import TTLCache
+
+SessionState = namedtuple('SessionState', ['session_id', 'user_id', 'is_active'])
+
+# Login sessions by session_id. Entries are dropped whenever the row changes
+# (logout, expiry); the TTL bounds staleness for writes from other processes.
+_session_cache = TTLCache(maxsize=10000)
+
+
+def get_session_state(session_id):
+    """Returns the SessionState for a session id, or None if it does not exist."""
+    state = _session_cache.get(session_id)
+    if state is not None:
+        return state
+
+    row = db.session.query(
+        UserSession.session_id, UserSession.user_id, UserSession.is_active
+    ).filter(UserSession.session_id == session_id).first()
+    if not row:
+        return None
+    state = SessionState(*row)
+    _session_cache.set(session_id, state, ttl=current_app.config.get('SESSION_CACHE_TTL', 300))
+    return state
+
+
+def get_active_session_id(user_id):
+    """
+    Returns the id of the caller's active login session, or None. Tokens
+    issued at login carry a session_id claim, answered from the cache; older
+    tokens without it fall back to looking up the user's active session.
+    """
+    session_id = get_jwt().get('session_id')
+    if session_id is None:
+        user_session = UserSession.query.filter_by(user_id=user_id, is_active=True).first()
+        return user_session.session_id if user_session else None
+
+    state = get_session_state(session_id)
+    if not state or not state.is_active or str(state.user_id) != str(user_id):
+        return None
+    return state.session_id
+
+
+def invalidate_session(session_id):
+    _session_cache.pop(session_id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_changed_sessions(session, flush_context):
+    changed = session.info.setdefault('changed_sessions', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, UserSession):
+            changed.add(obj.session_id)
+            invalidate_session(obj.session_id)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _invalidate_committed_sessions(session):
+    # Another request may have cached the pre-commit row after the flush
+    for session_id in session.info.pop('changed_sessions', ()):
+        invalidate_session(session_id)
@@ -0,0 +1,89 @@
+import threading
+import time
+from datetime import timedelta
+
+import click
+from flask import current_app
+
+from model import db, UserSession
+from api_utils import get_current_ist
+from session_cache import invalidate_session
+
+
+def close_stale_sessions(batch_size=None):
+    """
+    Closes active sessions older than SESSION_STALE_AFTER seconds (by default
+    the access token lifetime), i.e. sessions whose user never logged out and
+    whose token can no longer be used. Their duration is unknown, so it is left
+    empty and they stay out of the session-duration averages. Returns the count.
+    """
+    stale_after = current_app.config.get('SESSION_STALE_AFTER') or \
+        current_app.config['JWT_ACCESS_TOKEN_EXPIRES'].total_seconds()
+    batch_size = batch_size or current_app.config.get('SESSION_REAPER_BATCH_SIZE', 1000)
+    now = get_current_ist()
+    cutoff = now - timedelta(seconds=stale_after)
+
+    closed = 0
+    while True:
+        session_ids = [session_id for (session_id,) in db.session.query(UserSession.session_id).filter(
+            UserSession.is_active.is_(True),
+            UserSession.login_at < cutoff
+        ).limit(batch_size).all()]
+        if not session_ids:
+            return closed
+
+        UserSession.query.filter(UserSession.session_id.in_(session_ids)).update(
+            {UserSession.is_active: False, UserSession.logout_at: now}, synchronize_session=False
+        )
+        db.session.commit()
+        for session_id in session_ids:
+            invalidate_session(session_id)
+        closed += len(session_ids)
+
+
+class SessionReaper:
+    """Background thread that runs close_stale_sessions every SESSION_REAPER_INTERVAL seconds."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def ensure_started(self, app):
+        """Starts the reaper once per process, unless SESSION_REAPER_INTERVAL is 0."""
+        if self._thread is not None or not app.config.get('SESSION_REAPER_INTERVAL', 0):
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(app,), name='session-reaper', daemon=True)
+            self._thread.start()
+
+    def _run(self, app):
+        while True:
+            time.sleep(app.config['SESSION_REAPER_INTERVAL'])
+            with app.app_context():
+                try:
+                    closed = close_stale_sessions()
+                    if closed:
+                        print(f"Closed {closed} stale session(s).")
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Error closing stale sessions: {e}")
+                finally:
+                    db.session.remove()
+
+
+session_reaper = SessionReaper()
+
+
+def init_session_reaper(app):
+    """Registers the `flask close-stale-sessions` command and starts the reaper with the first request."""
+
+    @app.cli.command('close-stale-sessions')
+    def close_stale_sessions_command():
+        """Close login sessions that were never logged out."""
+        click.echo(f"Closed {close_stale_sessions()} stale session(s).")
+
+    @app.before_request
+    def start_session_reaper():
+        session_reaper.ensure_started(app)
@@ -1,7 +1,14 @@
 from app import app
-from model import db, User, UserProfile, Lesson, get_current_ist
-from werkzeug.security import generate_password_hash
+from model import db, User, UserProfile, UserSession, Lesson, Topic, QuizAttempt, QuestionAttempt, DailyActivity, get_current_ist
+from blob_store import get_blob_store
+from routes.topic import is_legacy_pdf
+from auth_utils import hash_password
+from activity_rollup import rebuild_activity_rollups
 from datetime import date
+import io
+import uuid
+import jwt
+import sqlalchemy as sa
 
 # Configuration for initial admins
 INITIAL_ADMINS = [
@@ -62,7 +69,7 @@ def add_initial_admins():
                 new_admin = User(
                     username=username,
                     email=admin_config["email"],
-                    password_hash=generate_password_hash(admin_config["password"]),
+                    password_hash=hash_password(admin_config["password"]),
                     user_role='admin',
                 )
                 db.session.add(new_admin)
@@ -108,6 +115,149 @@ def add_default_lessons():
         else:
             print(f"Lesson '{lesson_name}' already exists, skipping creation.")
 
+def upgrade_schema():
+    """
+    Adds columns and indexes that newer models define but an existing database
+    lacks. db.create_all() only creates missing tables, so this covers
+    columns added to tables that already exist.
+    """
+    inspector = sa.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                if column.server_default is not None:
+                    ddl += f' DEFAULT {column.server_default.arg}'
+                connection.execute(sa.text(ddl))
+                print(f"Added column '{table.name}.{column.name}'.")
+
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+                    print(f"Created index '{index.name}'.")
+
+def deduplicate_quiz_attempt_tokens():
+    """
+    Gives every quiz attempt a distinct access token so the unique index on
+    quiz_attempt_access_token can be created. Older tokens were derived from a
+    per-second timestamp and could repeat; the earliest attempt keeps its token.
+    """
+    inspector = sa.inspect(db.engine)
+    if QuizAttempt.__tablename__ not in inspector.get_table_names():
+        return
+    token = QuizAttempt.quiz_attempt_access_token
+    duplicated = db.session.query(token).group_by(token).having(sa.func.count() > 1).subquery()
+    rows = db.session.query(QuizAttempt.attempt_id, token).filter(
+        token.in_(sa.select(duplicated.c.quiz_attempt_access_token))
+    ).order_by(token, QuizAttempt.attempt_id).all()
+
+    seen = set()
+    for attempt_id, access_token in rows:
+        if access_token not in seen:
+            seen.add(access_token)
+            continue
+        db.session.query(QuizAttempt).filter_by(attempt_id=attempt_id).update(
+            {token: f'{access_token}_{attempt_id}'}, synchronize_session=False
+        )
+    db.session.commit()
+    if rows:
+        print(f"Made {len(rows) - len(seen)} duplicated quiz attempt token(s) unique.")
+
+def deduplicate_question_attempts():
+    """
+    Keeps only the latest answer per (attempt_id, question_id) so the unique
+    index on those columns can be created. Racing autosave writes could
+    previously insert the same answer twice.
+    """
+    inspector = sa.inspect(db.engine)
+    if QuestionAttempt.__tablename__ not in inspector.get_table_names():
+        return
+    latest = db.session.query(sa.func.max(QuestionAttempt.question_attempt_id)).group_by(
+        QuestionAttempt.attempt_id, QuestionAttempt.question_id
+    )
+    deleted = QuestionAttempt.query.filter(
+        QuestionAttempt.question_id.isnot(None),
+        QuestionAttempt.question_attempt_id.notin_(latest)
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    if deleted:
+        print(f"Removed {deleted} duplicated question attempt(s).")
+
+def compact_session_tokens():
+    """
+    Replaces full access tokens stored in user_sessions.session_token by older
+    logins with the token's JTI (or a fresh id if it cannot be read), so the
+    column and its unique index only hold short keys.
+    """
+    inspector = sa.inspect(db.engine)
+    if UserSession.__tablename__ not in inspector.get_table_names():
+        return
+    rows = db.session.query(UserSession.session_id, UserSession.session_token).filter(
+        sa.func.length(UserSession.session_token) > 36
+    ).all()
+    for session_id, session_token in rows:
+        try:
+            jti = jwt.decode(session_token, options={'verify_signature': False}).get('jti')
+        except jwt.InvalidTokenError:
+            jti = None
+        UserSession.query.filter_by(session_id=session_id).update(
+            {UserSession.session_token: jti or str(uuid.uuid4())}, synchronize_session=False
+        )
+    db.session.commit()
+    print(f"Compacted {len(rows)} session token(s).")
+
+def backfill_activity_rollups():
+    """Builds the dashboard rollups from existing history the first time they are introduced."""
+    if db.session.query(DailyActivity.activity_date).first():
+        return
+    if not (db.session.query(UserSession.session_id).first() or db.session.query(QuizAttempt.attempt_id).first()):
+        return
+    rebuild_activity_rollups()
+    print("Built daily activity rollups from session and quiz history.")
+
+def backfill_topic_content_size():
+    """Records content_size for legacy topics so listings can skip the BLOB column."""
+    updated = Topic.query.filter(
+        Topic.content_size.is_(None),
+        Topic.topic_content.isnot(None)
+    ).update({Topic.content_size: sa.func.length(Topic.topic_content)}, synchronize_session=False)
+    db.session.commit()
+    print(f"Backfilled content size for {updated} topic(s).")
+
+def migrate_topic_content_to_blob_store():
+    """
+    Moves PDFs still stored in topics.topic_content into the blob store, one
+    topic at a time. Topics whose legacy content is text stay in the database.
+    """
+    store = get_blob_store()
+    topic_ids = [topic_id for (topic_id,) in db.session.query(Topic.topic_id).filter(
+        Topic.topic_content.isnot(None),
+        Topic.content_digest.is_(None)
+    ).all()]
+    for topic_id in topic_ids:
+        if not is_legacy_pdf(topic_id):
+            continue
+        try:
+            topic = Topic.query.get(topic_id)
+            digest, size = store.put(io.BytesIO(topic.topic_content))
+            topic.content_digest = digest
+            topic.content_size = size
+            topic.content_mime_type = 'application/pdf'
+            topic.topic_content = None
+            db.session.commit()
+            print(f"Moved content of topic {topic_id} to the blob store.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Failed to move content of topic {topic_id}: {e}")
+
 def setup_database():
     """Set up the database by creating tables and adding initial data."""
     with app.app_context():
@@ -115,6 +265,17 @@ def setup_database():
         db.create_all()
         print("Database tables created.")
 
+        # Bring existing tables up to date with the models
+        deduplicate_quiz_attempt_tokens()
+        deduplicate_question_attempts()
+        upgrade_schema()
+        compact_session_tokens()
+        backfill_activity_rollups()
+
+        # Record sizes for legacy content, then move in-database PDFs to the blob store
+        backfill_topic_content_size()
+        migrate_topic_content_to_blob_store()
+
         # Add initial admins
         add_initial_admins()
 
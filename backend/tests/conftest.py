@@ -1,7 +1,14 @@
+import re
+from contextlib import contextmanager
 import pytest
+from sqlalchemy import event
+from flask_sqlalchemy.session import Session as FlaskSession
 from app import create_app
 from model import db as _db
 from config import TestingConfig
+from cache_utils import clear_all_caches
+from answer_buffer import answer_buffer
+from rate_limit import chatbot_rate_limiter
 
 @pytest.fixture(scope='session')
 def app():
@@ -28,22 +35,52 @@ def db(app):
         yield _db
         _db.drop_all()
 
+class _ConnectionSession(FlaskSession):
+    """A Flask-SQLAlchemy session that runs on the connection it was given instead of the app's engine."""
+
+    def get_bind(self, *args, **kwargs):
+        return self.bind
+
+
 @pytest.fixture(scope='function')
 def session(db):
     """
     Function-scoped database session.
-    This fixture ensures that each test function has a clean database state
-    by using a nested transaction (savepoint) and rolling back after the test.
-    This prevents test side-effects from affecting other tests.
+    Each test runs inside one outer transaction on its own connection, and
+    db.session is swapped for a session joined to it with SAVEPOINTs. Commits
+    made by the code under test only release a savepoint, so rolling back the
+    outer transaction afterwards undoes everything the test wrote.
     """
-    # Start a nested transaction (uses a SAVEPOINT)
-    db.session.begin_nested()
-    
+    connection = db.engine.connect()
+    # pysqlite only issues BEGIN before DML, so a leading SAVEPOINT would open
+    # (and its RELEASE commit) the transaction; begin it explicitly instead
+    dbapi_connection = connection.connection.driver_connection
+    isolation_level = dbapi_connection.isolation_level
+    dbapi_connection.isolation_level = None
+    transaction = connection.begin()
+    connection.exec_driver_sql('BEGIN')
+
+    app_session = db.session
+    db.session = db._make_scoped_session({
+        'class_': _ConnectionSession,
+        'bind': connection,
+        'join_transaction_mode': 'create_savepoint'
+    })
+
     # Yield the session object to the test function
     yield db.session
-    
-    # Rollback the transaction, undoing any changes made in the test
-    db.session.rollback()
+
+    # Roll back the outer transaction, undoing any changes made in the test
+    db.session.remove()
+    db.session = app_session
+    transaction.rollback()
+    dbapi_connection.isolation_level = isolation_level
+    connection.close()
+
+    # Drop in-process caches so no test sees state left behind by another
+    clear_all_caches()
+    answer_buffer.clear()
+    chatbot_rate_limiter.clear()
 
 
 @pytest.fixture(scope='function')
@@ -61,3 +98,26 @@ def runner(app):
     A test runner for the Flask command-line interface (CLI).
     """
     return app.test_cli_runner()
+
+@pytest.fixture
+def count_queries(db):
+    """
+    Records the SQL statements run against the test database.
+    Use as `with count_queries(r'FROM users') as statements:`; the list holds
+    every statement matching the regular expression, or all of them without one.
+    """
+    @contextmanager
+    def count(pattern=None):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if pattern is None or re.search(pattern, statement):
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+    return count
@@ -1,5 +1,8 @@
 import json
-from model import User, UserProfile, UserSession
+from datetime import timedelta
+from flask_jwt_extended import decode_token
+from model import db, User, UserProfile, UserSession
+from api_utils import get_current_ist
 from werkzeug.security import generate_password_hash
 
 def test_signup_success(client, session):
@@ -144,6 +147,25 @@ def test_login_success(client, session):
     assert "access_token" in data
     assert data['user']['username'] == 'loginuser.success'
 
+def test_login_rehashes_outdated_password_hash(client, session, app):
+    """
+    GIVEN a user whose password hash was made with other parameters than PASSWORD_HASH_METHOD
+    WHEN the user logs in
+    THEN check that the stored hash is upgraded and the password still works
+    """
+    password = "password"
+    user = User(email="rehash.login@example.com", username="rehashuser.login", password_hash=generate_password_hash(password, method='scrypt'))
+    session.add(user)
+    session.commit() # Use commit() to make the user visible to the app context
+
+    response = client.post('/api/login', data=json.dumps({"username": "rehashuser.login", "password": password}), content_type='application/json')
+    assert response.status_code == 200
+    session.refresh(user)
+    assert user.password_hash.startswith(app.config['PASSWORD_HASH_METHOD'] + '$')
+
+    response = client.post('/api/login', data=json.dumps({"username": "rehashuser.login", "password": password}), content_type='application/json')
+    assert response.status_code == 200
+
 def test_login_invalid_username(client):
     """
     GIVEN a Flask application
@@ -204,6 +226,59 @@ def test_validate_token_success(client, session):
     assert data['username'] == 'validuser.token'
     assert data['email'] == 'valid.token@example.com'
 
+def test_validate_token_uses_claims_until_premium_changes(client, session, count_queries):
+    """
+    GIVEN a logged-in user without premium
+    WHEN the token is validated repeatedly and the user's premium status then changes
+    THEN check that users are not queried per request and the old token reflects the upgrade
+    """
+    password = "password"
+    user = User(email="claims.token@example.com", username="claimsuser.token", password_hash=generate_password_hash(password))
+    session.add(user)
+    session.flush()
+    profile = UserProfile(user_id=user.user_id, full_name="Claims User", is_premium_user=False)
+    session.add(profile)
+    session.commit() # Use commit() to make the user visible to the app context
+
+    login_res = client.post('/api/login', data=json.dumps({"username": "claimsuser.token", "password": password}), content_type='application/json')
+    headers = {'Authorization': f"Bearer {login_res.get_json()['access_token']}"}
+
+    with count_queries(r'FROM users') as user_queries:
+        for _ in range(3):
+            response = client.get('/api/validate-token', headers=headers)
+            assert response.status_code == 200
+            assert response.get_json()['is_premium_user'] is False
+    assert len(user_queries) <= 1
+
+    profile.is_premium_user = True
+    session.commit()
+    assert user.token_version == 1
+
+    response = client.get('/api/validate-token', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['is_premium_user'] is True
+
+def test_user_cached_between_flush_and_commit_is_dropped_on_commit(session):
+    """
+    GIVEN a role change flushed but not yet committed
+    WHEN another request caches the user's stored identity before the commit
+    THEN check that the commit drops it again, so the new token_version is read
+    """
+    from auth_utils import get_user_record, _user_cache
+    user = User(email="commit.cache@example.com", username="commitcache.user", password_hash=generate_password_hash("password"))
+    session.add(user)
+    session.commit()
+    stale_record = get_user_record(user.user_id)
+
+    user.user_role = 'admin'
+    session.flush()
+    _user_cache.set(user.user_id, stale_record)
+    session.commit()
+
+    record = get_user_record(user.user_id)
+    assert record.user_role == 'admin'
+    assert record.token_version == stale_record.token_version + 1
+
 def test_validate_token_invalid(client):
     """
     GIVEN a Flask application
@@ -243,6 +318,69 @@ def test_logout_success(client, session):
     assert user_session.logout_at is not None
     assert user_session.session_duration_seconds is not None
 
+def test_session_cached_between_flush_and_commit_is_dropped_on_commit(session):
+    """
+    GIVEN a logout flushed but not yet committed
+    WHEN another request caches the still-active session before the commit
+    THEN check that the commit drops it again, so the session reads as inactive
+    """
+    from session_cache import get_session_state, _session_cache, SessionState
+    user = User(email="commit.session@example.com", username="commitsession.user", password_hash=generate_password_hash("password"))
+    session.add(user)
+    session.flush()
+    user_session = UserSession(user_id=user.user_id, session_token='commit-session-jti', login_at=get_current_ist())
+    session.add(user_session)
+    session.commit()
+
+    user_session.is_active = False
+    session.flush()
+    _session_cache.set(user_session.session_id, SessionState(user_session.session_id, user.user_id, True))
+    session.commit()
+
+    assert get_session_state(user_session.session_id).is_active is False
+
+def test_login_keys_session_by_token_jti(client, session):
+    """
+    GIVEN a registered user
+    WHEN the user logs in
+    THEN check that the session stores the token's JTI instead of the token itself
+    """
+    password = "password"
+    user = User(email="jti.login@example.com", username="jtiuser.login", password_hash=generate_password_hash(password))
+    session.add(user)
+    session.commit() # Use commit() to make the user visible to the app context
+
+    login_res = client.post('/api/login', data=json.dumps({"username": "jtiuser.login", "password": password}), content_type='application/json')
+    claims = decode_token(login_res.get_json()['access_token'])
+
+    user_session = UserSession.query.get(claims['session_id'])
+    assert user_session.session_token == claims['jti']
+    assert len(user_session.session_token) == 36
+
+def test_close_stale_sessions_command(runner, session):
+    """
+    GIVEN an active session older than the access token lifetime
+    WHEN the 'close-stale-sessions' command runs
+    THEN check that the session is closed without recording a duration
+    """
+    user = User(email="stale.session@example.com", username="staleuser.session", password_hash=generate_password_hash("password"))
+    session.add(user)
+    session.flush()
+    stale = UserSession(user_id=user.user_id, session_token="stale_session_token", login_at=get_current_ist() - timedelta(days=2))
+    fresh = UserSession(user_id=user.user_id, session_token="fresh_session_token", login_at=get_current_ist())
+    session.add_all([stale, fresh])
+    session.commit() # Use commit() to make the sessions visible to the command
+
+    result = runner.invoke(args=['close-stale-sessions'])
+    assert "stale session(s)" in result.output
+
+    session.refresh(stale)
+    session.refresh(fresh)
+    assert stale.is_active is False
+    assert stale.logout_at is not None
+    assert stale.session_duration_seconds is None
+    assert fresh.is_active is True
+
 def test_logout_no_token(client):
     """
     GIVEN a Flask application
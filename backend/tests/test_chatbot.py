@@ -1,10 +1,13 @@
 import json
 import pytest
+from flask_jwt_extended import decode_token
 from unittest.mock import patch
 from model import db, User, UserProfile, UserSession, ChatbotMessage
 from werkzeug.security import generate_password_hash
 from datetime import datetime
 import uuid
+from rate_limit import acquire_llm_slot
+from chatbot_backends import create_chatbot_service, EchoChatService, ReplayChatService
 
 @pytest.fixture
 def premium_user(session):
@@ -119,6 +122,244 @@ def test_send_message_non_premium_limit(mock_groq_service, client, session, non_
     assert response.status_code == 403
     assert "reached your message limit" in response.get_json()['message']
 
+@patch('routes.chatbot.groq_service')
+def test_send_message_stream_forwards_tokens_and_saves_reply(mock_groq_service, client, premium_user_token):
+    """
+    GIVEN a logged-in premium user and a mocked service that streams a reply in pieces
+    WHEN the '/api/send_message_stream' endpoint is posted to
+    THEN check that each piece arrives as a server-sent event and the full reply is stored
+    """
+    mock_groq_service.stream_chat_response.return_value = iter(["Saving ", "is ", "fun!"])
+
+    access_token, user_id, session_id = premium_user_token
+    headers = {'Authorization': f'Bearer {access_token}'}
+
+    response = client.post('/api/send_message_stream',
+                           headers=headers,
+                           data=json.dumps({'message': 'Why save?'}),
+                           content_type='application/json')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = [event for event in response.get_data(as_text=True).split('\n\n') if event]
+    assert [json.loads(event[len('data: '):])['token'] for event in events[:-1]] == ["Saving ", "is ", "fun!"]
+    assert events[-1].startswith('event: done\n')
+    assert json.loads(events[-1].split('data: ', 1)[1])['reply']['text'] == "Saving is fun!"
+
+    bot_message = ChatbotMessage.query.filter_by(session_id=session_id, message_type='bot').one()
+    assert bot_message.message_content == "Saving is fun!"
+
+@patch('routes.chatbot.finish_chat_turn')
+@patch('routes.chatbot.groq_service')
+def test_stream_finishes_the_turn_before_sending_done(mock_groq_service, mock_finish_chat_turn, client, premium_user_token):
+    """
+    GIVEN a client that closes the event stream as soon as it sees the "done" event
+    WHEN a streamed message is sent
+    THEN check that the turn was finished before the stream was closed
+    """
+    mock_groq_service.stream_chat_response.return_value = iter(["Hi ", "there!"])
+    access_token, _, session_id = premium_user_token
+
+    response = client.post('/api/send_message_stream', headers={'Authorization': f'Bearer {access_token}'},
+                           data=json.dumps({'message': 'Hello'}), content_type='application/json', buffered=False)
+    for chunk in response.response:
+        if chunk.startswith(b'event: done'):
+            break
+    response.close()
+
+    mock_finish_chat_turn.assert_called_once_with(session_id)
+
+@patch('routes.chatbot.groq_service')
+def test_send_message_uses_windowed_history_and_running_summary(mock_groq_service, app, client, session, monkeypatch, premium_user_token):
+    """
+    GIVEN a long chat session and a two-turn history window
+    WHEN the user sends three more messages
+    THEN check that older messages are folded into a stored summary and every message after it is sent to the model
+    """
+    monkeypatch.setitem(app.config, 'CHAT_HISTORY_MAX_TURNS', 2)
+    mock_groq_service.get_chat_response.return_value = "Keep saving!"
+    mock_groq_service.summarize_conversation.return_value = "The child asked about piggy banks."
+
+    access_token, user_id, session_id = premium_user_token
+    for i in range(10):
+        session.add(ChatbotMessage(user_id=user_id, session_id=session_id, message_content=f"Message {i}",
+                                   message_type='user' if i % 2 == 0 else 'bot'))
+    session.flush()
+
+    headers = {'Authorization': f'Bearer {access_token}'}
+    response = client.post('/api/send_message', headers=headers, data=json.dumps({'message': 'Tell me more'}), content_type='application/json')
+    assert response.status_code == 200
+
+    history, user_message = mock_groq_service.get_chat_response.call_args.args
+    assert [message.content for message in history] == [f"Message {i}" for i in range(2, 10)]
+    assert user_message == 'Tell me more'
+    folded_messages = mock_groq_service.summarize_conversation.call_args.args[1]
+    assert len(folded_messages) == 8
+    assert UserSession.query.get(session_id).chat_summary == "The child asked about piggy banks."
+
+    response = client.post('/api/send_message', headers=headers, data=json.dumps({'message': 'And then?'}), content_type='application/json')
+    assert response.status_code == 200
+    history, _ = mock_groq_service.get_chat_response.call_args.args
+    assert history[0].content == "Summary of the earlier conversation: The child asked about piggy banks."
+    assert [message.content for message in history[1:]] == ["Message 8", "Message 9", "Tell me more", "Keep saving!"]
+
+    # Between folds the prompt keeps every message after the summary, so none falls into a gap
+    response = client.post('/api/send_message', headers=headers, data=json.dumps({'message': 'What next?'}), content_type='application/json')
+    assert response.status_code == 200
+    history, _ = mock_groq_service.get_chat_response.call_args.args
+    assert [message.content for message in history[1:]] == ["Message 8", "Message 9", "Tell me more", "Keep saving!", "And then?", "Keep saving!"]
+
+@patch('routes.chatbot.groq_service')
+def test_first_turn_replies_are_served_from_response_cache(mock_groq_service, app, client, monkeypatch, premium_user_token, non_premium_user_token):
+    """
+    GIVEN one user's first question has been answered by the model
+    WHEN another user opens with the same question, worded slightly differently
+    THEN check that the cached reply is returned without calling the model again
+    """
+    monkeypatch.setitem(app.config, 'CHAT_RESPONSE_CACHE_SIMILARITY', 0.9)
+    mock_groq_service.get_chat_response.return_value = "Interest is money paid for using money."
+
+    first_token, _, _ = premium_user_token
+    response = client.post('/api/send_message', headers={'Authorization': f'Bearer {first_token}'},
+                           data=json.dumps({'message': 'What is interest?'}), content_type='application/json')
+    assert response.status_code == 200
+
+    second_token, _, second_session_id = non_premium_user_token
+    second_headers = {'Authorization': f'Bearer {second_token}'}
+    response = client.post('/api/send_message', headers=second_headers,
+                           data=json.dumps({'message': 'Can you explain INTEREST?'}), content_type='application/json')
+    assert response.get_json()['reply']['text'] == "Interest is money paid for using money."
+    mock_groq_service.get_chat_response.assert_called_once()
+    assert ChatbotMessage.query.filter_by(session_id=second_session_id, message_type='bot').count() == 1
+
+    # A second turn has history, so it always goes to the model
+    client.post('/api/send_message', headers=second_headers,
+                data=json.dumps({'message': 'Tell me about interest'}), content_type='application/json')
+    assert mock_groq_service.get_chat_response.call_count == 2
+
+def test_echo_backend_serves_full_chat_path_offline(client, monkeypatch, premium_user_token):
+    """
+    GIVEN the deterministic echo backend in place of the real model
+    WHEN a message is sent through the normal and streaming endpoints
+    THEN check that both return the echo reply without any network access
+    """
+    monkeypatch.setattr('routes.chatbot.groq_service', EchoChatService(latency='fixed:1'))
+    access_token, _, _ = premium_user_token
+    headers = {'Authorization': f'Bearer {access_token}'}
+
+    response = client.post('/api/send_message', headers=headers, data=json.dumps({'message': 'What is a budget?'}), content_type='application/json')
+    assert response.get_json()['reply']['text'] == "FinBot heard you ask: What is a budget?"
+
+    response = client.post('/api/send_message_stream', headers=headers, data=json.dumps({'message': 'And savings?'}), content_type='application/json')
+    assert 'event: done' in response.get_data(as_text=True)
+    assert "FinBot heard you ask: And savings?" in response.get_data(as_text=True)
+
+def test_recorded_replies_can_be_replayed(monkeypatch, tmp_path):
+    """
+    GIVEN replies recorded from a backend via CHATBOT_RECORD_PATH
+    WHEN the replay backend is built from that recording
+    THEN check that known questions get their recorded reply and others rotate through them
+    """
+    recording = tmp_path / 'replies.jsonl'
+    monkeypatch.setenv('CHATBOT_RECORD_PATH', str(recording))
+    monkeypatch.setenv('CHATBOT_ECHO_LATENCY', 'uniform:0-1')
+    recorder = create_chatbot_service('echo')
+    recorder.get_chat_response([], 'What is interest?')
+    ''.join(recorder.stream_chat_response([], 'How do banks work?'))
+
+    monkeypatch.delenv('CHATBOT_RECORD_PATH')
+    monkeypatch.setenv('CHATBOT_REPLAY_PATH', str(recording))
+    replay = create_chatbot_service('replay')
+    assert isinstance(replay, ReplayChatService)
+    assert replay.get_chat_response([], 'what is interest') == "FinBot heard you ask: What is interest?"
+    assert replay.get_chat_response([], 'Something new') == "FinBot heard you ask: What is interest?"
+    assert replay.get_chat_response([], 'Something else') == "FinBot heard you ask: How do banks work?"
+
+@patch('routes.chatbot.groq_service')
+def test_send_message_is_rate_limited_per_user(mock_groq_service, app, client, monkeypatch, premium_user_token):
+    """
+    GIVEN a per-user bucket of two messages that barely refills
+    WHEN the user sends three messages in a row
+    THEN check that the third gets a 429 with Retry-After and never reaches the model
+    """
+    monkeypatch.setitem(app.config, 'CHATBOT_RATE_LIMIT_BURST', 2)
+    monkeypatch.setitem(app.config, 'CHATBOT_RATE_LIMIT_PER_MINUTE', 1)
+    mock_groq_service.get_chat_response.return_value = "Sure!"
+    access_token, _, session_id = premium_user_token
+    headers = {'Authorization': f'Bearer {access_token}'}
+
+    statuses = [client.post('/api/send_message', headers=headers, data=json.dumps({'message': f'Question {i}'}),
+                            content_type='application/json') for i in range(3)]
+    assert [response.status_code for response in statuses] == [200, 200, 429]
+    assert int(statuses[2].headers['Retry-After']) > 0
+    assert mock_groq_service.get_chat_response.call_count == 2
+    assert ChatbotMessage.query.filter_by(session_id=session_id, message_type='user').count() == 2
+
+@patch('routes.chatbot.groq_service')
+def test_empty_message_does_not_use_a_rate_limit_token(mock_groq_service, app, client, monkeypatch, premium_user_token):
+    """
+    GIVEN a per-user bucket of one message that barely refills
+    WHEN the user sends an empty message and then a real one
+    THEN check that the empty one is rejected with a 400 and the real one still goes through
+    """
+    monkeypatch.setitem(app.config, 'CHATBOT_RATE_LIMIT_BURST', 1)
+    monkeypatch.setitem(app.config, 'CHATBOT_RATE_LIMIT_PER_MINUTE', 1)
+    mock_groq_service.get_chat_response.return_value = "Sure!"
+    access_token, _, _ = premium_user_token
+    headers = {'Authorization': f'Bearer {access_token}'}
+
+    empty = client.post('/api/send_message', headers=headers, data=json.dumps({'message': ''}),
+                        content_type='application/json')
+    assert empty.status_code == 400
+
+    sent = client.post('/api/send_message', headers=headers, data=json.dumps({'message': 'Question'}),
+                       content_type='application/json')
+    assert sent.status_code == 200
+
+@patch('routes.chatbot.groq_service')
+def test_send_message_returns_429_when_llm_slots_are_busy(mock_groq_service, app, client, monkeypatch, premium_user_token):
+    """
+    GIVEN a single global LLM slot that is already taken
+    WHEN a user sends a message
+    THEN check that it waits briefly, gets a 429 and its message is withdrawn
+    """
+    monkeypatch.setitem(app.config, 'CHATBOT_MAX_CONCURRENT_CALLS', 1)
+    monkeypatch.setitem(app.config, 'CHATBOT_QUEUE_TIMEOUT', 0.01)
+    access_token, _, session_id = premium_user_token
+
+    release = acquire_llm_slot()
+    try:
+        response = client.post('/api/send_message', headers={'Authorization': f'Bearer {access_token}'},
+                               data=json.dumps({'message': 'Anyone there?'}), content_type='application/json')
+    finally:
+        release()
+
+    assert response.status_code == 429
+    mock_groq_service.get_chat_response.assert_not_called()
+    assert ChatbotMessage.query.filter_by(session_id=session_id).count() == 0
+
+@patch('routes.chatbot.groq_service')
+def test_session_is_resolved_from_token_claim_and_dropped_on_logout(mock_groq_service, app, client, count_queries, premium_user_token):
+    """
+    GIVEN a user whose login token carries its session id
+    WHEN chat history is read repeatedly and the user then logs out
+    THEN check that no user_sessions lookup runs per request and chatting stops after logout
+    """
+    mock_groq_service.get_chat_response.return_value = "Hi!"
+    access_token, _, session_id = premium_user_token
+    assert decode_token(access_token)['session_id'] == session_id
+    headers = {'Authorization': f'Bearer {access_token}'}
+
+    with count_queries(r'FROM user_sessions') as session_queries:
+        for _ in range(3):
+            assert client.get('/api/chat_history', headers=headers).status_code == 200
+    assert len(session_queries) <= 1
+
+    assert client.post('/api/logout', headers=headers).status_code == 200
+    response = client.post('/api/send_message', headers=headers, data=json.dumps({'message': 'Hello?'}), content_type='application/json')
+    assert response.status_code == 400
+    assert "No active session" in response.get_json()['message']
+
 def test_send_message_empty(client, premium_user_token):
     """
     GIVEN a logged-in user
@@ -209,10 +450,33 @@ def test_get_chatbot_stats_admin_success(client, session, admin_user_token, prem
     assert stats['unique_users_chatted'] == 2
     assert stats['premium_users_chatted'] == 1
     assert stats['non_premium_users_chatted'] == 1
-    assert stats['active_users_today'] == 0
+    assert stats['active_users_today'] == 2
+    assert stats['active_users_last_7_days'] == 2
     assert stats['avg_messages_per_user'] == 1.5
     assert stats['avg_messages_per_session'] == 2.5
 
+def test_chatbot_stats_use_one_query_and_are_cached(client, session, count_queries, admin_user_token, premium_user_token):
+    """
+    GIVEN an admin user and some chat data
+    WHEN chatbot stats are requested twice
+    THEN check that they are computed with a single query over chatbot_messages and then served from the cache
+    """
+    _, premium_user_id, prem_session_id = premium_user_token
+    session.add(ChatbotMessage(user_id=premium_user_id, session_id=prem_session_id, message_content="Counted", message_type='user'))
+    session.flush()
+    headers = {'Authorization': f'Bearer {admin_user_token}'}
+
+    with count_queries(r'FROM chatbot_messages') as statements:
+        first = client.get('/api/chatbot_stats', headers=headers).get_json()
+        queries_after_first = len(statements)
+        session.add(ChatbotMessage(user_id=premium_user_id, session_id=prem_session_id, message_content="Not yet counted", message_type='user'))
+        session.flush()
+        second = client.get('/api/chatbot_stats', headers=headers).get_json()
+
+    assert queries_after_first == 1
+    assert len(statements) == 1
+    assert second == first
+
 def test_get_chatbot_stats_non_admin_forbidden(client, premium_user_token):
     """
     GIVEN a non-admin user
@@ -196,3 +196,26 @@ def test_get_all_modules(client, session, regular_user_token, admin_user, sample
     assert "Module 1" in module_titles
     assert "Module 2" in module_titles
     assert "Deleted Module" not in module_titles
+
+def test_module_list_snapshot_refreshes_after_admin_write(client, admin_user_token, sample_lesson):
+    """
+    GIVEN a lesson whose module list has already been served from the content snapshot
+    WHEN repeated reads are made and then an admin creates a module
+    THEN check that reads reuse the snapshot until the write makes it stale
+    """
+    from content_cache import get_content_snapshot, get_content_version
+    headers = {'Authorization': f'Bearer {admin_user_token}'}
+    list_url = f'/api/{sample_lesson.lesson_id}/modules'
+
+    assert client.get(list_url, headers=headers).get_json() == []
+    snapshot = get_content_snapshot()
+    assert client.get(list_url, headers=headers).status_code == 200
+    assert get_content_snapshot() is snapshot
+
+    version = get_content_version()
+    client.post(f'/api/{sample_lesson.lesson_id}/module/create', headers=headers,
+                data=json.dumps({'module_title': 'Snapshot Module'}), content_type='application/json')
+    assert get_content_version() > version
+
+    modules = client.get(list_url, headers=headers).get_json()
+    assert [m['module_title'] for m in modules] == ['Snapshot Module']
@@ -1,9 +1,14 @@
 import json
 import pytest
+from sqlalchemy import update
 from model import db, User, Lesson, Module, Topic, Quiz, Question, QuizAttempt, QuestionAttempt
 from werkzeug.security import generate_password_hash
 import uuid
+import io
 from datetime import datetime
+from api_utils import get_current_ist
+from answer_buffer import answer_buffer, write_question_attempts
+from content_cache import get_answer_key
 
 # --- Fixtures for Users, Tokens, and Learning Structure ---
 
@@ -123,6 +128,53 @@ def test_create_and_get_question(client, admin_user_token, sample_quiz):
     assert len(questions) == 1
     assert questions[0]['question_text'] == "What is interest?"
 
+def test_bulk_import_questions_from_json(client, admin_user_token, sample_quiz):
+    """
+    GIVEN an admin and a quiz
+    WHEN importing a JSON array of questions
+    THEN check that all are inserted and the quiz stats reflect them
+    """
+    lesson, module, topic, quiz = sample_quiz
+    headers = {'Authorization': f'Bearer {admin_user_token}'}
+    base_url = f'/api/{lesson.lesson_id}/module/{module.module_id}/topic/{topic.topic_id}/quizzes'
+    questions = [{
+        "question_text": f"Question {i}", "option1": "A", "option2": "B",
+        "option3": "C", "option4": "D", "correct_answer": "B", "score_points": 2
+    } for i in range(5)]
+
+    response = client.post(f'{base_url}/{quiz.quiz_id}/questions/import', headers=headers,
+                           data=json.dumps(questions), content_type='application/json')
+    assert response.status_code == 201
+    assert response.get_json()['imported'] == 5
+
+    stats = client.get(base_url, headers=headers).get_json()
+    quiz_stats = next(q for q in stats if q['quiz_id'] == quiz.quiz_id)
+    assert quiz_stats['total_questions'] == 5
+    assert quiz_stats['total_score'] == 10
+
+def test_bulk_import_questions_from_csv_reports_row_errors(client, admin_user_token, sample_quiz):
+    """
+    GIVEN a CSV upload where one row has a correct answer outside its options
+    WHEN importing the file
+    THEN check that a 400 lists the bad row and no questions are inserted
+    """
+    lesson, module, topic, quiz = sample_quiz
+    headers = {'Authorization': f'Bearer {admin_user_token}'}
+    csv_content = (
+        "question_text,option1,option2,option3,option4,correct_answer,score_points\n"
+        "What is a bond?,Debt,Equity,Cash,Gold,Debt,1\n"
+        "What is a stock?,Debt,Equity,Cash,Gold,Shares,1\n"
+    ).encode('utf-8')
+
+    response = client.post(f'/api/{lesson.lesson_id}/module/{module.module_id}/topic/{topic.topic_id}/quizzes/{quiz.quiz_id}/questions/import',
+                           headers=headers, data={'questions_file': (io.BytesIO(csv_content), 'questions.csv')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    data = response.get_json()
+    assert data['imported'] == 0
+    assert data['errors'] == [{'row': 2, 'message': 'Correct answer must be one of the provided options'}]
+    assert Question.query.filter_by(quiz_id=quiz.quiz_id).count() == 0
+
 def test_update_and_delete_question(client, session, admin_user_token, admin_user, sample_quiz):
     """
     GIVEN an admin and an existing question
@@ -154,6 +206,66 @@ def test_update_and_delete_question(client, session, admin_user_token, admin_use
     deleted_question = Question.query.get(question.question_id)
     assert deleted_question.deleted_at is not None
 
+def test_answer_key_is_cached_and_refreshed_after_question_update(client, session, count_queries, admin_user_token, regular_user_token, admin_user, sample_quiz):
+    """
+    GIVEN a quiz whose answer key was compiled when a user started it
+    WHEN answers are saved and an admin then changes the question's options
+    THEN check that saving reads no question rows and the updated key is used afterwards
+    """
+    lesson, module, topic, quiz = sample_quiz
+    admin, _ = admin_user
+    quiz.is_visible = True
+    question = Question(quiz_id=quiz.quiz_id, created_by_admin_id=admin.user_id, question_text="Q", option1="A", option2="B", option3="C", option4="D", correct_answer="A", score_points=4)
+    session.add(question)
+    session.flush()
+
+    headers = {'Authorization': f'Bearer {regular_user_token}'}
+    start_data = client.post('/api/start_quiz', headers=headers, data=json.dumps({'quiz_id': quiz.quiz_id}), content_type='application/json').get_json()
+    assert start_data['total_questions'] == 1
+    save_payload = {'quiz_attempt_access_token': start_data['quiz_attempt_access_token'], 'question_id': question.question_id}
+
+    with count_queries(r'\bFROM questions\b') as statements:
+        response = client.post('/api/save_answer', headers=headers, data=json.dumps({**save_payload, 'selected_answer': 'B'}), content_type='application/json')
+    assert response.status_code == 200
+    assert statements == []
+
+    update_url = f'/api/{lesson.lesson_id}/module/{module.module_id}/topic/{topic.topic_id}/quizzes/{quiz.quiz_id}/question/{question.question_id}/update'
+    update_response = client.put(update_url, headers={'Authorization': f'Bearer {admin_user_token}'},
+                                 data=json.dumps({'option4': 'E'}), content_type='application/json')
+    assert update_response.status_code == 200
+
+    response = client.post('/api/save_answer', headers=headers, data=json.dumps({**save_payload, 'selected_answer': 'E'}), content_type='application/json')
+    assert response.status_code == 200
+
+def test_answer_keys_are_retired_per_quiz_by_stored_version(app, session, admin_user, sample_quiz):
+    """
+    GIVEN cached answer keys for two quizzes
+    WHEN one quiz's question changes, and then its questions are rewritten behind the ORM's back with a version bump
+    THEN check that only that quiz's key is rebuilt, in both cases
+    """
+    lesson, module, topic, quiz = sample_quiz
+    admin, _ = admin_user
+    other_quiz = Quiz(module_id=module.module_id, topic_id=topic.topic_id, quiz_title="Other Quiz", duration_minutes=10, created_by_admin_id=admin.user_id)
+    session.add(other_quiz)
+    session.flush()
+    question = Question(quiz_id=quiz.quiz_id, created_by_admin_id=admin.user_id, question_text="Q", option1="A", option2="B", option3="C", option4="D", correct_answer="A")
+    other_question = Question(quiz_id=other_quiz.quiz_id, created_by_admin_id=admin.user_id, question_text="Q", option1="A", option2="B", option3="C", option4="D", correct_answer="B")
+    session.add_all([question, other_question])
+    session.flush()
+
+    get_answer_key(quiz.quiz_id)
+    other_key = get_answer_key(other_quiz.quiz_id)
+    question.correct_answer = "C"
+    session.flush()
+    assert get_answer_key(quiz.quiz_id).get(question.question_id).correct_answer == "C"
+    assert get_answer_key(other_quiz.quiz_id) is other_key
+
+    # Another worker process edits the question: only the stored version tells this one
+    session.execute(update(Question).where(Question.question_id == question.question_id).values(correct_answer="D"))
+    session.execute(update(Quiz).where(Quiz.quiz_id == quiz.quiz_id).values(questions_version=Quiz.questions_version + 1))
+    assert get_answer_key(quiz.quiz_id).get(question.question_id).correct_answer == "D"
+    assert get_answer_key(other_quiz.quiz_id) is other_key
+
 # --- Tests for Quiz Taking (User) ---
 
 def test_full_quiz_workflow(client, session, admin_user, regular_user_token, sample_quiz):
@@ -214,6 +326,188 @@ def test_full_quiz_workflow(client, session, admin_user, regular_user_token, sam
     assert attempt.completed_at is not None
     assert attempt.score_earned == 10
 
+def test_sync_autosave_upserts_without_looking_up_the_answer(client, session, count_queries, admin_user, regular_user_token, sample_quiz):
+    """
+    GIVEN a started quiz in the default sync autosave mode
+    WHEN the same question is saved twice
+    THEN check that each save is one upsert with no lookup, leaving a single row with the last answer
+    """
+    lesson, module, topic, quiz = sample_quiz
+    admin, _ = admin_user
+    quiz.is_visible = True
+    question = Question(quiz_id=quiz.quiz_id, created_by_admin_id=admin.user_id, question_text="Q", option1="A", option2="B", option3="C", option4="D", correct_answer="A")
+    session.add(question)
+    session.flush()
+
+    headers = {'Authorization': f'Bearer {regular_user_token}'}
+    attempt_token = client.post('/api/start_quiz', headers=headers, data=json.dumps({'quiz_id': quiz.quiz_id}),
+                                content_type='application/json').get_json()['quiz_attempt_access_token']
+    with count_queries(r'(?s)^\s*SELECT\b.*\bquestion_attempts\b') as lookups:
+        for selected in ['B', 'A']:
+            response = client.post('/api/save_answer', headers=headers, data=json.dumps({'quiz_attempt_access_token': attempt_token,
+                                   'question_id': question.question_id, 'selected_answer': selected}), content_type='application/json')
+            assert response.status_code == 200
+    assert lookups == []
+
+    attempt = QuizAttempt.query.filter_by(quiz_attempt_access_token=attempt_token).one()
+    answers = [(qa.selected_answer, qa.is_correct) for qa in QuestionAttempt.query.filter_by(attempt_id=attempt.attempt_id)]
+    assert answers == [('A', True)]
+
+def test_evaluate_quiz_uses_constant_number_of_question_queries(app, client, session, count_queries, admin_user, regular_user_token, sample_quiz):
+    """
+    GIVEN a six-question quiz where half of the answers were saved beforehand
+    WHEN the quiz is evaluated
+    THEN check that answers are upserted correctly with a fixed number of question statements
+    """
+    lesson, module, topic, quiz = sample_quiz
+    admin, _ = admin_user
+    quiz.is_visible = True
+    questions = [Question(quiz_id=quiz.quiz_id, created_by_admin_id=admin.user_id, question_text=f"Q{i}",
+                          option1="A", option2="B", option3="C", option4="D", correct_answer="A", score_points=1)
+                 for i in range(6)]
+    session.add_all(questions)
+    session.flush()
+
+    headers = {'Authorization': f'Bearer {regular_user_token}'}
+    attempt_token = client.post('/api/start_quiz', headers=headers, data=json.dumps({'quiz_id': quiz.quiz_id}),
+                                content_type='application/json').get_json()['quiz_attempt_access_token']
+    for question in questions[:3]:
+        client.post('/api/save_answer', headers=headers, data=json.dumps({'quiz_attempt_access_token': attempt_token,
+                    'question_id': question.question_id, 'selected_answer': 'B'}), content_type='application/json')
+
+    eval_payload = {
+        'quiz_attempt_access_token': attempt_token,
+        'responses': [{'question_id': q.question_id, 'selected_option': 'A' if i % 2 == 0 else 'C'} for i, q in enumerate(questions)]
+    }
+    with count_queries(r'\b(questions|question_attempts)\b') as statements:
+        eval_response = client.post('/api/evaluate_quiz', headers=headers, data=json.dumps(eval_payload), content_type='application/json')
+
+    assert eval_response.status_code == 200
+    assert eval_response.get_json()['score'] == 3
+    assert len(statements) <= 4
+
+    attempt = QuizAttempt.query.filter_by(quiz_attempt_access_token=attempt_token).one()
+    answers = {qa.question_id: (qa.selected_answer, qa.is_correct)
+               for qa in QuestionAttempt.query.filter_by(attempt_id=attempt.attempt_id).populate_existing()}
+    assert len(answers) == 6
+    assert answers[questions[0].question_id] == ('A', True)
+    assert answers[questions[1].question_id] == ('C', False)
+
+def test_buffered_autosave_coalesces_answers_until_evaluation(app, client, session, monkeypatch, admin_user, regular_user_token, sample_quiz):
+    """
+    GIVEN buffered autosave mode with a long flush interval
+    WHEN a user clicks several options and then submits only some responses
+    THEN check that answers are held in memory, coalesced, shown in quiz details and written at evaluation
+    """
+    monkeypatch.setitem(app.config, 'ANSWER_SAVE_MODE', 'buffered')
+    monkeypatch.setitem(app.config, 'ANSWER_BUFFER_FLUSH_INTERVAL', 3600)
+    lesson, module, topic, quiz = sample_quiz
+    admin, _ = admin_user
+    quiz.is_visible = True
+    q1 = Question(quiz_id=quiz.quiz_id, created_by_admin_id=admin.user_id, question_text="Q1", option1="A", option2="B", option3="C", option4="D", correct_answer="A", score_points=10)
+    q2 = Question(quiz_id=quiz.quiz_id, created_by_admin_id=admin.user_id, question_text="Q2", option1="X", option2="Y", option3="Z", option4="W", correct_answer="Y", score_points=5)
+    session.add_all([q1, q2])
+    session.flush()
+
+    headers = {'Authorization': f'Bearer {regular_user_token}'}
+    attempt_token = client.post('/api/start_quiz', headers=headers, data=json.dumps({'quiz_id': quiz.quiz_id}),
+                                content_type='application/json').get_json()['quiz_attempt_access_token']
+    for selected in ['B', 'C', 'A']:
+        response = client.post('/api/save_answer', headers=headers, data=json.dumps({'quiz_attempt_access_token': attempt_token,
+                               'question_id': q1.question_id, 'selected_answer': selected}), content_type='application/json')
+        assert response.status_code == 200
+
+    attempt = QuizAttempt.query.filter_by(quiz_attempt_access_token=attempt_token).one()
+    assert QuestionAttempt.query.filter_by(attempt_id=attempt.attempt_id).count() == 0
+
+    details = client.get(f'/api/quiz_details/{attempt_token}', headers=headers).get_json()
+    selected_answers = {q['question_id']: q['selected_answer'] for q in details['questions']}
+    assert selected_answers == {q1.question_id: 'A', q2.question_id: None}
+
+    eval_payload = {'quiz_attempt_access_token': attempt_token, 'responses': [{'question_id': q2.question_id, 'selected_option': 'Y'}]}
+    eval_response = client.post('/api/evaluate_quiz', headers=headers, data=json.dumps(eval_payload), content_type='application/json')
+    assert eval_response.status_code == 200
+
+    answers = {qa.question_id: qa.selected_answer for qa in QuestionAttempt.query.filter_by(attempt_id=attempt.attempt_id)}
+    assert answers == {q1.question_id: 'A', q2.question_id: 'Y'}
+
+    # A late autosave for the submitted attempt is dropped instead of overwriting the graded answer
+    answer_buffer.add(attempt.attempt_id, attempt.user_id, q1.question_id, 'B', False, get_current_ist())
+    assert answer_buffer.flush() == 0
+    # Writing an answer again replaces the row rather than adding a second one
+    write_question_attempts([{'attempt_id': attempt.attempt_id, 'user_id': attempt.user_id, 'question_id': q2.question_id,
+                              'selected_answer': 'Y', 'is_correct': True, 'attempted_at': get_current_ist()}])
+    answers = [(qa.question_id, qa.selected_answer) for qa in
+               QuestionAttempt.query.filter_by(attempt_id=attempt.attempt_id).populate_existing()]
+    assert sorted(answers) == sorted([(q1.question_id, 'A'), (q2.question_id, 'Y')])
+
+def test_flush_racing_evaluation_does_not_change_graded_answers(app, client, session, monkeypatch, admin_user, regular_user_token, sample_quiz):
+    """
+    GIVEN buffered autosaves, one flushed and one taken by the flusher but not yet written
+    WHEN the quiz is evaluated before the flusher writes it
+    THEN check that the flusher writes nothing and the graded answers stay as submitted
+    """
+    monkeypatch.setitem(app.config, 'ANSWER_SAVE_MODE', 'buffered')
+    monkeypatch.setitem(app.config, 'ANSWER_BUFFER_FLUSH_INTERVAL', 3600)
+    lesson, module, topic, quiz = sample_quiz
+    admin, _ = admin_user
+    quiz.is_visible = True
+    q1 = Question(quiz_id=quiz.quiz_id, created_by_admin_id=admin.user_id, question_text="Q1", option1="A", option2="B", option3="C", option4="D", correct_answer="A", score_points=10)
+    q2 = Question(quiz_id=quiz.quiz_id, created_by_admin_id=admin.user_id, question_text="Q2", option1="X", option2="Y", option3="Z", option4="W", correct_answer="Y", score_points=5)
+    session.add_all([q1, q2])
+    session.flush()
+
+    headers = {'Authorization': f'Bearer {regular_user_token}'}
+    attempt_token = client.post('/api/start_quiz', headers=headers, data=json.dumps({'quiz_id': quiz.quiz_id}),
+                                content_type='application/json').get_json()['quiz_attempt_access_token']
+    for question, selected in [(q2, 'X'), (q1, 'A')]:
+        response = client.post('/api/save_answer', headers=headers, data=json.dumps({'quiz_attempt_access_token': attempt_token,
+                               'question_id': question.question_id, 'selected_answer': selected}), content_type='application/json')
+        assert response.status_code == 200
+        if question is q2:
+            # While the attempt is open the flush writes the answer
+            assert answer_buffer.flush() == 1
+
+    # The flusher has taken the pending answer; evaluation commits just before it writes
+    def evaluate_then_write(entries, **kwargs):
+        eval_payload = {'quiz_attempt_access_token': attempt_token, 'responses': [{'question_id': q2.question_id, 'selected_option': 'Y'}]}
+        eval_response = client.post('/api/evaluate_quiz', headers=headers, data=json.dumps(eval_payload), content_type='application/json')
+        assert eval_response.get_json()['score'] == 5
+        return write_question_attempts(entries, **kwargs)
+    monkeypatch.setattr('answer_buffer.write_question_attempts', evaluate_then_write)
+
+    assert answer_buffer.flush() == 0
+    attempt = QuizAttempt.query.filter_by(quiz_attempt_access_token=attempt_token).one()
+    answers = {qa.question_id: qa.selected_answer for qa in QuestionAttempt.query.filter_by(attempt_id=attempt.attempt_id)}
+    assert answers == {q2.question_id: 'Y'}
+
+def test_attempt_tokens_are_unique_and_cached(client, session, count_queries, admin_user, regular_user_token, sample_quiz):
+    """
+    GIVEN a user who starts the same quiz twice in quick succession
+    WHEN the attempts are looked up by access token repeatedly
+    THEN check that the tokens differ and only the first lookup searches by token
+    """
+    lesson, module, topic, quiz = sample_quiz
+    admin, _ = admin_user
+    quiz.is_visible = True
+    session.add(Question(quiz_id=quiz.quiz_id, created_by_admin_id=admin.user_id, question_text="Q", option1="A", option2="B", option3="C", option4="D", correct_answer="A"))
+    session.flush()
+
+    headers = {'Authorization': f'Bearer {regular_user_token}'}
+    tokens = [client.post('/api/start_quiz', headers=headers, data=json.dumps({'quiz_id': quiz.quiz_id}),
+                          content_type='application/json').get_json()['quiz_attempt_access_token'] for _ in range(2)]
+    assert tokens[0] != tokens[1]
+
+    with count_queries(r'WHERE quiz_attempts\.quiz_attempt_access_token') as token_lookups:
+        for _ in range(3):
+            assert client.get(f'/api/quiz_details/{tokens[0]}', headers=headers).status_code == 200
+    assert len(token_lookups) == 1
+
+    for token in tokens:
+        session.delete(QuizAttempt.query.filter_by(quiz_attempt_access_token=token).one())
+    session.commit()
+    assert client.get(f'/api/quiz_details/{tokens[0]}', headers=headers).status_code == 500
+
 def test_user_cannot_start_invisible_quiz(client, session, regular_user_token, sample_quiz):
     """
     GIVEN a quiz that is not visible
@@ -229,3 +523,58 @@ def test_user_cannot_start_invisible_quiz(client, session, regular_user_token, s
     start_response = client.post('/api/start_quiz', headers=headers, data=json.dumps({'quiz_id': quiz.quiz_id}), content_type='application/json')
     # The app's generic exception handler turns the 403 abort into a 500
     assert start_response.status_code == 500
+
+# --- Tests for Content Path Resolution ---
+
+def test_cached_path_is_invalidated_when_quiz_is_deleted(client, admin_user_token, sample_quiz):
+    """
+    GIVEN a quiz path that has already been validated and cached
+    WHEN an admin deletes the quiz
+    THEN check that the next request on that path no longer succeeds
+    """
+    lesson, module, topic, quiz = sample_quiz
+    headers = {'Authorization': f'Bearer {admin_user_token}'}
+    base_url = f'/api/{lesson.lesson_id}/module/{module.module_id}/topic/{topic.topic_id}/quizzes/{quiz.quiz_id}'
+
+    assert client.get(f'{base_url}/questions', headers=headers).status_code == 200
+    assert client.delete(f'{base_url}/delete', headers=headers).status_code == 200
+
+    # The app's generic exception handler turns the 404 abort into a 500
+    assert client.get(f'{base_url}/questions', headers=headers).status_code == 500
+
+def test_resolve_content_path_reports_first_missing_level(app, sample_quiz):
+    """
+    GIVEN a valid lesson and module but a topic id that does not belong to them
+    WHEN the path is resolved
+    THEN check that a 404 naming the topic is raised
+    """
+    from werkzeug.exceptions import NotFound
+    from content_cache import resolve_content_path
+    lesson, module, topic, quiz = sample_quiz
+
+    with app.test_request_context():
+        resolve_content_path(lesson.lesson_id, module.module_id, topic.topic_id, quiz.quiz_id)
+        with pytest.raises(NotFound) as excinfo:
+            resolve_content_path(lesson.lesson_id, module.module_id, topic.topic_id + 1000)
+    assert excinfo.value.data['message'] == 'Topic not found'
+
+def test_path_cached_between_flush_and_commit_is_dropped_on_commit(app, session, sample_quiz):
+    """
+    GIVEN a quiz deleted and flushed but not yet committed
+    WHEN another request caches the quiz's path before the commit
+    THEN check that the commit drops the path again, so it is no longer resolved
+    """
+    from werkzeug.exceptions import NotFound
+    from content_cache import resolve_content_path, _path_cache
+    lesson, module, topic, quiz = sample_quiz
+    key = (lesson.lesson_id, module.module_id, topic.topic_id, quiz.quiz_id)
+
+    quiz.deleted_at = get_current_ist()
+    session.flush()
+    _path_cache.set(key, True)
+    session.commit()
+
+    assert _path_cache.get(key) is None
+    with app.test_request_context():
+        with pytest.raises(NotFound):
+            resolve_content_path(*key)
@@ -2,10 +2,16 @@ import json
 import pytest
 import csv
 import io
-from model import db, User, UserProfile, UserSession, Quiz, QuizAttempt, Module, Topic, UserModuleProgress, ChatbotMessage, Lesson
+import os
+from model import db, User, UserProfile, UserSession, Quiz, QuizAttempt, Module, Topic, UserModuleProgress, ChatbotMessage, Lesson, UserActivitySummary, Transaction, ExportJob
 from werkzeug.security import generate_password_hash
+from sqlalchemy import func
+from activity_rollup import get_activity_totals, refresh_user_summary
+from api_utils import get_current_ist
 from datetime import datetime, timedelta
 import uuid
+import gzip
+import zipfile
 
 # --- Fixtures for Users, Tokens, and Test Data ---
 
@@ -75,9 +81,46 @@ def test_get_admin_dashboard_summary_success(client, session, admin_user_token,
     data = response.get_json()
     assert data['total_users'] >= 1
     assert data['daily_active_users'] >= 0
-    assert data['avg_session_duration'] == "16 Min"
-    assert data['avg_quiz_score'] == "45.0%"
-    assert data['avg_quiz_time'] == "1 Min"
+    assert data['avg_session_duration'] == "10 Min"
+    assert data['avg_quiz_score'] == "80.0%"
+    assert data['avg_quiz_time'] == "2 Min"
+
+def test_activity_rollups_follow_session_and_attempt_writes(session, premium_user):
+    """
+    GIVEN the daily activity rollups
+    WHEN sessions and quiz attempts are inserted, updated and deleted
+    THEN check that the rollup totals always match aggregates over the raw tables
+    """
+    def assert_rollups_match():
+        session.flush()
+        totals = get_activity_totals()
+        sessions = session.query(func.count(UserSession.session_duration_seconds), func.coalesce(func.sum(UserSession.session_duration_seconds), 0)).one()
+        attempts = session.query(func.count(QuizAttempt.attempt_id), func.coalesce(func.sum(QuizAttempt.score_earned), 0), func.coalesce(func.sum(QuizAttempt.time_taken_seconds), 0)).one()
+        assert (totals.completed_sessions, totals.session_duration_total) == tuple(sessions)
+        assert (totals.quiz_attempts, totals.quiz_score_total, totals.quiz_time_total) == pytest.approx(tuple(attempts))
+
+    user, _ = premium_user
+    quiz = Quiz(quiz_title="Rollup Quiz", created_by_admin_id=1, duration_minutes=10)
+    session.add(quiz)
+    session.flush()
+
+    user_session = UserSession(user_id=user.user_id, session_token='rollup_session', login_at=datetime.now())
+    attempt = QuizAttempt(user_id=user.user_id, quiz_id=quiz.quiz_id, score_earned=0.0)
+    session.add_all([user_session, attempt])
+    assert_rollups_match()
+
+    user_session.session_duration_seconds = 900
+    attempt.score_earned = 70.0
+    attempt.time_taken_seconds = 300
+    assert_rollups_match()
+
+    session.expire(attempt)
+    attempt.score_earned = 90.0
+    assert_rollups_match()
+
+    session.delete(attempt)
+    session.delete(user_session)
+    assert_rollups_match()
 
 def test_get_admin_dashboard_summary_forbidden(client, premium_user_token):
     """
@@ -122,6 +165,36 @@ def test_get_user_summary_success(client, session, premium_user, premium_user_to
 
 # --- Tests for Parental Verification ---
 
+def test_user_summary_streak_and_stored_summary(client, session, premium_user, premium_user_token):
+    """
+    GIVEN a user with sessions on several days, the last three of them consecutive
+    WHEN the user summary is requested before and after the stored summary is refreshed
+    THEN check that both report the same streak, daily average and quiz stats
+    """
+    user, _ = premium_user
+    access_token, _, _ = premium_user_token
+    now = get_current_ist()
+    for days_ago, duration in [(0, 600), (0, 600), (1, 1200), (2, 1200), (5, 1200)]:
+        session.add(UserSession(user_id=user.user_id, session_token=f'streak_{days_ago}_{uuid.uuid4().hex[:8]}', login_at=now - timedelta(days=days_ago), session_duration_seconds=duration))
+    quiz = Quiz(quiz_title="Streak Quiz", created_by_admin_id=1, duration_minutes=10)
+    session.add(quiz)
+    session.flush()
+    session.add(QuizAttempt(user_id=user.user_id, quiz_id=quiz.quiz_id, score_earned=80.0, time_taken_seconds=120))
+    session.flush()
+
+    headers = {'Authorization': f'Bearer {access_token}'}
+    for refreshed in (False, True):
+        if refreshed:
+            refresh_user_summary(user.user_id)
+            session.flush()
+            assert UserActivitySummary.query.get(user.user_id).streak_days == 3
+
+        response = client.get('/api/user-summary', headers=headers)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['overall'] == {'dailyAverage': 20, 'streak': 3}
+        assert data['quiz'] == {'attempted': 1, 'averageScore': 80.0, 'totalTime': 2}
+
 def test_verify_parent_password_success_and_failure(client, session, premium_user, premium_user_token):
     """
     GIVEN a user with a parent password set
@@ -181,6 +254,169 @@ def test_get_analytics_report_success(client, session, premium_user, premium_use
     assert rows[5][1] == "Analytics Report Quiz"
     assert rows[5][2] == "95.0"
 
+def test_analytics_report_streams_one_query_per_section(client, session, count_queries, premium_user, premium_user_token):
+    """
+    GIVEN a premium user with several quiz attempts and completed topics
+    WHEN they request an 'analytics' report
+    THEN check that the CSV is streamed with titles joined in by a single query per section
+    """
+    user, _ = premium_user
+    access_token, _, _ = premium_user_token
+    lesson = Lesson(lesson_name="Streamed Lesson")
+    module = Module(lesson=lesson, module_title="Streamed Module", created_by_admin_id=1)
+    topics = [Topic(module=module, topic_title=f"Streamed Topic {i}", created_by_admin_id=1) for i in range(3)]
+    quiz = Quiz(quiz_title="Streamed Quiz", created_by_admin_id=1, duration_minutes=5)
+    session.add_all([lesson, module, quiz] + topics)
+    session.flush()
+    for i, topic in enumerate(topics):
+        session.add(UserModuleProgress(user_id=user.user_id, module_id=module.module_id, topic_id=topic.topic_id, progress_percentage=100, completed_at=get_current_ist()))
+        session.add(QuizAttempt(user_id=user.user_id, quiz_id=quiz.quiz_id, score_earned=60.0 + i, time_taken_seconds=100, completed_at=get_current_ist()))
+    session.flush()
+
+    with count_queries() as statements:
+        response = client.get('/api/user-reports/analytics?period=all', headers={'Authorization': f'Bearer {access_token}'})
+        assert response.is_streamed
+        rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+
+    assert [row[1] for row in rows[5:8]] == ["Streamed Quiz"] * 3
+    assert [row[:2] for row in rows[11:14]] == [[f"Streamed Topic {i}", "Streamed Module"] for i in range(3)]
+    assert len([sql for sql in statements if 'FROM quiz_attempts' in sql]) == 1
+    assert len([sql for sql in statements if 'FROM user_module_progress' in sql]) == 1
+    assert not [sql for sql in statements if sql.lstrip().startswith('SELECT') and 'FROM quizzes' in sql]
+
+def test_report_export_job_completes_and_downloads(client, session, premium_user, premium_user_token):
+    """
+    GIVEN a premium user with completed topics
+    WHEN they start an analytics export, poll it and download it
+    THEN check that the job completes and serves the report as a CSV attachment
+    """
+    user, _ = premium_user
+    access_token, _, _ = premium_user_token
+    lesson = Lesson(lesson_name="Export Lesson")
+    module = Module(lesson=lesson, module_title="Export Module", created_by_admin_id=1)
+    topic = Topic(module=module, topic_title="Export Topic", created_by_admin_id=1)
+    session.add_all([lesson, module, topic])
+    session.flush()
+    session.add(UserModuleProgress(user_id=user.user_id, module_id=module.module_id, topic_id=topic.topic_id, progress_percentage=100, completed_at=get_current_ist()))
+    session.flush()
+    headers = {'Authorization': f'Bearer {access_token}'}
+
+    response = client.post('/api/user-reports/analytics/export?period=all', headers=headers)
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+
+    status = client.get(f'/api/exports/{job_id}', headers=headers).get_json()
+    assert status['status'] == 'completed'
+    assert status['rows_written'] == 1
+    assert status['expires_at'] is not None
+
+    download = client.get(f'/api/exports/{job_id}/download', headers=headers)
+    assert download.status_code == 200
+    assert download.headers['Content-Type'].startswith('text/csv')
+    assert 'analytics_report_all.csv' in download.headers['Content-Disposition']
+    rows = list(csv.reader(io.StringIO(download.get_data(as_text=True))))
+    assert ['Export Topic', 'Export Module'] in [row[:2] for row in rows]
+
+def test_stalled_export_jobs_are_failed_and_later_purged(client, session, premium_user, premium_user_token):
+    """
+    GIVEN a job left running by a worker that went away, with a partial file, and a job queued just now
+    WHEN the stalled job is polled and exports are later purged
+    THEN check that only the stalled job is failed, its partial file removed, and it expires like other jobs
+    """
+    from export_jobs import get_export_dir, purge_expired_exports
+    user, _ = premium_user
+    access_token, _, _ = premium_user_token
+    now = get_current_ist().replace(tzinfo=None)
+    stalled = ExportJob(requested_by=user.user_id, report_type='analytics', period='all', status='running',
+                        created_at=now - timedelta(hours=3), started_at=now - timedelta(hours=2))
+    fresh = ExportJob(requested_by=user.user_id, report_type='analytics', period='all', created_at=now)
+    session.add_all([stalled, fresh])
+    session.flush()
+    partial_path = os.path.join(get_export_dir(), f'export_{stalled.job_id}_partial.csv')
+    with open(partial_path, 'w') as partial:
+        partial.write('Report,')
+
+    status = client.get(f'/api/exports/{stalled.job_id}', headers={'Authorization': f'Bearer {access_token}'}).get_json()
+    assert status['status'] == 'failed'
+    assert status['expires_at'] is not None
+    assert not os.path.exists(partial_path)
+    assert fresh.status == 'queued'
+
+    stalled.expires_at = now - timedelta(minutes=1)
+    session.flush()
+    assert purge_expired_exports() == 1
+    assert ExportJob.query.get(stalled.job_id) is None
+
+def test_admin_export_covers_all_users_and_is_owner_only(client, session, premium_user, premium_user_token, admin_user_token):
+    """
+    GIVEN chat messages from a user
+    WHEN an admin exports a compressed chatbot report for all users
+    THEN check that the gzip file has user columns and that other users cannot see the job
+    """
+    user, _ = premium_user
+    access_token, user_id, session_id = premium_user_token
+    session.add(ChatbotMessage(user_id=user_id, session_id=session_id, message_type='user', message_content='Exported hello'))
+    session.flush()
+    admin_headers = {'Authorization': f'Bearer {admin_user_token}'}
+
+    assert client.post('/api/admin/user-reports/chatbot/export', headers={'Authorization': f'Bearer {access_token}'}).status_code == 403
+    response = client.post('/api/admin/user-reports/chatbot/export?period=all&compress=true', headers=admin_headers)
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+
+    assert client.get(f'/api/exports/{job_id}', headers={'Authorization': f'Bearer {access_token}'}).status_code == 404
+    download = client.get(f'/api/exports/{job_id}/download', headers=admin_headers)
+    assert download.status_code == 200
+    assert download.headers['Content-Type'] == 'application/gzip'
+    rows = list(csv.reader(io.StringIO(gzip.decompress(download.get_data()).decode('utf-8'))))
+    assert rows[4] == ['User ID', 'Username', 'Timestamp', 'Sender', 'Message']
+    assert [str(user_id), user.username] in [row[:2] for row in rows if row[-1:] == ['Exported hello']]
+
+def test_engagement_export_requires_admin(client, premium_user_token):
+    """
+    GIVEN a non-admin user
+    WHEN they request the Parquet engagement export
+    THEN check that a 403 Forbidden is returned
+    """
+    access_token, _, _ = premium_user_token
+    response = client.post('/api/admin/engagement-export', headers={'Authorization': f'Bearer {access_token}'})
+    assert response.status_code == 403
+
+def test_engagement_export_writes_date_partitioned_parquet(client, session, tmp_path, premium_user, premium_user_token, admin_user_token):
+    """
+    GIVEN chat messages and transactions on known days
+    WHEN an admin runs the Parquet engagement export
+    THEN check that the zip holds one dataset per table, partitioned by date, without token columns
+    """
+    pq = pytest.importorskip('pyarrow.parquet')
+    user, _ = premium_user
+    _, user_id, session_id = premium_user_token
+    session.add(ChatbotMessage(user_id=user_id, session_id=session_id, message_type='user', message_content='Columnar hello', sent_at=datetime(2024, 3, 1, 10, 0)))
+    session.add(Transaction(user_id=user_id, transaction_type='expense', transaction_date=datetime(2024, 3, 2).date(), transaction_name='Columnar lunch', amount=12.5))
+    session.flush()
+    admin_headers = {'Authorization': f'Bearer {admin_user_token}'}
+
+    response = client.post('/api/admin/engagement-export?period=all', headers=admin_headers)
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job['status'] == 'completed' and job['file_format'] == 'parquet'
+
+    download = client.get(f"/api/exports/{job['job_id']}/download", headers=admin_headers)
+    assert download.status_code == 200
+    assert download.headers['Content-Type'] == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(download.get_data())) as archive:
+        names = archive.namelist()
+        archive.extractall(tmp_path)
+
+    assert 'chatbot_messages/date=2024-03-01/part-0.parquet' in names
+    assert 'transactions/date=2024-03-02/part-0.parquet' in names
+    assert {name.split('/')[0] for name in names} <= {'quiz_attempts', 'question_attempts', 'user_sessions', 'chatbot_messages', 'transactions'}
+    messages = pq.read_table(tmp_path / 'chatbot_messages' / 'date=2024-03-01').to_pylist()
+    assert [row['message_content'] for row in messages if row['user_id'] == user_id] == ['Columnar hello']
+    sessions = pq.read_table(tmp_path / 'user_sessions')
+    assert 'session_token' not in sessions.column_names
+    assert user_id in sessions.column('user_id').to_pylist()
+
 def test_get_chatbot_report_success(client, session, premium_user, premium_user_token):
     """
     GIVEN a premium user with a parent email and chat history
@@ -6,6 +6,9 @@ from werkzeug.security import generate_password_hash
 from datetime import datetime
 import uuid
 import io
+import hashlib
+from blob_store import get_blob_store, sweep_unreferenced_blobs
+from setup_db import migrate_topic_content_to_blob_store
 
 # --- Fixtures for Users, Tokens, and Learning Structure ---
 
@@ -116,6 +119,38 @@ def test_update_topic_success(client, session, admin_user_token, admin_user, sam
     assert response.status_code == 200
     assert response.get_json()['topic_title'] == 'New Title'
 
+def test_topic_metadata_endpoints_do_not_load_pdf_blob(client, session, admin_user_token, regular_user_token, admin_user, sample_lesson_module):
+    """
+    GIVEN a topic whose PDF is stored in the database with its size recorded
+    WHEN the topic is updated, fetched and listed
+    THEN check that has_content/has_pdf are reported without loading topic_content
+    """
+    lesson, module = sample_lesson_module
+    admin, _ = admin_user
+    pdf_content = b'%PDF-1.5 ' + b'\x00\xff' * 64
+    topic = Topic(module_id=module.module_id, created_by_admin_id=admin.user_id, topic_title='Heavy Topic',
+                  topic_content=pdf_content, content_size=len(pdf_content))
+    session.add(topic)
+    session.flush()
+    session.expire(topic)
+
+    base_url = f'/api/{lesson.lesson_id}/module/{module.module_id}/topic/{topic.topic_id}'
+    update_response = client.put(f'{base_url}/update', headers={'Authorization': f'Bearer {admin_user_token}'},
+                                 data=json.dumps({'topic_title': 'Still Heavy'}), content_type='application/json')
+    assert update_response.status_code == 200
+    assert update_response.get_json()['has_content'] is True
+
+    user_headers = {'Authorization': f'Bearer {regular_user_token}'}
+    detail_response = client.get(f'/api/lesson/{lesson.lesson_id}/module/{module.module_id}/topic/{topic.topic_id}', headers=user_headers)
+    assert detail_response.status_code == 200
+    assert detail_response.get_json()['has_pdf'] is True
+
+    list_response = client.get(f'/api/{lesson.lesson_id}/module/{module.module_id}/topics', headers=user_headers)
+    assert list_response.status_code == 200
+    assert any(t['topic_id'] == topic.topic_id and t['has_content'] for t in list_response.get_json())
+
+    assert 'topic_content' not in topic.__dict__
+
 def test_delete_topic_success(client, session, admin_user_token, admin_user, sample_lesson_module):
     """
     GIVEN an existing topic
@@ -167,6 +202,128 @@ def test_upload_and_download_content_success(mock_magic, client, session, admin_
     assert download_response.data == pdf_content
     assert download_response.mimetype == 'application/pdf'
 
+def test_download_content_streams_in_chunks_and_honours_ranges(client, app, session, monkeypatch, regular_user_token, admin_user, sample_lesson_module):
+    """
+    GIVEN a topic whose PDF is still stored in the database and a small streaming chunk size
+    WHEN the content is downloaded in full and with a byte range
+    THEN check that the full body, a 206 partial body and a 416 are returned correctly
+    """
+    monkeypatch.setitem(app.config, 'TOPIC_CONTENT_CHUNK_SIZE', 4)
+    lesson, module = sample_lesson_module
+    admin, _ = admin_user
+    pdf_content = b'%PDF-1.5 streamed pdf content'
+    topic = Topic(module_id=module.module_id, created_by_admin_id=admin.user_id, topic_title='Streamed Topic', topic_content=pdf_content)
+    session.add(topic)
+    session.flush()
+
+    base_url = f'/api/{lesson.lesson_id}/module/{module.module_id}/topic/{topic.topic_id}'
+    user_headers = {'Authorization': f'Bearer {regular_user_token}'}
+    full_response = client.get(f'{base_url}/download_content', headers=user_headers)
+    assert full_response.status_code == 200
+    assert full_response.data == pdf_content
+    assert full_response.headers['Accept-Ranges'] == 'bytes'
+
+    partial_response = client.get(f'{base_url}/download_content', headers={**user_headers, 'Range': 'bytes=5-14'})
+    assert partial_response.status_code == 206
+    assert partial_response.data == pdf_content[5:15]
+    assert partial_response.headers['Content-Range'] == f'bytes 5-14/{len(pdf_content)}'
+
+    unsatisfiable_response = client.get(f'{base_url}/download_content', headers={**user_headers, 'Range': 'bytes=1000-'})
+    assert unsatisfiable_response.status_code == 416
+
+@patch('routes.topic.magic.Magic')
+def test_uploaded_content_is_deduplicated_and_served_with_etag(mock_magic, client, session, admin_user_token, regular_user_token, admin_user, sample_lesson_module):
+    """
+    GIVEN two topics that receive the same PDF upload
+    WHEN the content is downloaded and then requested again with If-None-Match
+    THEN check that both topics share one blob, the digest is the ETag and a 304 is returned
+    """
+    mock_magic.return_value.from_buffer.return_value = 'application/pdf'
+    lesson, module = sample_lesson_module
+    admin, _ = admin_user
+    first = Topic(module_id=module.module_id, created_by_admin_id=admin.user_id, topic_title='First Copy')
+    second = Topic(module_id=module.module_id, created_by_admin_id=admin.user_id, topic_title='Second Copy')
+    session.add_all([first, second])
+    session.flush()
+
+    pdf_content = b'%PDF-1.5 shared pdf content'
+    admin_headers = {'Authorization': f'Bearer {admin_user_token}'}
+    for topic in (first, second):
+        response = client.post(f'/api/{lesson.lesson_id}/module/{module.module_id}/topic/{topic.topic_id}/upload_content',
+                               headers=admin_headers, data={'content_file': (io.BytesIO(pdf_content), 'test.pdf')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 200
+
+    assert first.content_digest == second.content_digest == hashlib.sha256(pdf_content).hexdigest()
+    assert first.content_size == len(pdf_content)
+    assert first.topic_content is None
+
+    download_url = f'/api/{lesson.lesson_id}/module/{module.module_id}/topic/{first.topic_id}/download_content'
+    user_headers = {'Authorization': f'Bearer {regular_user_token}'}
+    response = client.get(download_url, headers=user_headers)
+    assert response.status_code == 200
+    assert response.data == pdf_content
+    assert response.headers['ETag'] == f'"{first.content_digest}"'
+
+    cached_response = client.get(download_url, headers={**user_headers, 'If-None-Match': response.headers['ETag']})
+    assert cached_response.status_code == 304
+
+    # Blobs live on disk, outside the test's transaction
+    get_blob_store().delete(first.content_digest)
+
+def test_blob_migration_moves_only_pdf_topics(client, session, regular_user_token, admin_user, sample_lesson_module):
+    """
+    GIVEN one topic with legacy PDF content and one with legacy text content
+    WHEN the in-database content is migrated to the blob store
+    THEN check that only the PDF moves and the text topic is still served as text
+    """
+    lesson, module = sample_lesson_module
+    admin, _ = admin_user
+    pdf_content = b'%PDF-1.5 migrated pdf content'
+    pdf_topic = Topic(module_id=module.module_id, created_by_admin_id=admin.user_id, topic_title='Legacy PDF', topic_content=pdf_content)
+    text_topic = Topic(module_id=module.module_id, created_by_admin_id=admin.user_id, topic_title='Legacy Text', topic_content=b'Plain text lesson')
+    session.add_all([pdf_topic, text_topic])
+    session.flush()
+
+    migrate_topic_content_to_blob_store()
+
+    digest = hashlib.sha256(pdf_content).hexdigest()
+    assert pdf_topic.content_digest == digest
+    assert pdf_topic.content_mime_type == 'application/pdf'
+    assert pdf_topic.topic_content is None
+    assert text_topic.content_digest is None
+    assert text_topic.topic_content == b'Plain text lesson'
+
+    response = client.get(f'/api/lesson/{lesson.lesson_id}/module/{module.module_id}/topic/{text_topic.topic_id}',
+                          headers={'Authorization': f'Bearer {regular_user_token}'})
+    assert response.status_code == 200
+    assert response.get_json()['topic_content'] == 'Plain text lesson'
+
+    # Blobs live on disk, outside the test's transaction
+    get_blob_store().delete(digest)
+
+def test_sweep_deletes_only_unreferenced_settled_blobs(session, admin_user, sample_lesson_module):
+    """
+    GIVEN a blob a topic points at and one no topic references
+    WHEN unreferenced blobs are swept, first within and then past the grace period
+    THEN check that only the unreferenced blob is deleted, and only once it has settled
+    """
+    lesson, module = sample_lesson_module
+    admin, _ = admin_user
+    store = get_blob_store()
+    kept_digest, _ = store.put(io.BytesIO(b'%PDF-1.5 referenced blob'))
+    orphan_digest, _ = store.put(io.BytesIO(b'%PDF-1.5 orphaned blob'))
+    session.add(Topic(module_id=module.module_id, created_by_admin_id=admin.user_id, topic_title='Blob Owner', content_digest=kept_digest))
+    session.flush()
+
+    sweep_unreferenced_blobs(grace=3600)
+    assert store.exists(orphan_digest)
+
+    sweep_unreferenced_blobs(grace=-1)
+    assert store.exists(kept_digest)
+    assert not store.exists(orphan_digest)
+    store.delete(kept_digest)
+
 # --- Tests for User Progress ---
 
 def test_start_and_get_progress(client, regular_user_token, sample_lesson_module):
@@ -180,3 +180,27 @@ def test_get_user_premium_status(client, non_premium_user_token, premium_user_to
     response_prem = client.get('/api/user-premium-status', headers=headers_prem)
     assert response_prem.status_code == 200
     assert response_prem.get_json()['is_premium'] is True
+
+def test_user_without_profile_gets_404(client, session):
+    """
+    GIVEN a logged-in user who has no profile
+    WHEN their premium status and summary are requested
+    THEN check that both return 404, and that the status is served once a profile exists
+    """
+    password = "password123"
+    user = User(email=f"no_profile_{uuid.uuid4().hex[:8]}@example.com", username=f"no_profile_{uuid.uuid4().hex[:8]}", password_hash=generate_password_hash(password))
+    session.add(user)
+    session.flush()
+    response = client.post('/api/login', data=json.dumps({'username': user.username, 'password': password}), content_type='application/json')
+    headers = {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+    response = client.get('/api/user-premium-status', headers=headers)
+    assert response.status_code == 404
+    assert response.get_json()['message'] == 'User or profile not found'
+    assert client.get('/api/user-summary', headers=headers).status_code == 404
+
+    session.add(UserProfile(user_id=user.user_id, full_name="Late Profile", is_premium_user=False))
+    session.flush()
+    response = client.get('/api/user-premium-status', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['is_premium'] is False